@@ -3,6 +3,7 @@ import os
 
 from celery import Celery
 from celery.schedules import crontab
+from kombu import Exchange, Queue
 from django.conf import settings
 
 # Set the default Django settings module for the 'celery' program.
@@ -28,13 +29,78 @@ app.conf.update(timezone='Africa/Dar_es_Salaam')
 # Configure Celery using settings from Django settings.py.
 app.config_from_object(settings, namespace='CELERY')
 
+# Task routing: single (transactional) sends get their own queue so they
+# never wait behind the chunks of a bulk job. Run separate workers per queue
+# so each can be sized on its own, e.g.
+#   celery -A email_service worker -Q transactional -c 4 -n transactional@%h
+#   celery -A email_service worker -Q bulk,celery -c 16 -n bulk@%h
+TRANSACTIONAL_QUEUE = getattr(settings, 'EMAIL_TRANSACTIONAL_QUEUE', 'transactional')
+BULK_QUEUE = getattr(settings, 'EMAIL_BULK_QUEUE', 'bulk')
+USE_PRIORITIES = getattr(settings, 'EMAIL_TASK_PRIORITIES', False)
+
+
+def task_route(queue, priority):
+    """
+    Routes to `queue`, with a 0-9 priority (9 most urgent) when broker-side
+    priorities are enabled. Redis treats 0 as most urgent, so the value is
+    flipped for it.
+    """
+    if not USE_PRIORITIES:
+        return {'queue': queue}
+    if str(app.conf.broker_url or '').startswith(('redis', 'rediss', 'sentinel')):
+        priority = 9 - priority
+    return {'queue': queue, 'priority': priority}
+
+
+if not hasattr(settings, 'CELERY_TASK_ROUTES'):
+    app.conf.task_routes = {
+        'emails_app.tasks.send_email_task': task_route(TRANSACTIONAL_QUEUE, 9),
+        # Fan-out tasks go ahead of chunks so a new job starts promptly
+        'emails_app.tasks.send_bulk_email_task': task_route(BULK_QUEUE, 6),
+        'emails_app.tasks.send_recipient_list_task': task_route(BULK_QUEUE, 6),
+        'emails_app.tasks.send_email_chunk': task_route(BULK_QUEUE, 3),
+        'emails_app.tasks.send_templated_email_chunk': task_route(BULK_QUEUE, 3),
+    }
+
+if not hasattr(settings, 'CELERY_WORKER_PREFETCH_MULTIPLIER'):
+    # A worker serving several queues would otherwise reserve bulk chunks
+    # while transactional tasks wait for it
+    app.conf.worker_prefetch_multiplier = 1
+
+if USE_PRIORITIES:
+    # Broker-side priorities within each queue: x-max-priority on RabbitMQ,
+    # priority sub-queues on Redis. Off by default since existing RabbitMQ
+    # queues must be re-declared to gain a priority argument.
+    app.conf.task_queues = [
+        Queue(name, Exchange(name), routing_key=name,
+              queue_arguments={'x-max-priority': 10})
+        for name in ('celery', TRANSACTIONAL_QUEUE, BULK_QUEUE)
+    ]
+    app.conf.broker_transport_options = {
+        'priority_steps': list(range(10)),
+        'queue_order_strategy': 'priority',
+        **(getattr(settings, 'CELERY_BROKER_TRANSPORT_OPTIONS', None) or {}),
+    }
+
 # Celery Beat settings
 app.conf.beat_schedule = {
     'say-hello-every-day-at-8': {
         'task': 'emails_app.tasks.say_helo',
         'schedule': crontab(hour=21, minute=47),
         # 'args': (2)
-    }
+    },
+    'collect-attachment-garbage-hourly': {
+        'task': 'emails_app.tasks.collect_attachment_garbage_task',
+        'schedule': crontab(minute=15),
+    },
+    'archive-email-records-daily': {
+        'task': 'emails_app.tasks.archive_email_records_task',
+        'schedule': crontab(hour=2, minute=30),
+    },
+    'purge-idempotency-keys-hourly': {
+        'task': 'emails_app.tasks.purge_idempotency_keys_task',
+        'schedule': crontab(minute=45),
+    },
 }
 
 # Load tasks from all registered Django app configs.
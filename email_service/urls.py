@@ -18,16 +18,11 @@ from django.contrib import admin
 from django.urls import path, include
 from decouple import config
 
-from emails_app.utils import set_smtp_settings
-
 
 admin.site.site_header = f'NES ADMINISTRATION'
 admin.site.site_title = f"NES ADMINISTRATION"
 admin.site.index_title = 'Site Administration'
 
-
-set_smtp_settings()  # Call the function to set SMTP settings dynamically
-
 urlpatterns = [
     path(config('SECRET_ADMIN_URL') + '/admin/', admin.site.urls),
     path('api/', include('emails_app.urls')),
@@ -1,30 +1,47 @@
+import time
+
 from django.contrib import admin
 
-from emails_app.models import Client, EmailRecord, SMTPSettings
+from emails_app.models import BulkJob, Client, EmailRecord, EmailRecordArchive, SMTPSettings, SuppressedRecipient
+from emails_app.relay_health import get_relay_health
+from emails_app.relays import SMTPSettingsSnapshot
 from emails_app.utils import truncate_string
 
 
 @admin.register(SMTPSettings)
 class SMTPSettingsAdmin(admin.ModelAdmin):
-    list_display = ('host', 'port', 'username', 'use_tls', 'use_ssl')
+    list_display = ('host', 'port', 'username', 'use_tls', 'use_ssl',
+                    'weight', 'is_active', 'health')
     fieldsets = (
         (None, {
             'fields': ('host', 'username', 'password', 'default_from_email')
         }),
+        ('Load Balancing', {
+            'fields': ('is_active', 'weight', 'max_connections'),
+            'description': 'Sends are spread over the active relays by weight. Relays that keep failing are taken out of rotation for a while.'
+        }),
         ('Security', {
             'fields': ('use_tls', 'use_ssl'),
             'description': 'Configure security settings for the SMTP connection. The port will be set automatically.'
         }),
+        ('Rate Limits', {
+            'fields': ('send_rate', 'send_burst', 'max_recipients_per_message'),
+            'description': 'Keep sending just under the provider limits to avoid throttling.'
+        }),
     )
 
-    def has_add_permission(self, request):
-        # Only allow adding if there are no existing settings
-        return not SMTPSettings.objects.exists()
-
     def has_delete_permission(self, request, obj=None):
-        # Disable delete permission
+        # Disable delete permission; deactivate a relay instead
         return False
 
+    @admin.display(description='Health')
+    def health(self, obj):
+        health = get_relay_health(SMTPSettingsSnapshot(obj, obj.version))
+        if health['down_until'] > time.time():
+            return f"Out of rotation for {int(health['down_until'] - time.time())}s"
+        latency = f", {health['latency'] * 1000:.0f} ms/msg" if health['latency'] else ''
+        return f"{health['error_rate']:.0%} errors{latency}"
+
 
 @admin.register(Client)
 class ClientAdmin(admin.ModelAdmin):
@@ -57,3 +74,53 @@ class EmailRecordAdmin(admin.ModelAdmin):
     @admin.display(description='Recipient')
     def short_recipient(self, obj):
         return truncate_string(obj, field_name='recipient', max_length=150)
+
+
+@admin.register(BulkJob)
+class BulkJobAdmin(admin.ModelAdmin):
+    list_display = ('client', 'short_subject', 'status', 'total',
+                    'sent', 'failed', 'suppressed', 'created_at', 'completed_at',)
+    list_filter = ['status', 'client']
+    list_per_page = 50
+    readonly_fields = ('id', 'client', 'subject', 'status', 'total',
+                       'sent', 'failed', 'suppressed', 'created_at', 'completed_at')
+
+    def has_add_permission(self, request):
+        return False  # Disable add permission
+
+    def has_change_permission(self, request, obj=None):
+        return False  # Disable change permission
+
+    @admin.display(description='Subject')
+    def short_subject(self, obj):
+        return truncate_string(obj, field_name='subject', max_length=150)
+
+
+@admin.register(EmailRecordArchive)
+class EmailRecordArchiveAdmin(admin.ModelAdmin):
+    list_display = ('client', 'period_start', 'period_end', 'record_count',
+                    'sent_count', 'failed_count', 'created_at',)
+    list_filter = ['client']
+    list_per_page = 50
+    date_hierarchy = 'period_start'
+    exclude = ('data',)
+    readonly_fields = ('client', 'period_start', 'period_end', 'first_record_id', 'last_record_id',
+                       'record_count', 'sent_count', 'failed_count', 'created_at')
+
+    def has_add_permission(self, request):
+        return False  # Disable add permission
+
+    def has_change_permission(self, request, obj=None):
+        return False  # Disable change permission
+
+    def has_delete_permission(self, request, obj=None):
+        return False  # Disable delete permission; archives are kept for audits
+
+
+@admin.register(SuppressedRecipient)
+class SuppressedRecipientAdmin(admin.ModelAdmin):
+    list_display = ('email', 'client', 'reason', 'created_at',)
+    list_filter = ['reason', 'client']
+    list_per_page = 50
+    search_fields = ('email',)
+    readonly_fields = ('created_at',)
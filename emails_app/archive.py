@@ -0,0 +1,141 @@
+import csv
+import io
+import time
+import zlib
+from datetime import timedelta
+from itertools import groupby
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import LEGACY_EMAIL_STATUSES, EmailRecord, EmailRecordArchive, EmailStatusChoices
+
+ARCHIVE_FIELDS = ('id', 'client_id', 'subject', 'recipient', 'status',
+                  'error_message', 'task_type', 'timestamp')
+
+
+def get_hot_days():
+    return getattr(settings, 'EMAIL_RECORD_HOT_DAYS', 30)
+
+
+def encode_records(rows):
+    """
+    Packs record value tuples (in ARCHIVE_FIELDS order) into compressed CSV.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([
+            value.isoformat() if hasattr(value, 'isoformat')
+            else '' if value is None else value
+            for value in row
+        ])
+    return zlib.compress(buffer.getvalue().encode(), 6)
+
+
+def decode_records(data):
+    """
+    Unpacks an archive's data into one dict per record.
+    """
+    text = zlib.decompress(bytes(data)).decode()
+    for row in csv.reader(io.StringIO(text)):
+        record = dict(zip(ARCHIVE_FIELDS, row))
+        record['id'] = int(record['id'])
+        record['client_id'] = int(record['client_id'])
+        record['status'] = LEGACY_EMAIL_STATUSES.get(record['status'], record['status'])
+        record['error_message'] = record['error_message'] or None
+        record['timestamp'] = parse_datetime(record['timestamp'])
+        yield record
+
+
+def archive_email_records(older_than_days=None, batch_size=5000, sleep=0.0, limit=None):
+    """
+    Moves email records older than `older_than_days` days out of the hot
+    table into compressed EmailRecordArchive rows, one batch of primary keys
+    at a time. Each batch is archived and deleted in one short transaction,
+    so a record is never lost or kept in both places. Returns the number of
+    records moved.
+    """
+    days = older_than_days if older_than_days is not None else get_hot_days()
+    cutoff = timezone.now() - timedelta(days=days)
+    moved = 0
+    last_id = 0
+    while limit is None or moved < limit:
+        size = batch_size if limit is None else min(batch_size, limit - moved)
+        rows = list(EmailRecord.objects.filter(
+            pk__gt=last_id, timestamp__lt=cutoff).order_by('pk').values_list(*ARCHIVE_FIELDS)[:size])
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        # Archive records not yet converted from the legacy statuses with
+        # the current ones, so the counts and searches cover them
+        rows = [row[:4] + (LEGACY_EMAIL_STATUSES.get(row[4], row[4]),) + row[5:] for row in rows]
+
+        archives = []
+        rows.sort(key=lambda row: (row[1], row[0]))
+        for client_id, client_rows in groupby(rows, key=lambda row: row[1]):
+            client_rows = list(client_rows)
+            statuses = [row[4] for row in client_rows]
+            timestamps = [row[7] for row in client_rows]
+            archives.append(EmailRecordArchive(
+                client_id=client_id,
+                period_start=min(timestamps),
+                period_end=max(timestamps),
+                first_record_id=client_rows[0][0],
+                last_record_id=client_rows[-1][0],
+                record_count=len(client_rows),
+                sent_count=statuses.count(EmailStatusChoices.SENT),
+                failed_count=statuses.count(EmailStatusChoices.FAILED),
+                data=encode_records(client_rows),
+            ))
+
+        with transaction.atomic():
+            EmailRecordArchive.objects.bulk_create(archives)
+            EmailRecord.objects.filter(pk__in=[row[0] for row in rows]).delete()
+        moved += len(rows)
+        if sleep:
+            time.sleep(sleep)
+    return moved
+
+
+def search_email_records(client_id=None, recipient=None, status=None, since=None, until=None):
+    """
+    Yields matching records as dicts for audits: archived records first,
+    then those still in the hot table. Archives are narrowed down by client
+    and period before any of them is decompressed.
+    """
+    hot = EmailRecord.objects.order_by('timestamp')
+    archives = EmailRecordArchive.objects.order_by('period_start')
+    if client_id is not None:
+        hot = hot.filter(client_id=client_id)
+        archives = archives.filter(client_id=client_id)
+    if recipient:
+        hot = hot.filter(recipient=recipient)
+    if status:
+        # Match rows not yet converted from the legacy statuses too
+        hot = hot.filter(status__in=[status] + [
+            legacy for legacy, current in LEGACY_EMAIL_STATUSES.items() if current == status])
+    if since:
+        hot = hot.filter(timestamp__gte=since)
+        archives = archives.filter(period_end__gte=since)
+    if until:
+        hot = hot.filter(timestamp__lt=until)
+        archives = archives.filter(period_start__lt=until)
+
+    for archive in archives.only('data').iterator():
+        for record in decode_records(archive.data):
+            if recipient and record['recipient'] != recipient:
+                continue
+            if status and record['status'] != status:
+                continue
+            if since and record['timestamp'] < since:
+                continue
+            if until and record['timestamp'] >= until:
+                continue
+            yield record
+
+    for record in hot.values(*ARCHIVE_FIELDS).iterator():
+        record['status'] = LEGACY_EMAIL_STATUSES.get(record['status'], record['status'])
+        yield record
@@ -0,0 +1,318 @@
+import asyncio
+import base64
+import logging
+import re
+import smtplib
+import socket
+import ssl
+from email.utils import parseaddr
+
+from django.conf import settings
+
+from .metrics import timed
+
+logger = logging.getLogger("emails_app")
+
+CRLF = b'\r\n'
+
+
+def quote_data(data):
+    """
+    Normalizes line endings to CRLF and dot-stuffs lines starting with a
+    period, as the SMTP DATA command requires.
+    """
+    data = re.sub(br'(?:\r\n|\n|\r(?!\n))', CRLF, data)
+    data = re.sub(br'(?m)^\.', b'..', data)
+    if not data.endswith(CRLF):
+        data += CRLF
+    return data
+
+
+class AsyncSMTPSession:
+    """
+    A minimal asyncio SMTP client: EHLO, STARTTLS or implicit TLS, AUTH
+    PLAIN, and MAIL/RCPT/DATA pipelined into a single write when the server
+    advertises PIPELINING (RFC 2920).
+
+    Failures raise the `smtplib` exception types, so callers can handle them
+    the same way as errors from the synchronous backend.
+    """
+
+    def __init__(self, host='localhost', port=25, username=None, password=None,
+                 use_tls=False, use_ssl=False, timeout=None, local_hostname=None):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.use_ssl = use_ssl
+        self.timeout = timeout or getattr(settings, 'EMAIL_TIMEOUT', None) or 60
+        self.local_hostname = local_hostname or socket.getfqdn()
+        self.extensions = set()
+        self.message_count = 0
+        self._reader = None
+        self._writer = None
+
+    @property
+    def connected(self):
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def _read_reply(self):
+        lines = []
+        while True:
+            try:
+                line = await asyncio.wait_for(self._reader.readline(), self.timeout)
+            except (asyncio.TimeoutError, OSError) as e:
+                self._abort()
+                raise smtplib.SMTPServerDisconnected(
+                    f"Connection to {self.host} lost: {e}")
+            if not line:
+                self._abort()
+                raise smtplib.SMTPServerDisconnected(
+                    f"Connection to {self.host} closed unexpectedly")
+            try:
+                code = int(line[:3])
+            except ValueError:
+                self._abort()
+                raise smtplib.SMTPServerDisconnected(
+                    f"Malformed reply from {self.host}: {line!r}")
+            lines.append(line[4:].strip())
+            if line[3:4] != b'-':
+                return code, b'\n'.join(lines)
+
+    async def _write(self, data):
+        try:
+            self._writer.write(data)
+            await asyncio.wait_for(self._writer.drain(), self.timeout)
+        except (asyncio.TimeoutError, OSError) as e:
+            self._abort()
+            raise smtplib.SMTPServerDisconnected(
+                f"Connection to {self.host} lost: {e}")
+
+    async def _command(self, line, expected):
+        await self._write(line.encode() + CRLF)
+        code, message = await self._read_reply()
+        if code not in expected:
+            raise smtplib.SMTPResponseException(code, message)
+        return code, message
+
+    async def _ehlo(self):
+        code, message = await self._command(
+            f'EHLO {self.local_hostname}', (250,))
+        self.extensions = {
+            line.split()[0].decode('ascii', 'replace').lower()
+            for line in message.split(b'\n')[1:] if line.strip()
+        }
+
+    async def connect(self):
+        ssl_context = ssl.create_default_context() if (self.use_ssl or self.use_tls) else None
+        try:
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(
+                    self.host, self.port, ssl=ssl_context if self.use_ssl else None),
+                self.timeout)
+        except (asyncio.TimeoutError, OSError) as e:
+            raise smtplib.SMTPConnectError(421, str(e).encode())
+        code, message = await self._read_reply()
+        if code != 220:
+            self._abort()
+            raise smtplib.SMTPConnectError(code, message)
+        await self._ehlo()
+        if self.use_tls:
+            await self._command('STARTTLS', (220,))
+            try:
+                await asyncio.wait_for(
+                    self._writer.start_tls(ssl_context, server_hostname=self.host), self.timeout)
+            except (asyncio.TimeoutError, OSError) as e:
+                self._abort()
+                raise smtplib.SMTPConnectError(421, f"TLS handshake failed: {e}".encode())
+            await self._ehlo()
+        if self.username:
+            credentials = base64.b64encode(
+                f'\0{self.username}\0{self.password or ""}'.encode()).decode('ascii')
+            try:
+                await self._command(f'AUTH PLAIN {credentials}', (235,))
+            except smtplib.SMTPResponseException as e:
+                raise smtplib.SMTPAuthenticationError(e.smtp_code, e.smtp_error)
+
+    async def send(self, from_email, recipients, data):
+        """
+        Sends one message. Returns a dict of refused recipients mapped to
+        `(code, message)`, like `smtplib.SMTP.sendmail`, and raises if the
+        sender, every recipient or the message itself is refused.
+        """
+        mail = f'MAIL FROM:<{parseaddr(from_email)[1]}>'.encode() + CRLF
+        rcpts = [f'RCPT TO:<{parseaddr(recipient)[1]}>'.encode() + CRLF
+                 for recipient in recipients]
+
+        if 'pipelining' in self.extensions:
+            await self._write(mail + b''.join(rcpts) + b'DATA' + CRLF)
+            mail_reply = await self._read_reply()
+            rcpt_replies = [await self._read_reply() for _ in rcpts]
+            data_reply = await self._read_reply()
+        else:
+            await self._write(mail)
+            mail_reply = await self._read_reply()
+            rcpt_replies = []
+            data_reply = None
+            if mail_reply[0] == 250:
+                for rcpt in rcpts:
+                    await self._write(rcpt)
+                    rcpt_replies.append(await self._read_reply())
+
+        refused = {
+            recipient: reply for recipient, reply in zip(recipients, rcpt_replies)
+            if reply[0] not in (250, 251)
+        }
+        accepted = mail_reply[0] == 250 and len(refused) < len(recipients)
+        if data_reply is None and accepted:
+            await self._write(b'DATA' + CRLF)
+            data_reply = await self._read_reply()
+
+        if data_reply is not None and data_reply[0] == 354 and not accepted:
+            # A pipelining server may start DATA even though nothing is
+            # deliverable; end it empty so the session stays usable
+            await self._write(b'.' + CRLF)
+            await self._read_reply()
+        if not accepted:
+            await self.reset()
+            if mail_reply[0] != 250:
+                raise smtplib.SMTPSenderRefused(mail_reply[0], mail_reply[1], from_email)
+            raise smtplib.SMTPRecipientsRefused(refused)
+        if data_reply[0] != 354:
+            await self.reset()
+            raise smtplib.SMTPDataError(*data_reply)
+
+        if isinstance(data, bytes):
+            await self._write(quote_data(data) + b'.' + CRLF)
+        else:
+            # StreamingData: write block by block as attachments are read.
+            # If an attachment can't be read part-way, the message can only
+            # be abandoned by dropping the connection before the final dot
+            try:
+                for block in data.blocks():
+                    await self._write(block)
+            except OSError as e:
+                self._abort()
+                raise smtplib.SMTPServerDisconnected(
+                    f"Message data could not be read: {e}")
+            await self._write(b'.' + CRLF)
+        code, message = await self._read_reply()
+        if code != 250:
+            await self.reset()
+            raise smtplib.SMTPDataError(code, message)
+        self.message_count += 1
+        return refused
+
+    async def reset(self):
+        try:
+            await self._command('RSET', (250,))
+        except smtplib.SMTPException:
+            self._abort()
+
+    async def quit(self):
+        if not self.connected:
+            return
+        try:
+            await self._command('QUIT', (221,))
+        except smtplib.SMTPException:
+            pass
+        self._abort()
+
+    def _abort(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._writer = None
+        self._reader = None
+
+
+class AsyncDeliveryEngine:
+    """
+    Delivers many envelopes from one process over up to `concurrency`
+    simultaneous SMTP sessions to the same relay. A session that fails is
+    replaced, and each session is recycled after `max_messages` messages.
+    """
+
+    def __init__(self, concurrency=None, max_messages=None, **connection_kwargs):
+        self.concurrency = concurrency or getattr(
+            settings, 'EMAIL_ASYNC_CONCURRENCY', 10)
+        self.max_messages = max_messages or getattr(
+            settings, 'EMAIL_POOL_MAX_MESSAGES', 100)
+        # Without explicit relay settings, use the EMAIL_* Django settings
+        # just like get_connection() does
+        self.connection_kwargs = connection_kwargs or {
+            'host': settings.EMAIL_HOST,
+            'port': settings.EMAIL_PORT,
+            'username': settings.EMAIL_HOST_USER,
+            'password': settings.EMAIL_HOST_PASSWORD,
+            'use_tls': settings.EMAIL_USE_TLS,
+            'use_ssl': settings.EMAIL_USE_SSL,
+        }
+
+    async def _run_session(self, queue, results):
+        session = None
+        try:
+            while True:
+                try:
+                    index, envelope = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    if session is None or not session.connected or session.message_count >= self.max_messages:
+                        if session is not None:
+                            await session.quit()
+                            session = None
+                        fresh = AsyncSMTPSession(**self.connection_kwargs)
+                        try:
+                            with timed('smtp_connect'):
+                                await fresh.connect()
+                        except BaseException:
+                            # A session refused STARTTLS or AUTH is still
+                            # connected, but must not carry any message
+                            fresh._abort()
+                            raise
+                        session = fresh
+                    with timed('smtp_data'):
+                        results[index] = (await session.send(*envelope), None)
+                except (smtplib.SMTPException, OSError) as e:
+                    if not isinstance(e, smtplib.SMTPException):
+                        e = smtplib.SMTPServerDisconnected(f"Connection lost: {e}")
+                    results[index] = (None, e)
+                    if isinstance(e, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+                        if session is not None:
+                            session._abort()
+                        session = None
+        finally:
+            if session is not None:
+                await session.quit()
+
+    async def deliver(self, envelopes):
+        """
+        Sends every `(from_email, recipients, data)` envelope and returns a
+        `(refused, error)` pair per envelope, in order: `error` is the
+        exception if the message was not accepted, otherwise `refused` holds
+        any individually refused recipients.
+        """
+        queue = asyncio.Queue()
+        for item in enumerate(envelopes):
+            queue.put_nowait(item)
+        results = [None] * queue.qsize()
+        sessions = min(self.concurrency, len(results))
+        outcomes = await asyncio.gather(
+            *(self._run_session(queue, results) for _ in range(sessions)), return_exceptions=True)
+        errors = [outcome for outcome in outcomes if isinstance(outcome, BaseException)]
+        if errors:
+            # A session broke down unexpectedly; the envelope it was sending
+            # gets its error, while every other envelope keeps its own result
+            logger.error(f"Async SMTP session failed: {errors[0]!r}")
+            results = [result or (None, errors[0]) for result in results]
+        return results
+
+
+def deliver_envelopes(envelopes, concurrency=None, **connection_kwargs):
+    """
+    Synchronous entry point for Celery tasks: runs the engine on a fresh
+    event loop until every envelope has an outcome.
+    """
+    engine = AsyncDeliveryEngine(concurrency=concurrency, **connection_kwargs)
+    return asyncio.run(engine.deliver(envelopes))
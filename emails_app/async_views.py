@@ -0,0 +1,268 @@
+"""
+Async versions of the token and send endpoints, for serving under ASGI.
+
+Django's ASGI handler reads the request body from the socket without a
+thread, so a slow upload only costs a coroutine. The views then parse the
+buffered body and store attachments in worker threads, look up the Client
+with async ORM queries and publish through the publisher threads, never
+blocking the event loop on I/O.
+"""
+import logging
+from functools import wraps
+
+import jwt
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.http import JsonResponse
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from emails_app.attachments import aacquire_attachments, arelease_attachments, astore_attachment
+from emails_app.clients import aget_client_for_ip
+from emails_app.idempotency import async_idempotent
+from emails_app.metrics import set_labels, timed
+from emails_app.models import BulkJob, Client, TaskTypeChoices
+from emails_app.publishing import publish
+from emails_app.serializers import BulkEmailSerializer, EmailSerializer
+from emails_app.utils import ErrorCode, format_serializer_errors, get_server_ip
+from .tasks import send_email_task, send_bulk_email_task
+
+logger = logging.getLogger("emails_app")
+
+
+class AsyncJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that loads the requesting Client, with its user, in a
+    single async query. Applies the same user checks as `get_user`.
+    """
+
+    async def aauthenticate_client(self, request):
+        header = self.get_header(request)
+        raw_token = self.get_raw_token(header) if header is not None else None
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        try:
+            user_id = validated_token[jwt_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken("Token contained no recognizable user identification") from e
+
+        user_filter = {jwt_settings.USER_ID_FIELD: user_id}
+        client = await Client.objects.select_related('user').filter(
+            **{f'user__{field}': value for field, value in user_filter.items()}).afirst()
+        if client is None:
+            if not await get_user_model().objects.filter(**user_filter).aexists():
+                raise AuthenticationFailed("User not found", code="user_not_found")
+            return False
+
+        if jwt_settings.CHECK_USER_IS_ACTIVE and not client.user.is_active:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+        if jwt_settings.CHECK_REVOKE_TOKEN and validated_token.get(
+                jwt_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(client.user.password):
+            raise AuthenticationFailed("The user's password has been changed.", code="password_changed")
+        return client
+
+
+def async_api_view(authenticate=False):
+    """
+    Wraps an async view as a POST-only JSON endpoint exempt from CSRF checks,
+    like the DRF views. With `authenticate`, the view is only called with a
+    valid access token, and gets the Client as `request.client`; otherwise
+    the same 401 and 404 responses as DRF are returned.
+
+    Django 4.2's `require_POST` and `csrf_exempt` don't support async views.
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method != 'POST':
+                return JsonResponse({'detail': f'Method "{request.method}" not allowed.'},
+                                    status=status.HTTP_405_METHOD_NOT_ALLOWED, headers={'Allow': 'POST'})
+            if authenticate:
+                authenticator = AsyncJWTAuthentication()
+                try:
+                    client = await authenticator.aauthenticate_client(request)
+                except AuthenticationFailed as e:
+                    return JsonResponse(
+                        e.detail if isinstance(e.detail, dict) else {'detail': e.detail},
+                        status=status.HTTP_401_UNAUTHORIZED,
+                        headers={'WWW-Authenticate': authenticator.authenticate_header(request)})
+                if client is None:
+                    return JsonResponse(
+                        {'detail': 'Authentication credentials were not provided.'},
+                        status=status.HTTP_401_UNAUTHORIZED,
+                        headers={'WWW-Authenticate': authenticator.authenticate_header(request)})
+                if client is False:
+                    return JsonResponse({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+                request.client = client
+                request.user = client.user
+            return await view(request, *args, **kwargs)
+
+        wrapper.csrf_exempt = True
+        return wrapper
+    return decorator
+
+
+def _validate_form(request, serializer_class):
+    # Parses the buffered multipart body; uploads over the memory limit
+    # are read back from temporary files
+    data = request.POST.copy()
+    data.update(request.FILES)
+    serializer = serializer_class(data=data)
+    serializer.is_valid()
+    return serializer, request.FILES.getlist('attachments')
+
+
+async def validate_form(request, serializer_class):
+    with timed('request_parse'):
+        return await sync_to_async(_validate_form, thread_sensitive=False)(request, serializer_class)
+
+
+async def store_attachments(attachments):
+    # Store attachments once and pass (name, digest, content_type)
+    # references to the task instead of the file contents
+    with timed('attachment_store'):
+        attached_files = [await astore_attachment(attachment) for attachment in attachments]
+        await aacquire_attachments(attached_files)
+    return attached_files
+
+
+def invalid_request_response(serializer):
+    error_response = {
+        "success": False,
+        'code': ErrorCode.INVALID_REQUEST.code,
+        'message': ErrorCode.INVALID_REQUEST.message,
+        'errors': format_serializer_errors(serializer.errors)
+    }
+    return JsonResponse(error_response, status=status.HTTP_400_BAD_REQUEST)
+
+
+def internal_error_response():
+    error_response = {
+        "success": False,
+        'code': ErrorCode.INTERNAL_ERROR.code,
+        'message': ErrorCode.INTERNAL_ERROR.message,
+        'errors': []
+    }
+    return JsonResponse(error_response, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@async_api_view(authenticate=True)
+@async_idempotent
+async def send_single_email(request):
+    client = request.client
+    set_labels(client=client.pk, task_type=TaskTypeChoices.SINGLE)
+    serializer, attachments = await validate_form(request, EmailSerializer)
+    if serializer.errors:
+        return invalid_request_response(serializer)
+
+    subject = serializer.validated_data['subject']
+    message = serializer.validated_data.get('message', None)
+    recipient = serializer.validated_data['recipient']
+    html_message = serializer.validated_data.get('html_message', None)
+
+    attached_files = []
+    try:
+        attached_files = await store_attachments(attachments)
+        with timed('publish'):
+            await publish(send_email_task, subject, message, recipient, attached_files, html_message, client.pk)
+    except Exception as e:
+        logger.error(f"Error initiating email: {str(e)}")
+        # The task was never published, so nothing else drops its references
+        await arelease_attachments(attached_files)
+        return internal_error_response()
+    success_response = {
+        "success": True,
+        'message': 'Email sending task has been initiated'
+    }
+    return JsonResponse(success_response, status=status.HTTP_202_ACCEPTED)
+
+
+@async_api_view(authenticate=True)
+@async_idempotent
+async def send_bulk_email(request):
+    client = request.client
+    set_labels(client=client.pk, task_type=TaskTypeChoices.BULK)
+    serializer, attachments = await validate_form(request, BulkEmailSerializer)
+    if serializer.errors:
+        return invalid_request_response(serializer)
+
+    subject = serializer.validated_data['subject']
+    message = serializer.validated_data.get('message', None)
+    recipient_list = serializer.validated_data.get('recipient_list', [])
+    recipient_context = serializer.validated_data.get('recipient_context', None)
+    html_message = serializer.validated_data.get('html_message', None)
+    collective = serializer.validated_data.get('collective', False)
+    chunk_size = serializer.validated_data.get('chunk_size', None)
+
+    job = None
+    attached_files = []
+    try:
+        attached_files = await store_attachments(attachments)
+        # Track progress on a BulkJob the client can poll
+        job = await BulkJob.objects.acreate(
+            client=client, subject=subject, total=len(recipient_context or recipient_list))
+        with timed('publish'):
+            await publish(
+                send_bulk_email_task, subject, message, recipient_list, attached_files, html_message, client.pk,
+                collective=collective, chunk_size=chunk_size, recipient_context=recipient_context,
+                job_id=str(job.pk))
+    except Exception as e:
+        logger.error(f"Error initiating bulk email: {str(e)}")
+        # The task was never published, so nothing else cleans up
+        await arelease_attachments(attached_files)
+        await sync_to_async(BulkJob.mark_failed)(job and job.pk)
+        return internal_error_response()
+    success_response = {
+        "success": True,
+        'message': 'Bulky email sending task has been initiated',
+        'job_id': str(job.pk),
+    }
+    return JsonResponse(success_response, status=status.HTTP_202_ACCEPTED)
+
+
+@async_api_view()
+async def obtain_token(request):
+    server_ip = get_server_ip(request)
+    logger.info(f'Request Token from IP: {server_ip}')
+
+    client = await aget_client_for_ip(server_ip)
+    if client is None or client.user is None:
+        error_response = {
+            "success": False,
+            'code': ErrorCode.INVALID_IP.code,
+            'message': f'{ErrorCode.INVALID_IP.message} - {server_ip}'
+        }
+        return JsonResponse(error_response, status=status.HTTP_403_FORBIDDEN)
+
+    try:
+        if apps.is_installed('rest_framework_simplejwt.token_blacklist'):
+            # The blacklist app records every refresh token it issues
+            refresh = await sync_to_async(RefreshToken.for_user)(client.user)
+        else:
+            refresh = RefreshToken.for_user(client.user)
+
+        decoded_payload = jwt.decode(
+            str(refresh.access_token), settings.SECRET_KEY, algorithms=[settings.SIMPLE_JWT["ALGORITHM"]])
+
+        return JsonResponse({
+            "success": True,
+            'refresh': str(refresh),
+            'access': str(refresh.access_token),
+            'token_info': decoded_payload,
+        }, status=status.HTTP_200_OK)
+    except Exception as e:
+        error_response = {
+            "success": False,
+            'code': ErrorCode.INTERNAL_ERROR.code,
+            'message': ErrorCode.INTERNAL_ERROR.message,
+            'errors': str(e)
+        }
+        return JsonResponse(error_response, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
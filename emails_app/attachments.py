@@ -0,0 +1,163 @@
+import hashlib
+import logging
+from collections import Counter
+from datetime import timedelta
+from functools import lru_cache
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import AttachmentBlob
+
+logger = logging.getLogger("emails_app")
+
+ATTACHMENT_PREFIX = 'email_attachments'
+
+
+@lru_cache(maxsize=None)
+def get_attachment_storage():
+    """
+    Returns the storage attachment blobs live in: a local directory when
+    `EMAIL_ATTACHMENT_ROOT` is set, otherwise `default_storage`.
+    """
+    root = getattr(settings, 'EMAIL_ATTACHMENT_ROOT', None)
+    if root:
+        return FileSystemStorage(location=root)
+    return default_storage
+
+
+def blob_path(digest):
+    return f'{ATTACHMENT_PREFIX}/{digest[:2]}/{digest}'
+
+
+def hash_upload(uploaded_file):
+    hasher = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def write_blob(uploaded_file, digest):
+    storage = get_attachment_storage()
+    path = blob_path(digest)
+    if not storage.exists(path):
+        uploaded_file.seek(0)
+        saved_path = storage.save(path, uploaded_file)
+        if saved_path != path:
+            # Another request stored the same content first
+            storage.delete(saved_path)
+
+
+def store_attachment(uploaded_file):
+    """
+    Stores an uploaded file under the hash of its content and returns the
+    `(name, digest, content_type)` reference that tasks receive instead of
+    the bytes. Content that is already stored is not written again.
+    """
+    digest = hash_upload(uploaded_file)
+
+    # Touch the row first so a concurrent garbage collection skips it
+    _, created = AttachmentBlob.objects.get_or_create(
+        digest=digest, defaults={'size': uploaded_file.size})
+    if not created:
+        AttachmentBlob.objects.filter(digest=digest).update(
+            updated_at=timezone.now())
+
+    write_blob(uploaded_file, digest)
+    return (uploaded_file.name, digest, uploaded_file.content_type)
+
+
+async def astore_attachment(uploaded_file):
+    """
+    Async `store_attachment`: the file is hashed and written in a worker
+    thread outside the thread async ORM queries share.
+    """
+    digest = await sync_to_async(hash_upload, thread_sensitive=False)(uploaded_file)
+
+    _, created = await AttachmentBlob.objects.aget_or_create(
+        digest=digest, defaults={'size': uploaded_file.size})
+    if not created:
+        await AttachmentBlob.objects.filter(digest=digest).aupdate(
+            updated_at=timezone.now())
+
+    await sync_to_async(write_blob, thread_sensitive=False)(uploaded_file, digest)
+    return (uploaded_file.name, digest, uploaded_file.content_type)
+
+
+def _reference_counts(attachment_refs):
+    return Counter(digest for _, digest, _ in attachment_refs or [])
+
+
+def acquire_attachments(attachment_refs, count=1):
+    """
+    Marks the referenced blobs as needed by `count` more pending tasks.
+    """
+    for digest, uses in _reference_counts(attachment_refs).items():
+        AttachmentBlob.objects.filter(digest=digest).update(
+            references=F('references') + uses * count, updated_at=timezone.now())
+
+
+async def aacquire_attachments(attachment_refs, count=1):
+    for digest, uses in _reference_counts(attachment_refs).items():
+        await AttachmentBlob.objects.filter(digest=digest).aupdate(
+            references=F('references') + uses * count, updated_at=timezone.now())
+
+
+def release_attachments(attachment_refs, count=1):
+    """
+    Drops `count` task references to the referenced blobs. Blobs left without
+    references are removed by `collect_attachment_garbage`.
+    """
+    for digest, uses in _reference_counts(attachment_refs).items():
+        AttachmentBlob.objects.filter(digest=digest).update(
+            references=F('references') - uses * count, updated_at=timezone.now())
+
+
+async def arelease_attachments(attachment_refs, count=1):
+    for digest, uses in _reference_counts(attachment_refs).items():
+        await AttachmentBlob.objects.filter(digest=digest).aupdate(
+            references=F('references') - uses * count, updated_at=timezone.now())
+
+
+def load_attachments(attachment_refs):
+    """
+    Resolves `(name, digest, content_type)` references into the
+    `(name, content, content_type)` tuples `EmailMessage.attach` expects.
+    """
+    storage = get_attachment_storage()
+    attachments = []
+    for file_name, digest, content_type in attachment_refs or []:
+        with storage.open(blob_path(digest), 'rb') as f:
+            attachments.append((file_name, f.read(), content_type))
+    return attachments
+
+
+def collect_attachment_garbage(grace_period=None, max_age=None):
+    """
+    Deletes blobs no pending task references any more, once they have been
+    unreferenced for `grace_period` seconds. Blobs untouched for `max_age`
+    seconds are deleted regardless, in case a task died without releasing.
+    """
+    grace_period = grace_period if grace_period is not None else getattr(
+        settings, 'EMAIL_ATTACHMENT_GC_GRACE', 3600)
+    max_age = max_age if max_age is not None else getattr(
+        settings, 'EMAIL_ATTACHMENT_MAX_AGE', 7 * 24 * 3600)
+    now = timezone.now()
+    expired = AttachmentBlob.objects.filter(
+        Q(references__lte=0, updated_at__lt=now - timedelta(seconds=grace_period)) |
+        Q(updated_at__lt=now - timedelta(seconds=max_age))
+    )
+
+    storage = get_attachment_storage()
+    deleted = 0
+    for digest in list(expired.values_list('digest', flat=True)):
+        # Re-apply the filter so a blob acquired in the meantime is kept
+        if expired.filter(digest=digest).delete()[0]:
+            storage.delete(blob_path(digest))
+            deleted += 1
+    if deleted:
+        logger.info(f"Deleted {deleted} unreferenced attachment blobs")
+    return deleted
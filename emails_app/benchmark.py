@@ -0,0 +1,317 @@
+import ipaddress
+import itertools
+import math
+import os
+import platform
+import resource
+import signal
+import subprocess
+import sys
+import time
+import uuid
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+
+from celery import current_app
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.utils import timezone
+
+from .attachments import acquire_attachments, store_attachment
+from .models import BulkJob, Client, SMTPSettings
+from .relays import SMTPSettingsSnapshot, smtp_settings_cache
+from .scheduling import compute_chunk_size
+from .smtp_sink import SMTPSink
+from .utils import chunk_list
+
+BENCHMARK_TASKS = ('single', 'bulk', 'chunk')
+BENCHMARK_ENGINES = ('pool', 'async')
+# Benchmark clients take a free address of this documentation range
+BENCHMARK_CLIENT_NETWORK = ipaddress.ip_network('192.0.2.0/24')
+SMTP_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+MANAGE_PY = Path(__file__).resolve().parent.parent / 'manage.py'
+
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1,
+                       math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def get_benchmark_queue():
+    return getattr(settings, 'EMAIL_BENCHMARK_QUEUE', 'benchmark')
+
+
+def benchmark_is_isolated():
+    """
+    Whether the settings say their database and broker are used only for
+    benchmarking. The benchmark refuses to run elsewhere unless forced.
+    """
+    return getattr(settings, 'EMAIL_BENCHMARK_ISOLATED', False)
+
+
+def route_to_benchmark_queue(name, args, kwargs, options, task=None, **kw):
+    return {'queue': get_benchmark_queue()}
+
+
+@contextmanager
+def benchmark_routing():
+    """
+    Routes every task to `EMAIL_BENCHMARK_QUEUE` until the block exits, so
+    the benchmark and the tasks it fans out never reach the queues the
+    production workers consume.
+    """
+    conf, amqp = current_app.conf, current_app.amqp
+    saved = conf.task_routes
+    conf.task_routes = (route_to_benchmark_queue,)
+    amqp.flush_routes()
+    amqp.router = amqp.Router()
+    try:
+        yield
+    finally:
+        conf.task_routes = saved
+        amqp.flush_routes()
+        amqp.router = amqp.Router()
+
+
+@contextmanager
+def pin_relay(host, port, engine):
+    """
+    Points this process's delivery at `host:port` without TLS or AUTH, and
+    selects the delivery engine, whatever the database says, until the
+    block exits.
+    """
+    relay = SMTPSettings(host=host, port=port, username='', password='',
+                         use_tls=False, use_ssl=False,
+                         default_from_email='benchmark@example.com')
+    overrides = {'EMAIL_BACKEND': SMTP_BACKEND, 'EMAIL_DELIVERY_ENGINE': engine}
+    saved = {name: getattr(settings, name) for name in overrides if hasattr(settings, name)}
+    smtp_settings_cache.pin(SMTPSettingsSnapshot(relay, version=f'benchmark:{host}:{port}'))
+    for name, value in overrides.items():
+        setattr(settings, name, value)
+    try:
+        yield
+    finally:
+        smtp_settings_cache.unpin()
+        for name in overrides:
+            if name in saved:
+                setattr(settings, name, saved[name])
+            else:
+                delattr(settings, name)
+
+
+@contextmanager
+def benchmark_client():
+    """
+    Yields a new Client without rate limits, on an address of
+    `BENCHMARK_CLIENT_NETWORK` no other client uses. Only that client is
+    deleted afterwards, which also deletes the records and jobs the
+    benchmark created.
+    """
+    taken = set(Client.objects.values_list('static_ip', flat=True))
+    static_ip = next((str(address) for address in BENCHMARK_CLIENT_NETWORK.hosts()
+                      if str(address) not in taken), None)
+    if static_ip is None:
+        raise RuntimeError(f'Every address of {BENCHMARK_CLIENT_NETWORK} is taken by a client')
+    client = Client.objects.create(
+        static_ip=static_ip, system_name=f'Benchmark {uuid.uuid4().hex[:8]}')
+    try:
+        yield client
+    finally:
+        Client.objects.filter(pk=client.pk).delete()
+
+
+class LocalWorker:
+    """
+    A Celery worker subprocess, started through the `benchmark_worker`
+    command so that it delivers to the benchmark's SMTP sink and consumes
+    only the benchmark queue.
+    """
+
+    def __init__(self, relay_port, engine, concurrency, relay_host='127.0.0.1'):
+        self.name = f'benchmark-{uuid.uuid4().hex[:8]}@{platform.node()}'
+        self.command = [
+            sys.executable, str(MANAGE_PY), 'benchmark_worker',
+            '--relay', f'{relay_host}:{relay_port}', '--engine', engine,
+            '--concurrency', str(concurrency), '--hostname', self.name,
+            # benchmark_delivery has already checked where it may run
+            '--i-know',
+        ]
+        self.process = None
+
+    def start(self, timeout=60):
+        self.process = subprocess.Popen(self.command)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'Benchmark worker exited with {self.process.returncode}')
+            if current_app.control.ping(destination=[self.name], timeout=1):
+                return
+        self.stop()
+        raise RuntimeError('Benchmark worker did not come up in time')
+
+    def stop(self, timeout=60):
+        if self.process is None or self.process.poll() is not None:
+            return
+        # Warm shutdown, so the worker reaps its pool and the CPU time of
+        # its children is counted
+        self.process.send_signal(signal.SIGTERM)
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+class DeliveryBenchmark:
+    """
+    Runs the send tasks against a local SMTP sink and measures delivery.
+
+    In `eager` mode the tasks run inside this process; in `workers` mode a
+    real local worker is started for each scenario. Each scenario reports
+    messages per second, per-message latency percentiles (from enqueueing
+    to acceptance by the sink), CPU time and peak RSS. CPU time covers this
+    process in eager mode, including the sink, and the worker processes in
+    workers mode. Peak RSS is the high-water mark of the measured processes
+    so far, so run one scenario per invocation to isolate it.
+    """
+
+    def __init__(self, mode='eager', sink_latency=0.0, concurrency=4, timeout=300):
+        self.mode = mode
+        self.sink_latency = sink_latency
+        self.concurrency = concurrency
+        self.timeout = timeout
+
+    def scenarios(self, tasks, engines, recipient_counts, chunk_sizes, attachment_sizes):
+        for task, engine, recipients, chunk_size, attachment_size in itertools.product(
+                tasks, engines, recipient_counts, chunk_sizes, attachment_sizes):
+            if task == 'single' and chunk_size != chunk_sizes[0]:
+                continue  # chunk size means nothing for single sends
+            yield {
+                'task': task,
+                'engine': engine,
+                'recipients': recipients,
+                'chunk_size': None if task == 'single' else chunk_size or None,
+                'attachment_size': attachment_size,
+            }
+
+    def run(self, scenarios):
+        results = []
+        with benchmark_client() as client:
+            for scenario in scenarios:
+                results.append(self.run_scenario(client, **scenario))
+        return {
+            'started_at': timezone.now().isoformat(),
+            'host': platform.node(),
+            'python': platform.python_version(),
+            'mode': self.mode,
+            'sink_latency': self.sink_latency,
+            'concurrency': self.concurrency if self.mode == 'workers' else 1,
+            'results': results,
+        }
+
+    def _attachments(self, size):
+        if not size:
+            return []
+        uploaded = SimpleUploadedFile(
+            'benchmark.bin', os.urandom(size), content_type='application/octet-stream')
+        return [store_attachment(uploaded)]
+
+    def _dispatch(self, client, task, recipients, chunk_size, attachments):
+        """
+        Enqueues the work the way the views and fan-out tasks do and returns
+        the enqueue time of each recipient.
+        """
+        from .tasks import send_bulk_email_task, send_email_chunk, send_email_task
+
+        subject, message = 'Benchmark', 'Benchmark message body.\n' * 20
+        submitted = {}
+        if task == 'single':
+            acquire_attachments(attachments, count=len(recipients))
+            for recipient in recipients:
+                submitted[recipient] = time.monotonic()
+                send_email_task.delay(subject, message, recipient, attachments, None, client.pk)
+        elif task == 'bulk':
+            job = BulkJob.objects.create(client=client, subject=subject, total=len(recipients))
+            acquire_attachments(attachments)
+            now = time.monotonic()
+            submitted = dict.fromkeys(recipients, now)
+            send_bulk_email_task.delay(subject, message, recipients, attachments, None, client.pk,
+                                       chunk_size=chunk_size, job_id=str(job.pk))
+        else:
+            chunks = list(chunk_list(recipients, compute_chunk_size(
+                len(recipients), override=chunk_size)))
+            acquire_attachments(attachments, count=len(chunks))
+            job_key = uuid.uuid4().hex
+            for chunk in chunks:
+                submitted.update(dict.fromkeys(chunk, time.monotonic()))
+                send_email_chunk.delay(subject, message, chunk, attachments, None, client.pk,
+                                       job_key=job_key)
+        return submitted
+
+    def run_scenario(self, client, task, engine, recipients, chunk_size, attachment_size):
+        run_id = uuid.uuid4().hex[:8]
+        addresses = [f'bench-{run_id}-{i}@example.com' for i in range(recipients)]
+        attachments = self._attachments(attachment_size)
+        sink = SMTPSink(latency=self.sink_latency, record_arrivals=True).start()
+        worker = None
+        eager = current_app.conf.task_always_eager
+        stack = ExitStack()
+        try:
+            if self.mode == 'workers':
+                current_app.conf.task_always_eager = False
+                stack.enter_context(benchmark_routing())
+                worker = LocalWorker(sink.port, engine, self.concurrency)
+                worker.start()
+                usage_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+            else:
+                current_app.conf.task_always_eager = True
+                stack.enter_context(pin_relay(sink.host, sink.port, engine))
+                usage_before = resource.getrusage(resource.RUSAGE_SELF)
+
+            started = time.monotonic()
+            submitted = self._dispatch(client, task, addresses, chunk_size, attachments)
+            completed = sink.wait_for(recipients, timeout=self.timeout)
+            duration = time.monotonic() - started
+
+            if worker is not None:
+                worker.stop()
+                usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+            else:
+                usage = resource.getrusage(resource.RUSAGE_SELF)
+        finally:
+            if worker is not None:
+                worker.stop()
+            stack.close()
+            current_app.conf.task_always_eager = eager
+            sink.stop()
+
+        latencies = sorted(
+            arrived - submitted[recipient]
+            for arrived, rcpts in sink.arrivals
+            for recipient in rcpts if recipient in submitted)
+        return {
+            'task': task,
+            'engine': engine,
+            'recipients': recipients,
+            'chunk_size': chunk_size,
+            'attachment_size': attachment_size,
+            'completed': completed,
+            'messages': sink.message_count,
+            'smtp_sessions': sink.session_count,
+            'duration_seconds': round(duration, 4),
+            'messages_per_second': round(sink.message_count / duration, 2) if duration else None,
+            'latency_ms': {
+                name: round(percentile(latencies, fraction) * 1000, 2) if latencies else None
+                for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1.0))
+            },
+            'cpu_seconds': round((usage.ru_utime - usage_before.ru_utime)
+                                 + (usage.ru_stime - usage_before.ru_stime), 4),
+            # ru_maxrss is in kilobytes on Linux
+            'peak_rss_kb': usage.ru_maxrss,
+        }
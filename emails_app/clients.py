@@ -0,0 +1,120 @@
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.shortcuts import get_object_or_404
+
+from .models import Client
+
+CLIENTS_GENERATION_CACHE_KEY = 'emails_app:clients_generation'
+
+
+def bump_clients_generation():
+    """
+    Tells every process that its cached `static_ip -> Client` map is stale.
+    """
+    cache.set(CLIENTS_GENERATION_CACHE_KEY, uuid.uuid4().hex, timeout=None)
+
+
+class ClientIPCache:
+    """
+    Per-process map of static IP to Client (with its user), including misses,
+    so token requests don't query the database. The shared generation token
+    written by the Client signals is checked at most once every
+    `check_interval` seconds.
+    """
+
+    def __init__(self, check_interval=None, max_entries=None):
+        self.check_interval = check_interval if check_interval is not None else getattr(
+            settings, 'EMAIL_CLIENT_CACHE_CHECK_INTERVAL', 5)
+        self.max_entries = max_entries or getattr(
+            settings, 'EMAIL_CLIENT_CACHE_MAX_ENTRIES', 10000)
+        self._clients = {}
+        self._generation = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def _check_generation(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        generation = cache.get(CLIENTS_GENERATION_CACHE_KEY)
+        with self._lock:
+            if generation != self._generation:
+                self._clients = {}
+                self._generation = generation
+            self._checked_at = now
+
+    async def _acheck_generation(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        generation = await cache.aget(CLIENTS_GENERATION_CACHE_KEY)
+        with self._lock:
+            if generation != self._generation:
+                self._clients = {}
+                self._generation = generation
+            self._checked_at = now
+
+    def _remember(self, static_ip, client):
+        with self._lock:
+            if len(self._clients) >= self.max_entries:
+                self._clients = {}
+            self._clients[static_ip] = client
+
+    def get(self, static_ip):
+        """
+        Returns the Client registered for `static_ip`, or None.
+        """
+        self._check_generation()
+        try:
+            return self._clients[static_ip]
+        except KeyError:
+            pass
+        client = Client.objects.select_related('user').filter(
+            static_ip=static_ip).first()
+        self._remember(static_ip, client)
+        return client
+
+    async def aget(self, static_ip):
+        await self._acheck_generation()
+        try:
+            return self._clients[static_ip]
+        except KeyError:
+            pass
+        client = await Client.objects.select_related('user').filter(
+            static_ip=static_ip).afirst()
+        self._remember(static_ip, client)
+        return client
+
+    def clear(self):
+        with self._lock:
+            self._clients = {}
+
+
+client_ip_cache = ClientIPCache()
+
+
+def get_client_for_ip(static_ip):
+    if not static_ip:
+        return None
+    return client_ip_cache.get(static_ip)
+
+
+async def aget_client_for_ip(static_ip):
+    if not static_ip:
+        return None
+    return await client_ip_cache.aget(static_ip)
+
+
+def get_request_client(request):
+    """
+    Returns the authenticated user's Client, or raises Http404. Behind
+    `idempotent`, which already looked it up, no query is made.
+    """
+    client = getattr(request, 'client', None)
+    if client is None:
+        client = request.client = get_object_or_404(Client, user=request.user)
+    return client
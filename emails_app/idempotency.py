@@ -0,0 +1,237 @@
+import hashlib
+import json
+import logging
+from datetime import timedelta
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.http import JsonResponse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import Client, IdempotencyKey
+from .utils import ErrorCode
+
+logger = logging.getLogger("emails_app")
+
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+
+def get_idempotency_ttl():
+    return getattr(settings, 'EMAIL_IDEMPOTENCY_TTL', 24 * 3600)
+
+
+def get_idempotency_lock_timeout():
+    return getattr(settings, 'EMAIL_IDEMPOTENCY_LOCK_TIMEOUT', 60)
+
+
+def _cache_key(user_pk, key):
+    # Keyed on the Client's user, which the request already carries, so a
+    # cache hit doesn't need the Client at all
+    digest = hashlib.sha256(key.encode()).hexdigest()
+    return f'emails_app:idempotency:{user_pk}:{digest}'
+
+
+def _remaining_ttl(row):
+    expires_at = row.created_at + timedelta(seconds=get_idempotency_ttl())
+    return (expires_at - timezone.now()).total_seconds()
+
+
+def _replay(status_code, data):
+    return Response(data, status=status_code, headers={REPLAYED_HEADER: 'true'})
+
+
+def _in_progress_response():
+    return {
+        "success": False,
+        'code': ErrorCode.REQUEST_IN_PROGRESS.code,
+        'message': ErrorCode.REQUEST_IN_PROGRESS.message,
+        'errors': []
+    }
+
+
+def _json_replay(status_code, data):
+    response = JsonResponse(data, status=status_code)
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+
+class IdempotencyKeyContention(Exception):
+    """
+    Raised when a key could neither be claimed nor found, because other
+    requests kept inserting and expiring it.
+    """
+
+
+def reserve_idempotency_key(client, key, attempts=5):
+    """
+    Claims `key` for `client` by inserting its row, which the unique
+    constraint lets only one request do. Returns None if claimed, otherwise
+    the live row of the earlier request. Rows past the TTL, and claims
+    abandoned for longer than `EMAIL_IDEMPOTENCY_LOCK_TIMEOUT`, are deleted
+    and the insert is tried again, up to `attempts` times in all.
+    """
+    now = timezone.now()
+    expired_before = now - timedelta(seconds=get_idempotency_ttl())
+    abandoned_before = now - timedelta(seconds=get_idempotency_lock_timeout())
+    for _ in range(attempts):
+        try:
+            with transaction.atomic():
+                IdempotencyKey.objects.create(client=client, key=key)
+            return None
+        except IntegrityError:
+            existing = IdempotencyKey.objects.filter(client=client, key=key).first()
+            if existing is None:
+                # Deleted since the insert failed; try to claim it again
+                continue
+            stale_before = abandoned_before if existing.status_code is None else expired_before
+            if existing.created_at >= stale_before:
+                return existing
+            IdempotencyKey.objects.filter(
+                pk=existing.pk, created_at__lt=stale_before).delete()
+    raise IdempotencyKeyContention(
+        f"Could not claim idempotency key for client {client.pk} in {attempts} attempts")
+
+
+def store_idempotent_response(client, key, status_code, data):
+    IdempotencyKey.objects.filter(client=client, key=key).update(
+        status_code=status_code, response=data)
+    cache.set(_cache_key(client.user_id, key), (status_code, data),
+              timeout=get_idempotency_ttl())
+
+
+def release_idempotency_key(client, key):
+    IdempotencyKey.objects.filter(
+        client=client, key=key, status_code__isnull=True).delete()
+
+
+def purge_idempotency_keys():
+    """
+    Deletes keys older than the TTL. Returns the number deleted.
+    """
+    expired_before = timezone.now() - timedelta(seconds=get_idempotency_ttl())
+    deleted, _ = IdempotencyKey.objects.filter(created_at__lt=expired_before).delete()
+    return deleted
+
+
+def idempotent(view):
+    """
+    Makes a send view honour the `Idempotency-Key` header, scoped per Client.
+
+    A repeated key within `EMAIL_IDEMPOTENCY_TTL` seconds gets the original
+    successful response back without running the view again. The cache is
+    checked first; new keys are claimed with a single insert, which is also
+    how the database catches repeats the cache has lost. A repeat arriving
+    while the first request is still running gets a 409, and a key whose
+    request failed is released so it can be retried.
+
+    The Client looked up to claim a key is left on `request.client`, where
+    `get_request_client` finds it.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.META.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view(request, *args, **kwargs)
+        if len(key) > 255:
+            error_response = {
+                "success": False,
+                'code': ErrorCode.INVALID_REQUEST.code,
+                'message': ErrorCode.INVALID_REQUEST.message,
+                'errors': {'Idempotency-Key': ['Ensure this header has no more than 255 characters.']}
+            }
+            return Response(error_response, status=status.HTTP_400_BAD_REQUEST)
+
+        cache_key = _cache_key(request.user.pk, key)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return _replay(*cached)
+
+        client = Client.objects.filter(user=request.user).first()
+        if client is None:
+            return view(request, *args, **kwargs)
+        request.client = client
+
+        try:
+            existing = reserve_idempotency_key(client, key)
+        except IdempotencyKeyContention as e:
+            logger.warning(str(e))
+            return Response(_in_progress_response(), status=status.HTTP_409_CONFLICT)
+        if existing is not None:
+            if existing.status_code is not None:
+                # Cached only for what is left of the row's TTL
+                cache.set(cache_key, (existing.status_code, existing.response),
+                          timeout=_remaining_ttl(existing))
+                return _replay(existing.status_code, existing.response)
+            return Response(_in_progress_response(), status=status.HTTP_409_CONFLICT)
+
+        try:
+            response = view(request, *args, **kwargs)
+        except BaseException:
+            release_idempotency_key(client, key)
+            raise
+        if status.is_success(response.status_code):
+            store_idempotent_response(client, key, response.status_code, response.data)
+        else:
+            release_idempotency_key(client, key)
+        return response
+
+    return wrapper
+
+
+def async_idempotent(view):
+    """
+    `idempotent` for the async views, which authenticate the Client
+    themselves and return JsonResponse. The database steps run through the
+    thread async ORM queries share.
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        key = request.META.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return await view(request, *args, **kwargs)
+        if len(key) > 255:
+            error_response = {
+                "success": False,
+                'code': ErrorCode.INVALID_REQUEST.code,
+                'message': ErrorCode.INVALID_REQUEST.message,
+                'errors': {'Idempotency-Key': ['Ensure this header has no more than 255 characters.']}
+            }
+            return JsonResponse(error_response, status=status.HTTP_400_BAD_REQUEST)
+
+        client = request.client
+        cache_key = _cache_key(request.user.pk, key)
+        cached = await cache.aget(cache_key)
+        if cached is not None:
+            return _json_replay(*cached)
+
+        try:
+            existing = await sync_to_async(reserve_idempotency_key)(client, key)
+        except IdempotencyKeyContention as e:
+            logger.warning(str(e))
+            return JsonResponse(_in_progress_response(), status=status.HTTP_409_CONFLICT)
+        if existing is not None:
+            if existing.status_code is not None:
+                await cache.aset(cache_key, (existing.status_code, existing.response),
+                                 timeout=_remaining_ttl(existing))
+                return _json_replay(existing.status_code, existing.response)
+            return JsonResponse(_in_progress_response(), status=status.HTTP_409_CONFLICT)
+
+        try:
+            response = await view(request, *args, **kwargs)
+        except BaseException:
+            await sync_to_async(release_idempotency_key)(client, key)
+            raise
+        if status.is_success(response.status_code):
+            await sync_to_async(store_idempotent_response)(
+                client, key, response.status_code, json.loads(response.content))
+        else:
+            await sync_to_async(release_idempotency_key)(client, key)
+        return response
+
+    return wrapper
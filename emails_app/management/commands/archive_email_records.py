@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from emails_app.archive import archive_email_records, get_hot_days
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves email records older than the hot period into compressed "
+        "archive rows, one primary-key batch per transaction."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=None,
+                            help=f'Archive records older than this many days (default {get_hot_days()}).')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Number of records moved by each transaction.')
+        parser.add_argument('--sleep', type=float, default=0.0,
+                            help='Seconds to pause between batches.')
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Stop after moving this many records.')
+
+    def handle(self, *args, **options):
+        moved = archive_email_records(
+            older_than_days=options['older_than_days'], batch_size=options['batch_size'],
+            sleep=options['sleep'], limit=options['limit'])
+        self.stdout.write(self.style.SUCCESS(f'Archived {moved} email records.'))
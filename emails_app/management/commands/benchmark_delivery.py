@@ -0,0 +1,80 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from emails_app.benchmark import BENCHMARK_ENGINES, BENCHMARK_TASKS, DeliveryBenchmark, benchmark_is_isolated
+
+
+def int_list(value):
+    return [int(item) for item in value.split(',') if item.strip()]
+
+
+def name_list(choices):
+    def parse(value):
+        names = [item.strip() for item in value.split(',') if item.strip()]
+        unknown = set(names) - set(choices)
+        if unknown:
+            raise ValueError(f"unknown: {', '.join(sorted(unknown))}")
+        return names
+    return parse
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks delivery against a local SMTP sink, across tasks, delivery "
+        "engines, recipient counts, chunk sizes and attachment sizes, and prints "
+        "the results as JSON. Uses a throwaway client and never touches the "
+        "configured relay; in workers mode tasks go to EMAIL_BENCHMARK_QUEUE. "
+        "Runs only with settings that set EMAIL_BENCHMARK_ISOLATED, for a "
+        "database and broker of its own, unless --i-know is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=('eager', 'workers'), default='eager',
+                            help='Run tasks in this process, or on a local worker per scenario.')
+        parser.add_argument('--tasks', type=name_list(BENCHMARK_TASKS), default=list(BENCHMARK_TASKS),
+                            help='Comma-separated tasks: single, bulk, chunk.')
+        parser.add_argument('--engines', type=name_list(BENCHMARK_ENGINES), default=['pool'],
+                            help='Comma-separated delivery engines: pool, async.')
+        parser.add_argument('--recipients', type=int_list, default=[100],
+                            help='Comma-separated recipient counts.')
+        parser.add_argument('--chunk-sizes', type=int_list, default=[0],
+                            help='Comma-separated chunk sizes; 0 sizes chunks automatically.')
+        parser.add_argument('--attachment-sizes', type=int_list, default=[0],
+                            help='Comma-separated attachment sizes in bytes; 0 for none.')
+        parser.add_argument('--sink-latency', type=float, default=0.0,
+                            help='Seconds the SMTP sink waits before accepting each message.')
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help='Worker processes in workers mode.')
+        parser.add_argument('--timeout', type=float, default=300,
+                            help='Seconds to wait for each scenario to be delivered.')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+        parser.add_argument('--i-know', action='store_true',
+                            help='Run against a database and broker not marked EMAIL_BENCHMARK_ISOLATED.')
+
+    def handle(self, *args, **options):
+        if not (benchmark_is_isolated() or options['i_know']):
+            raise CommandError(
+                'The benchmark writes to the configured database and, in workers mode, publishes '
+                'to its broker. Use settings with a database and broker of their own and '
+                'EMAIL_BENCHMARK_ISOLATED = True, or pass --i-know.')
+        benchmark = DeliveryBenchmark(
+            mode=options['mode'], sink_latency=options['sink_latency'],
+            concurrency=options['concurrency'], timeout=options['timeout'])
+        scenarios = list(benchmark.scenarios(
+            options['tasks'], options['engines'], options['recipients'],
+            options['chunk_sizes'], options['attachment_sizes']))
+        if not scenarios:
+            raise CommandError('No scenarios to run.')
+
+        report = benchmark.run(scenarios)
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stdout.write(self.style.SUCCESS(
+                f"Wrote {len(report['results'])} results to {options['output']}."))
+        else:
+            self.stdout.write(output)
+        if not all(result['completed'] for result in report['results']):
+            raise CommandError('Some scenarios did not finish before the timeout.')
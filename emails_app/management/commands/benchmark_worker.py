@@ -0,0 +1,38 @@
+from celery import current_app
+from django.core.management.base import BaseCommand, CommandError
+
+from emails_app.benchmark import (
+    BENCHMARK_ENGINES, benchmark_is_isolated, benchmark_routing, get_benchmark_queue, pin_relay,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Starts a Celery worker that consumes EMAIL_BENCHMARK_QUEUE and delivers "
+        "to the given relay instead of the configured one. Started by "
+        "benchmark_delivery in workers mode."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--relay', required=True, help='host:port of the SMTP sink.')
+        parser.add_argument('--engine', choices=BENCHMARK_ENGINES, default='pool')
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--hostname', required=True)
+        parser.add_argument('--i-know', action='store_true',
+                            help='Run against a database and broker not marked EMAIL_BENCHMARK_ISOLATED.')
+
+    def handle(self, *args, **options):
+        if not (benchmark_is_isolated() or options['i_know']):
+            raise CommandError(
+                'The benchmark worker writes to the configured database. Use settings with a '
+                'database and broker of their own and EMAIL_BENCHMARK_ISOLATED = True, or pass --i-know.')
+        host, _, port = options['relay'].rpartition(':')
+        current_app.conf.task_always_eager = False
+        # Pinned and routed before the pool forks, so every child inherits it
+        with pin_relay(host, int(port), options['engine']), benchmark_routing():
+            current_app.worker_main([
+                'worker', '--loglevel', 'warning', '--pool', 'prefork',
+                '--concurrency', str(options['concurrency']),
+                '--hostname', options['hostname'],
+                '--queues', get_benchmark_queue(),
+            ])
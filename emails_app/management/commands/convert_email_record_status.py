@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Case, Max, Min, Value, When
+
+from emails_app.models import LEGACY_EMAIL_STATUSES, EmailRecord
+
+
+class Command(BaseCommand):
+    help = (
+        "Converts EmailRecord.status from the legacy 'Sent'/'Failed' strings to "
+        "EmailStatusChoices values, one primary-key range at a time so no "
+        "statement holds locks on more than a batch of rows."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Number of primary keys covered by each UPDATE.')
+        parser.add_argument('--sleep', type=float, default=0.0,
+                            help='Seconds to pause between batches.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        legacy = EmailRecord.objects.filter(status__in=LEGACY_EMAIL_STATUSES)
+        bounds = legacy.aggregate(low=Min('pk'), high=Max('pk'))
+        if bounds['low'] is None:
+            self.stdout.write(self.style.SUCCESS('No legacy statuses to convert.'))
+            return
+
+        new_status = Case(
+            *[When(status=old, then=Value(new)) for old, new in LEGACY_EMAIL_STATUSES.items()])
+        converted = 0
+        for start in range(bounds['low'], bounds['high'] + 1, batch_size):
+            # Each UPDATE runs in its own short autocommit transaction
+            converted += legacy.filter(
+                pk__gte=start, pk__lt=start + batch_size).update(status=new_status)
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Converted {converted} email records.'))
@@ -0,0 +1,44 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from emails_app.archive import ARCHIVE_FIELDS, search_email_records
+from emails_app.models import EmailStatusChoices
+
+
+def parse_moment(value):
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(value)
+        moment = timezone.datetime(day.year, day.month, day.day)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+class Command(BaseCommand):
+    help = (
+        "Prints email records matching the filters as CSV, from both the "
+        "archives and the hot table, for audits."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--client', type=int, help='Client ID.')
+        parser.add_argument('--recipient', help='Recipient address.')
+        parser.add_argument('--status', choices=EmailStatusChoices.values)
+        parser.add_argument('--since', type=parse_moment, help='Date or datetime, inclusive.')
+        parser.add_argument('--until', type=parse_moment, help='Date or datetime, exclusive.')
+
+    def handle(self, *args, **options):
+        if not any(options[name] for name in ('client', 'recipient', 'since', 'until')):
+            raise CommandError('Give at least one of --client, --recipient, --since or --until.')
+        writer = csv.writer(self.stdout)
+        writer.writerow(ARCHIVE_FIELDS)
+        for record in search_email_records(
+                client_id=options['client'], recipient=options['recipient'],
+                status=options['status'], since=options['since'], until=options['until']):
+            writer.writerow([record[field] for field in ARCHIVE_FIELDS])
@@ -0,0 +1,336 @@
+import bisect
+import contextvars
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from celery.signals import task_postrun, worker_process_shutdown
+from django.conf import settings
+from django.core.signals import request_finished
+
+logger = logging.getLogger("emails_app")
+
+STAGE_SECONDS = 'emails_stage_seconds'
+MESSAGES_TOTAL = 'emails_messages_total'
+AGGREGATE_FILE = 'aggregate.json'
+
+METRIC_HELP = {
+    STAGE_SECONDS: ('histogram', 'Seconds spent in each stage of accepting and delivering email.'),
+    MESSAGES_TOTAL: ('counter', 'Messages by final or retried delivery outcome.'),
+}
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_labels = contextvars.ContextVar('emails_app_metric_labels', default={})
+
+
+def metrics_enabled():
+    return getattr(settings, 'EMAIL_METRICS_ENABLED', True)
+
+
+def get_metrics_dir():
+    return getattr(settings, 'EMAIL_METRICS_DIR', None) or os.path.join(
+        tempfile.gettempdir(), 'emails_app_metrics')
+
+
+def set_labels(**labels):
+    """
+    Sets labels (e.g. client and task type) added to every metric recorded
+    by this thread or task until `clear_labels()`.
+    """
+    _labels.set({name: str(value) for name, value in labels.items() if value is not None})
+
+
+def clear_labels():
+    _labels.set({})
+
+
+def _key(labels):
+    return tuple(sorted({**_labels.get(), **labels}.items()))
+
+
+class MetricsRegistry:
+    """
+    Counters and histograms of one process, written every `flush_interval`
+    seconds to its own file in the metrics directory so that all processes,
+    including prefork workers, can be summed up by `collect()`.
+
+    A child inherits its parent's registry across fork(); the values are
+    dropped the first time the child records anything, since they are
+    already counted in the parent's file. Files of exited processes are
+    folded into an aggregate file by `collect()`, so counters never go
+    backwards while the directory doesn't grow with every recycled worker.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, flush_interval=None):
+        self.buckets = buckets
+        self.flush_interval = flush_interval or getattr(
+            settings, 'EMAIL_METRICS_FLUSH_INTERVAL', 5)
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._path = os.path.join(
+            get_metrics_dir(), f'{self._pid}-{uuid.uuid4().hex[:8]}.json')
+        self._counters = {}
+        self._histograms = {}
+        self._dirty = False
+        self._flusher = None
+
+    def _ensure_process(self):
+        # Called with the lock held
+        if self._pid != os.getpid():
+            self._reset()
+        if self._flusher is None:
+            self._flusher = threading.Thread(
+                target=self._flush_periodically, name='emails-metrics', daemon=True)
+            self._flusher.start()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _key(labels))
+        with self._lock:
+            self._ensure_process()
+            self._counters[key] = self._counters.get(key, 0) + value
+            self._dirty = True
+
+    def observe(self, name, value, **labels):
+        key = (name, _key(labels))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._ensure_process()
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            histogram[0][index] += 1
+            histogram[1] += value
+            self._dirty = True
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'buckets': list(self.buckets),
+                'counters': [[name, list(labels), value]
+                             for (name, labels), value in self._counters.items()],
+                'histograms': [[name, list(labels), list(counts), total]
+                               for (name, labels), (counts, total) in self._histograms.items()],
+            }
+
+    def flush(self):
+        """
+        Writes this process's values to its file, atomically.
+        """
+        with self._lock:
+            if not self._dirty or self._pid != os.getpid():
+                return
+            self._dirty = False
+        data = self.snapshot()
+        try:
+            os.makedirs(get_metrics_dir(), exist_ok=True)
+            temporary = f'{self._path}.tmp'
+            with open(temporary, 'w') as f:
+                json.dump(data, f)
+            os.replace(temporary, self._path)
+        except OSError as e:
+            logger.error(f"Error writing metrics: {str(e)}")
+
+    def _flush_periodically(self):
+        pid = os.getpid()
+        while pid == os.getpid():
+            time.sleep(self.flush_interval)
+            self.flush()
+
+
+registry = MetricsRegistry()
+
+
+def inc(name, value=1, **labels):
+    if value and metrics_enabled():
+        registry.inc(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    if metrics_enabled():
+        registry.observe(name, value, **labels)
+
+
+def count_messages(outcome, value=1, **labels):
+    inc(MESSAGES_TOTAL, value, outcome=outcome, **labels)
+
+
+@contextmanager
+def timed(stage, **labels):
+    """
+    Records how long the block took in the stage histogram, with an
+    `outcome` label of `ok` or `error`.
+    """
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        observe(STAGE_SECONDS, time.perf_counter() - started,
+                stage=stage, outcome=outcome, **labels)
+
+
+@worker_process_shutdown.connect
+def _flush_on_shutdown(**kwargs):
+    registry.flush()
+
+
+@task_postrun.connect
+@request_finished.connect
+def _clear_labels_after_work(**kwargs):
+    clear_labels()
+
+
+def _merge(data, counters, histograms):
+    for metric, labels, value in data['counters']:
+        key = (metric, tuple(tuple(label) for label in labels))
+        counters[key] = counters.get(key, 0) + value
+    for metric, labels, counts, total in data['histograms']:
+        key = (metric, tuple(tuple(label) for label in labels))
+        current = histograms.setdefault(key, [[0] * len(counts), 0.0])
+        current[0] = [a + b for a, b in zip(current[0], counts)]
+        current[1] += total
+
+
+def _process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _file_pid(name):
+    pid = name.split('-', 1)[0]
+    return int(pid) if pid.isdigit() and '-' in name else None
+
+
+def compact_metrics(directory=None):
+    """
+    Folds the files of processes that have exited into the aggregate file
+    and deletes them. Processes are looked up by the pid in the file name,
+    so the directory must only be shared by processes of one host.
+    """
+    directory = directory or get_metrics_dir()
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return
+    dead = [name for name in names if name.endswith('.json')
+            and _file_pid(name) is not None and not _process_exists(_file_pid(name))]
+    if not dead:
+        return
+
+    # Concurrent scrapes must not fold the same file in twice
+    with open(os.path.join(directory, '.compact.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        counters, histograms = {}, {}
+        aggregate = os.path.join(directory, AGGREGATE_FILE)
+        try:
+            with open(aggregate) as f:
+                _merge(json.load(f), counters, histograms)
+        except FileNotFoundError:
+            pass
+        merged = []
+        for name in dead:
+            path = os.path.join(directory, name)
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except FileNotFoundError:
+                continue  # Folded in by another scrape already
+            except (OSError, ValueError):
+                data = None
+            if data is not None and data['buckets'] == list(DEFAULT_BUCKETS):
+                _merge(data, counters, histograms)
+            merged.append(path)
+
+        temporary = f'{aggregate}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump({
+                'buckets': list(DEFAULT_BUCKETS),
+                'counters': [[name, list(labels), value]
+                             for (name, labels), value in counters.items()],
+                'histograms': [[name, list(labels), counts, total]
+                               for (name, labels), (counts, total) in histograms.items()],
+            }, f)
+        os.replace(temporary, aggregate)
+        for path in merged:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def collect():
+    """
+    Sums the files of every process into `(counters, histograms, buckets)`,
+    keyed by `(name, labels)`.
+    """
+    registry.flush()
+    directory = get_metrics_dir()
+    try:
+        compact_metrics(directory)
+    except OSError as e:
+        logger.error(f"Error compacting metrics: {str(e)}")
+    counters, histograms, buckets = {}, {}, list(DEFAULT_BUCKETS)
+    try:
+        names = [name for name in os.listdir(directory) if name.endswith('.json')]
+    except FileNotFoundError:
+        names = []
+    for name in names:
+        try:
+            with open(os.path.join(directory, name)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if data['buckets'] != buckets:
+            continue
+        _merge(data, counters, histograms)
+    return counters, histograms, buckets
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def render_prometheus():
+    """
+    All processes' metrics in the Prometheus text exposition format.
+    """
+    counters, histograms, buckets = collect()
+    lines = []
+    for metric, (kind, help_text) in METRIC_HELP.items():
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} {kind}')
+        for (name, labels), value in sorted(counters.items()):
+            if name == metric:
+                lines.append(f'{metric}{_format_labels(labels)} {value}')
+        for (name, labels), (counts, total) in sorted(histograms.items()):
+            if name != metric:
+                continue
+            cumulative = 0
+            for bound, count in zip(list(buckets) + ['+Inf'], counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{_format_labels(labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{metric}_sum{_format_labels(labels)} {total}')
+            lines.append(f'{metric}_count{_format_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
@@ -1,9 +1,13 @@
 
+import uuid
+
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
 
 from django.contrib.auth.models import User
 
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 
@@ -12,6 +16,34 @@ class TaskTypeChoices(models.TextChoices):
     BULK = 'bulk', _('Bulk Email')
 
 
+class BulkJobStatusChoices(models.TextChoices):
+    PENDING = 'pending', _('Pending')
+    RUNNING = 'running', _('Running')
+    COMPLETED = 'completed', _('Completed')
+    FAILED = 'failed', _('Failed')
+
+
+class EmailStatusChoices(models.TextChoices):
+    SENT = 'sent', _('Sent')
+    FAILED = 'failed', _('Failed')
+    SUPPRESSED = 'suppressed', _('Suppressed')
+
+
+# Status strings written before EmailStatusChoices, until converted with
+# the convert_email_record_status command
+LEGACY_EMAIL_STATUSES = {
+    'Sent': EmailStatusChoices.SENT,
+    'Failed': EmailStatusChoices.FAILED,
+}
+
+
+class SuppressionReasonChoices(models.TextChoices):
+    HARD_BOUNCE = 'hard_bounce', _('Hard Bounce')
+    UNSUBSCRIBED = 'unsubscribed', _('Unsubscribed')
+    COMPLAINT = 'complaint', _('Complaint')
+    MANUAL = 'manual', _('Manual')
+
+
 class SMTPSettings(models.Model):
     host = models.CharField(
         max_length=255,
@@ -46,6 +78,46 @@ class SMTPSettings(models.Model):
         verbose_name="Default From Email",
         help_text="The default email address to use for the 'From' field when sending emails."
     )
+    send_rate = models.FloatField(
+        blank=True,
+        null=True,
+        verbose_name="Send Rate",
+        help_text="Maximum messages per second across all workers. Leave empty for no limit."
+    )
+    send_burst = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+        verbose_name="Send Burst",
+        help_text="Messages that may be sent at once before the send rate applies. Defaults to one second's worth."
+    )
+    max_recipients_per_message = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+        verbose_name="Max Recipients per Message",
+        help_text="Most envelope recipients (RCPT TO) the relay accepts for one message in collective sends. Leave empty for the default."
+    )
+    weight = models.PositiveIntegerField(
+        default=1,
+        verbose_name="Weight",
+        help_text="Share of the traffic this relay gets relative to the other active relays."
+    )
+    max_connections = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+        verbose_name="Max Connections",
+        help_text="Most SMTP sessions each worker process keeps open to this relay. Leave empty for the default."
+    )
+    is_active = models.BooleanField(
+        default=True,
+        verbose_name="Active",
+        help_text="Whether workers send through this relay."
+    )
+    version = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name="Version",
+        help_text="Increases on every save so workers can tell their cached settings are stale."
+    )
 
     class Meta:
         verbose_name = "SMTP Setting"
@@ -63,7 +135,13 @@ class SMTPSettings(models.Model):
             self.port = 587
         else:
             self.port = 25  # Default SMTP port if neither TLS nor SSL is used
-        super(SMTPSettings, self).save(*args, **kwargs)
+        # The shared counter's row stays locked until the save commits, so
+        # concurrent saves of any relays get distinct, ordered versions
+        with transaction.atomic():
+            self.version = VersionCounter.next_value(
+                'smtp_settings', initial=lambda: SMTPSettings.objects.aggregate(
+                    latest=models.Max('version'))['latest'] or 0)
+            super(SMTPSettings, self).save(*args, **kwargs)
 
     def __str__(self):
         return f"SMTP Settings for {self.host}"
@@ -72,10 +150,8 @@ class SMTPSettings(models.Model):
 
 
 def get_smtp_settings():
-    try:
-        return SMTPSettings.objects.get()
-    except SMTPSettings.DoesNotExist:
-        return None
+    # The first active relay; see emails_app.relays for all of them
+    return SMTPSettings.objects.filter(is_active=True).order_by('pk').first()
 
 
 class Client(models.Model):
@@ -88,6 +164,24 @@ class Client(models.Model):
     static_ip = models.GenericIPAddressField(
         verbose_name="Static IP", unique=True, help_text="Static IP address of the client system"
     )
+    bulk_chunk_size = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+        verbose_name="Bulk Chunk Size",
+        help_text="Recipients per bulk sending task. Leave empty to size chunks automatically."
+    )
+    send_rate = models.FloatField(
+        blank=True,
+        null=True,
+        verbose_name="Send Rate",
+        help_text="Maximum messages per second for this client. Leave empty for no limit."
+    )
+    send_burst = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+        verbose_name="Send Burst",
+        help_text="Messages that may be sent at once before the send rate applies. Defaults to one second's worth."
+    )
 
     def __str__(self):
         return f"{self.system_name} ({self.static_ip})"
@@ -101,6 +195,8 @@ class EmailRecord(models.Model):
     client = models.ForeignKey(
         Client,
         on_delete=models.CASCADE,
+        # Covered by the leading column of the (client, timestamp) index
+        db_index=False,
         related_name='email_records',
         verbose_name="Client",
         help_text="The client associated with this email record."
@@ -116,8 +212,9 @@ class EmailRecord(models.Model):
     )
     status = models.CharField(
         max_length=10,
+        choices=EmailStatusChoices.choices,
         verbose_name="Status",
-        help_text="The status of the email (e.g., 'Sent', 'Failed')."
+        help_text="The status of the email (sent, failed or suppressed)."
     )
     error_message = models.TextField(
         blank=True,
@@ -144,3 +241,442 @@ class EmailRecord(models.Model):
     class Meta:
         verbose_name = "Email Record"
         verbose_name_plural = "Email Records"
+        indexes = [
+            models.Index(fields=['client', '-timestamp'],
+                         name='emailrecord_client_ts_idx'),
+            models.Index(fields=['status', '-timestamp'],
+                         name='emailrecord_status_ts_idx'),
+            models.Index(fields=['recipient'],
+                         name='emailrecord_recipient_idx'),
+            # Failures are rare, so a partial index keeps them cheap to list
+            models.Index(fields=['client', '-timestamp'],
+                         name='emailrecord_failed_ts_idx',
+                         condition=models.Q(status=EmailStatusChoices.FAILED)),
+        ]
+
+
+class AttachmentBlob(models.Model):
+    digest = models.CharField(
+        max_length=64,
+        primary_key=True,
+        verbose_name="Digest",
+        help_text="SHA-256 of the attachment content, used as its storage key."
+    )
+    size = models.PositiveBigIntegerField(
+        verbose_name="Size",
+        help_text="The size of the attachment in bytes."
+    )
+    references = models.IntegerField(
+        default=0,
+        verbose_name="References",
+        help_text="The number of pending tasks that still need this attachment."
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name="Created At"
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name="Updated At",
+        help_text="The last time a task acquired or released this attachment."
+    )
+
+    def __str__(self):
+        return f'{self.digest} ({self.size} bytes, {self.references} references)'
+
+    class Meta:
+        verbose_name = "Attachment Blob"
+        verbose_name_plural = "Attachment Blobs"
+
+
+class RecipientList(models.Model):
+    client = models.ForeignKey(
+        Client,
+        on_delete=models.CASCADE,
+        related_name='recipient_lists',
+        verbose_name="Client",
+        help_text="The client that uploaded this recipient list."
+    )
+    source_name = models.CharField(
+        max_length=255,
+        blank=True,
+        verbose_name="Source Name",
+        help_text="The name of the uploaded recipient file."
+    )
+    total_rows = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Total Rows",
+        help_text="The number of non-empty rows read from the file."
+    )
+    valid_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Valid Recipients",
+        help_text="The number of distinct valid recipients stored."
+    )
+    invalid_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Invalid Rows",
+        help_text="The number of rows that did not hold a valid email address."
+    )
+    duplicate_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Duplicate Rows",
+        help_text="The number of valid rows repeating an address already in the list."
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name="Created At"
+    )
+
+    def __str__(self):
+        return f'{self.source_name or "Recipient list"} ({self.valid_count} recipients)'
+
+    class Meta:
+        verbose_name = "Recipient List"
+        verbose_name_plural = "Recipient Lists"
+
+
+class RecipientListEntry(models.Model):
+    recipient_list = models.ForeignKey(
+        RecipientList,
+        on_delete=models.CASCADE,
+        related_name='entries',
+        verbose_name="Recipient List"
+    )
+    email = models.EmailField(
+        verbose_name="Email",
+        help_text="The normalized email address of the recipient."
+    )
+
+    def __str__(self):
+        return self.email
+
+    class Meta:
+        verbose_name = "Recipient List Entry"
+        verbose_name_plural = "Recipient List Entries"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipient_list', 'email'], name='unique_recipient_list_email'),
+        ]
+
+
+class BulkJob(models.Model):
+    id = models.UUIDField(
+        primary_key=True,
+        default=uuid.uuid4,
+        editable=False,
+        verbose_name="Job ID"
+    )
+    client = models.ForeignKey(
+        Client,
+        on_delete=models.CASCADE,
+        related_name='bulk_jobs',
+        verbose_name="Client",
+        help_text="The client that started this bulk job."
+    )
+    subject = models.CharField(
+        max_length=255,
+        verbose_name="Subject",
+        help_text="The subject of the email."
+    )
+    status = models.CharField(
+        max_length=10,
+        choices=BulkJobStatusChoices.choices,
+        default=BulkJobStatusChoices.PENDING,
+        verbose_name="Status"
+    )
+    total = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Total",
+        help_text="The number of recipients in the job."
+    )
+    sent = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Sent",
+        help_text="The number of recipients the email was sent to."
+    )
+    failed = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Failed",
+        help_text="The number of recipients the email could not be sent to."
+    )
+    suppressed = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Suppressed",
+        help_text="The number of recipients skipped because they are on the suppression list."
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name="Created At"
+    )
+    completed_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name="Completed At"
+    )
+
+    @property
+    def pending(self):
+        return max(self.total - self.sent - self.failed - self.suppressed, 0)
+
+    @classmethod
+    def record_progress(cls, job_id, sent=0, failed=0, suppressed=0):
+        """
+        Adds a chunk's outcome to the job's counters with a single atomic
+        UPDATE, then marks the job completed once every recipient is
+        accounted for. The completion UPDATE only matches while the job is
+        still open, so exactly one chunk completes it.
+        """
+        if not job_id or not (sent or failed or suppressed):
+            return
+        cls.objects.filter(pk=job_id).update(
+            sent=F('sent') + sent, failed=F('failed') + failed,
+            suppressed=F('suppressed') + suppressed)
+        cls.objects.filter(
+            pk=job_id, completed_at__isnull=True,
+            total__lte=F('sent') + F('failed') + F('suppressed')
+        ).update(status=BulkJobStatusChoices.COMPLETED, completed_at=timezone.now())
+
+    @classmethod
+    def mark_running(cls, job_id):
+        if job_id:
+            cls.objects.filter(pk=job_id, status=BulkJobStatusChoices.PENDING).update(
+                status=BulkJobStatusChoices.RUNNING)
+
+    @classmethod
+    def mark_failed(cls, job_id):
+        """
+        Fails every recipient not yet accounted for, e.g. when the job could
+        not be fanned out at all.
+        """
+        if job_id:
+            cls.objects.filter(pk=job_id, completed_at__isnull=True).update(
+                status=BulkJobStatusChoices.FAILED,
+                failed=F('total') - F('sent') - F('suppressed'),
+                completed_at=timezone.now())
+
+    def __str__(self):
+        return f'{self.subject} ({self.sent + self.failed + self.suppressed}/{self.total})'
+
+    class Meta:
+        verbose_name = "Bulk Job"
+        verbose_name_plural = "Bulk Jobs"
+
+
+class VersionCounter(models.Model):
+    name = models.CharField(
+        max_length=100,
+        unique=True,
+        verbose_name="Name",
+        help_text="What the counter versions, e.g. 'smtp_settings'."
+    )
+    value = models.PositiveBigIntegerField(
+        default=0,
+        verbose_name="Value",
+        help_text="The last version handed out."
+    )
+
+    def __str__(self):
+        return f'{self.name} ({self.value})'
+
+    class Meta:
+        verbose_name = "Version Counter"
+        verbose_name_plural = "Version Counters"
+
+    @classmethod
+    def next_value(cls, name, initial=None):
+        """
+        Increments the `name` counter with a single atomic UPDATE and returns
+        its new value. A new counter starts from `initial()`, if given. Call
+        inside a transaction to keep other callers waiting until it commits.
+        """
+        with transaction.atomic():
+            if not cls.objects.filter(name=name).update(value=F('value') + 1):
+                cls.objects.bulk_create([cls(name=name, value=initial() if initial else 0)],
+                                        ignore_conflicts=True)
+                cls.objects.filter(name=name).update(value=F('value') + 1)
+            return cls.objects.values_list('value', flat=True).get(name=name)
+
+
+class RateLimitBucket(models.Model):
+    key = models.CharField(
+        max_length=100,
+        unique=True,
+        verbose_name="Key",
+        help_text="What the bucket limits, e.g. 'client:3' or 'relay:1'."
+    )
+    tokens = models.FloatField(
+        default=0,
+        verbose_name="Tokens",
+        help_text="Messages that may be sent right now."
+    )
+    refilled_at = models.FloatField(
+        default=0,
+        verbose_name="Refilled At",
+        help_text="Unix time of the last refill."
+    )
+
+    def __str__(self):
+        return f'{self.key} ({self.tokens:.1f} tokens)'
+
+    class Meta:
+        verbose_name = "Rate Limit Bucket"
+        verbose_name_plural = "Rate Limit Buckets"
+
+
+class IdempotencyKey(models.Model):
+    client = models.ForeignKey(
+        Client,
+        on_delete=models.CASCADE,
+        related_name='idempotency_keys',
+        verbose_name="Client",
+        help_text="The client that sent the key."
+    )
+    key = models.CharField(
+        max_length=255,
+        verbose_name="Key",
+        help_text="Value of the Idempotency-Key request header."
+    )
+    status_code = models.PositiveSmallIntegerField(
+        blank=True,
+        null=True,
+        verbose_name="Status Code",
+        help_text="Status of the original response, empty while it is being processed."
+    )
+    response = models.JSONField(
+        blank=True,
+        null=True,
+        verbose_name="Response",
+        help_text="Body of the original response."
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        db_index=True,
+        verbose_name="Created At"
+    )
+
+    def __str__(self):
+        return f'{self.client} {self.key}'
+
+    class Meta:
+        verbose_name = "Idempotency Key"
+        verbose_name_plural = "Idempotency Keys"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['client', 'key'], name='unique_client_idempotency_key'),
+        ]
+
+
+class EmailRecordArchive(models.Model):
+    client = models.ForeignKey(
+        Client,
+        on_delete=models.CASCADE,
+        related_name='email_record_archives',
+        verbose_name="Client",
+        help_text="The client whose email records are archived."
+    )
+    period_start = models.DateTimeField(
+        verbose_name="Period Start",
+        help_text="Timestamp of the oldest record in the batch."
+    )
+    period_end = models.DateTimeField(
+        verbose_name="Period End",
+        help_text="Timestamp of the newest record in the batch."
+    )
+    first_record_id = models.BigIntegerField(
+        verbose_name="First Record ID",
+        help_text="ID the oldest record had in the email record table."
+    )
+    last_record_id = models.BigIntegerField(
+        verbose_name="Last Record ID",
+        help_text="ID the newest record had in the email record table."
+    )
+    record_count = models.PositiveIntegerField(
+        verbose_name="Records",
+        help_text="Number of records in the batch."
+    )
+    sent_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Sent"
+    )
+    failed_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Failed"
+    )
+    data = models.BinaryField(
+        verbose_name="Data",
+        help_text="The records as zlib-compressed CSV."
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name="Archived At"
+    )
+
+    def __str__(self):
+        return f'{self.record_count} records of {self.client} from {self.period_start:%Y-%m-%d}'
+
+    class Meta:
+        verbose_name = "Email Record Archive"
+        verbose_name_plural = "Email Record Archives"
+        indexes = [
+            models.Index(fields=['client', 'period_start'],
+                         name='emailarchive_client_start_idx'),
+            models.Index(fields=['period_start', 'period_end'],
+                         name='emailarchive_period_idx'),
+        ]
+
+
+class SuppressedRecipient(models.Model):
+    client = models.ForeignKey(
+        Client,
+        on_delete=models.CASCADE,
+        blank=True,
+        null=True,
+        related_name='suppressed_recipients',
+        verbose_name="Client",
+        help_text="The client whose emails skip this address. Leave empty to suppress it for every client."
+    )
+    email = models.CharField(
+        max_length=254,
+        verbose_name="Email",
+        help_text="The suppressed address, lower-cased."
+    )
+    reason = models.CharField(
+        max_length=20,
+        choices=SuppressionReasonChoices.choices,
+        default=SuppressionReasonChoices.MANUAL,
+        verbose_name="Reason",
+        help_text="Why nothing should be sent to this address."
+    )
+    note = models.TextField(
+        blank=True,
+        default='',
+        verbose_name="Note",
+        help_text="Details such as the bounce reply from the relay."
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name="Created At"
+    )
+
+    def save(self, *args, **kwargs):
+        self.email = self.email.strip().lower()
+        super(SuppressedRecipient, self).save(*args, **kwargs)
+
+    def __str__(self):
+        return f'{self.email} ({self.get_reason_display()})'
+
+    class Meta:
+        verbose_name = "Suppressed Recipient"
+        verbose_name_plural = "Suppressed Recipients"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['client', 'email'], name='unique_client_suppression'),
+            # NULLs never collide, so global entries need their own constraint
+            models.UniqueConstraint(
+                fields=['email'], condition=models.Q(client__isnull=True),
+                name='unique_global_suppression'),
+        ]
+        indexes = [
+            models.Index(fields=['email'], name='suppression_email_idx'),
+        ]
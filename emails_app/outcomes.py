@@ -0,0 +1,92 @@
+import smtplib
+
+
+def _reply_text(message):
+    if isinstance(message, bytes):
+        return message.decode('utf-8', 'replace')
+    return str(message)
+
+
+def is_permanent_failure(error):
+    """
+    Tells whether a delivery error is final for the recipient: a 5xx reply to
+    the recipient or the message. Connection, authentication and sender
+    problems, 4xx replies and anything else are transient and may be retried.
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+        return bool(codes) and all(500 <= code < 600 for code in codes)
+    if isinstance(error, (smtplib.SMTPConnectError, smtplib.SMTPAuthenticationError,
+                          smtplib.SMTPSenderRefused)):
+        return False
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 500 <= error.smtp_code < 600
+    return False
+
+
+def is_relay_failure(error):
+    """
+    Tells whether a delivery error points at the relay itself rather than at
+    the message or a recipient: it can't be reached, dropped the session,
+    refused to log in or to take mail, or is temporarily out of service.
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return any(code == 421 for code, _ in error.recipients.values())
+    if isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError,
+                          smtplib.SMTPAuthenticationError, smtplib.SMTPSenderRefused)):
+        return True
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    return isinstance(error, (OSError, smtplib.SMTPException))
+
+
+def describe_error(error):
+    """
+    A short, readable error message for the email record.
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return '; '.join(f'{recipient}: {code} {_reply_text(message)}'
+                         for recipient, (code, message) in error.recipients.items())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return f'{error.smtp_code} {_reply_text(error.smtp_error)}'
+    return str(error) or error.__class__.__name__
+
+
+def split_outcomes(items, results):
+    """
+    Sorts `items` by the `(refused, error)` delivery result each one got.
+
+    Returns `(delivered, permanent, transient)`, where `delivered` lists the
+    items and the other two list `(item, error)` pairs.
+    """
+    delivered, permanent, transient = [], [], []
+    for item, (refused, error) in zip(items, results):
+        if error is None and refused:
+            error = smtplib.SMTPRecipientsRefused(refused)
+        if error is None:
+            delivered.append(item)
+        elif is_permanent_failure(error):
+            permanent.append((item, error))
+        else:
+            transient.append((item, error))
+    return delivered, permanent, transient
+
+
+def expand_batch_results(envelopes, results):
+    """
+    Turns the `(refused, error)` result of each multi-recipient envelope into
+    one result per envelope recipient, in order, from the server's reply to
+    that recipient's RCPT command.
+    """
+    expanded = []
+    for (_, recipients, _), (refused, error) in zip(envelopes, results):
+        for recipient in recipients:
+            if isinstance(error, smtplib.SMTPRecipientsRefused) and recipient in error.recipients:
+                expanded.append(({recipient: error.recipients[recipient]}, None))
+            elif error is not None:
+                expanded.append((None, error))
+            elif refused and recipient in refused:
+                expanded.append(({recipient: refused[recipient]}, None))
+            else:
+                expanded.append(({}, None))
+    return expanded
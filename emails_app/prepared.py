@@ -0,0 +1,152 @@
+import threading
+from collections import OrderedDict
+from email import encoders
+from email.mime.base import MIMEBase
+from email.utils import formatdate, make_msgid
+
+from django.conf import settings
+from django.core.mail.message import sanitize_address
+from django.core.mail.utils import DNS_NAME
+
+from .streaming import StreamingData, split_streamed
+
+PER_RECIPIENT_HEADERS = (b'to', b'message-id', b'date')
+UNDISCLOSED_RECIPIENTS = b'undisclosed-recipients:;'
+
+
+def _strip_headers(header_block, names):
+    """
+    Removes the named headers, including their folded continuation lines,
+    from a CRLF-separated header block.
+    """
+    kept = []
+    skipping = False
+    for line in header_block.split(b'\r\n'):
+        if line[:1] in (b' ', b'\t'):
+            if not skipping:
+                kept.append(line)
+            continue
+        name = line.split(b':', 1)[0].strip().lower()
+        skipping = name in names
+        if not skipping:
+            kept.append(line)
+    return b'\r\n'.join(kept)
+
+
+class PreparedMessage:
+    """
+    An email whose MIME body and attachments have been encoded once.
+
+    Each envelope only splices To, Message-ID and Date headers in front of
+    the cached bytes, so sending the same message to many recipients, or
+    again hours later, doesn't re-encode the body or the attachments for
+    each one. Attachments added with `attach_streamed` aren't cached at
+    all; they are read from storage while each envelope is sent.
+    """
+
+    def __init__(self, email_message):
+        self.encoding = email_message.encoding or settings.DEFAULT_CHARSET
+        self.from_email = sanitize_address(
+            email_message.from_email, self.encoding)
+        data = email_message.message().as_bytes(linesep='\r\n')
+        header_block, _, self.body = data.partition(b'\r\n\r\n')
+        self.headers = _strip_headers(header_block, PER_RECIPIENT_HEADERS)
+        streamed = getattr(email_message, 'streamed_attachments', None)
+        self.body_segments = split_streamed(self.body, streamed) if streamed else None
+
+    def envelope(self, recipient):
+        """
+        Returns the `(from_email, recipients, data)` triple to hand to the
+        SMTP connection for one recipient.
+        """
+        to = sanitize_address(recipient, self.encoding)
+        return self._envelope([to], to.encode())
+
+    def batch_envelope(self, recipients):
+        """
+        Returns one envelope delivering the message to all `recipients` as
+        blind copies: they are only named in RCPT TO, never in the headers.
+        """
+        return self._envelope(
+            [sanitize_address(recipient, self.encoding) for recipient in recipients],
+            UNDISCLOSED_RECIPIENTS)
+
+    def _envelope(self, recipients, to_header):
+        head = b''.join([
+            b'To: ', to_header, b'\r\n',
+            b'Message-ID: ', make_msgid(domain=DNS_NAME).encode(), b'\r\n',
+            b'Date: ', formatdate(localtime=settings.EMAIL_USE_LOCALTIME).encode(), b'\r\n',
+            self.headers, b'\r\n\r\n',
+        ])
+        if self.body_segments:
+            return self.from_email, recipients, StreamingData([head] + self.body_segments)
+        return self.from_email, recipients, head + self.body
+
+
+def message_envelope(email_message):
+    """
+    Serializes an EmailMessage into the `(from_email, recipients, data)`
+    triple the delivery engines send, as Django's SMTP backend would.
+    """
+    encoding = email_message.encoding or settings.DEFAULT_CHARSET
+    data = email_message.message().as_bytes(linesep='\r\n')
+    streamed = getattr(email_message, 'streamed_attachments', None)
+    if streamed:
+        data = StreamingData(split_streamed(data, streamed))
+    return (
+        sanitize_address(email_message.from_email, encoding),
+        [sanitize_address(address, encoding)
+         for address in email_message.recipients()],
+        data,
+    )
+
+
+class PreparedMessageCache:
+    """
+    Small per-process LRU of prepared messages keyed by bulk job, so every
+    chunk of a job that lands on the same worker reuses the encoded bytes.
+    """
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size or getattr(
+            settings, 'EMAIL_PREPARED_MESSAGE_CACHE_SIZE', 4)
+        self._messages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, job_key, build_message):
+        """
+        Returns the prepared message for `job_key`, calling `build_message()`
+        for the EmailMessage to prepare when it isn't cached yet.
+        """
+        if job_key is None:
+            return PreparedMessage(build_message())
+        with self._lock:
+            prepared = self._messages.get(job_key)
+            if prepared is not None:
+                self._messages.move_to_end(job_key)
+                return prepared
+        prepared = PreparedMessage(build_message())
+        with self._lock:
+            self._messages[job_key] = prepared
+            while len(self._messages) > self.max_size:
+                self._messages.popitem(last=False)
+        return prepared
+
+
+prepared_messages = PreparedMessageCache()
+
+
+def build_attachment_parts(attachments):
+    """
+    Encodes `(name, content, content_type)` attachments into MIME parts that
+    can be attached to any number of messages without being encoded again.
+    """
+    parts = []
+    for file_name, content, content_type in attachments:
+        maintype, _, subtype = (content_type or 'application/octet-stream').partition('/')
+        part = MIMEBase(maintype, subtype or 'octet-stream')
+        part.set_payload(content)
+        encoders.encode_base64(part)
+        part.add_header('Content-Disposition', 'attachment', filename=file_name)
+        parts.append(part)
+    return parts
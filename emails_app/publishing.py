@@ -0,0 +1,39 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def get_publish_executor():
+    """
+    Returns this process's pool of publisher threads, sized by
+    `EMAIL_PUBLISH_THREADS`. A pool inherited across fork() is replaced,
+    since its threads don't exist in the child.
+    """
+    global _executor, _executor_pid
+    pid = os.getpid()
+    with _executor_lock:
+        if _executor is None or _executor_pid != pid:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'EMAIL_PUBLISH_THREADS', 4),
+                thread_name_prefix='emails-publish')
+            _executor_pid = pid
+    return _executor
+
+
+async def publish(task, *args, **kwargs):
+    """
+    Publishes `task` to the broker from a publisher thread and waits for it
+    without blocking the event loop. A slow or reconnecting broker ties up
+    at most the publisher threads, never the threads other requests need.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_publish_executor(), partial(task.delay, *args, **kwargs))
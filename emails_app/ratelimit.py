@@ -0,0 +1,130 @@
+import logging
+import math
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import RateLimitBucket
+
+logger = logging.getLogger("emails_app")
+
+TokenBucket = namedtuple('TokenBucket', ['key', 'rate', 'burst'])
+
+
+def make_bucket(key, rate, burst=None):
+    """
+    Returns a TokenBucket refilling at `rate` messages per second, or None if
+    `rate` is not set. The burst defaults to one second's worth of tokens.
+    """
+    if not rate or rate <= 0:
+        return None
+    return TokenBucket(key, float(rate), max(1, burst or math.ceil(rate)))
+
+
+def get_send_buckets(client, snapshot):
+    """
+    The buckets a send for `client` through the relay in `snapshot` must take
+    tokens from: the client's own limit and the relay's limit, where set.
+    """
+    buckets = [
+        make_bucket(f'client:{client.pk}', client.send_rate, client.send_burst),
+        make_bucket(f'relay:{snapshot.key}',
+                    snapshot.send_rate, snapshot.send_burst),
+    ]
+    return [bucket for bucket in buckets if bucket is not None]
+
+
+def take_tokens(buckets, wanted):
+    """
+    Refills `buckets` and takes up to `wanted` tokens from every one of them,
+    atomically across processes. Returns `(granted, wait)`, where `wait` is
+    how long to sleep before trying again if nothing was granted.
+    """
+    if not buckets:
+        return wanted, 0
+    limits = {bucket.key: bucket for bucket in buckets}
+    with transaction.atomic():
+        # Lock rows in key order so concurrent takers can't deadlock
+        rows = list(RateLimitBucket.objects.select_for_update().filter(
+            key__in=limits).order_by('key'))
+        if len(rows) < len(limits):
+            now = time.time()
+            RateLimitBucket.objects.bulk_create([
+                RateLimitBucket(key=key, tokens=bucket.burst, refilled_at=now)
+                for key, bucket in limits.items()
+            ], ignore_conflicts=True)
+            rows = list(RateLimitBucket.objects.select_for_update().filter(
+                key__in=limits).order_by('key'))
+
+        now = time.time()
+        for row in rows:
+            bucket = limits[row.key]
+            elapsed = max(0.0, now - row.refilled_at)
+            row.tokens = min(bucket.burst, row.tokens + elapsed * bucket.rate)
+            row.refilled_at = now
+
+        granted = min(wanted, int(min(row.tokens for row in rows)))
+        for row in rows:
+            row.tokens -= granted
+            row.save(update_fields=['tokens', 'refilled_at'])
+
+    if granted:
+        return granted, 0
+    # Wait for a full burst (or all that is wanted) rather than a single
+    # token, so throttled senders take tokens in batches, not one by one
+    needed = min(wanted, min(bucket.burst for bucket in buckets))
+    wait = max((needed - row.tokens) / limits[row.key].rate for row in rows)
+    return 0, max(wait, 0.01)
+
+
+def wait_for_tokens(buckets, wanted):
+    """
+    Blocks until `wanted` tokens have been taken from every bucket, sleeping
+    between attempts rather than failing. Returns `wanted`.
+    """
+    taken = 0
+    while taken < wanted:
+        granted, wait = take_tokens(buckets, wanted - taken)
+        taken += granted
+        if not granted:
+            time.sleep(wait)
+    return wanted
+
+
+def throttle(items, buckets, batch_size=None, weight=None):
+    """
+    Yields `items` in consecutive slices no faster than `buckets` allow,
+    waiting for tokens between slices. With no buckets, yields `items` whole.
+
+    Each item takes one token, or `weight(item)` tokens when given, e.g. one
+    per recipient of a batched envelope.
+    """
+    if not buckets:
+        if items:
+            yield items
+        return
+    batch_size = batch_size or getattr(settings, 'EMAIL_RATE_LIMIT_BATCH', 50)
+    if weight is not None:
+        position = 0
+        while position < len(items):
+            # At least one item per slice, however heavy it is
+            end, tokens = position + 1, weight(items[position])
+            while end < len(items) and tokens + weight(items[end]) <= batch_size:
+                tokens += weight(items[end])
+                end += 1
+            wait_for_tokens(buckets, tokens)
+            yield items[position:end]
+            position = end
+        return
+    position = 0
+    while position < len(items):
+        granted, wait = take_tokens(
+            buckets, min(batch_size, len(items) - position))
+        if not granted:
+            logger.debug(f"Rate limited, waiting {wait:.2f}s for a token")
+            time.sleep(wait)
+            continue
+        yield items[position:position + granted]
+        position += granted
@@ -0,0 +1,152 @@
+import csv
+import io
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+
+from .models import RecipientListEntry
+
+RECIPIENT_FILE_FORMATS = ('csv', 'ndjson')
+EMAIL_COLUMN_NAMES = ('email', 'email_address', 'recipient')
+
+
+def guess_file_format(file_name):
+    if file_name and file_name.lower().endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    return 'csv'
+
+
+def normalize_email(address):
+    """
+    Strips whitespace and lower-cases the domain part, which is
+    case-insensitive, so the same mailbox dedupes to a single address.
+    """
+    address = address.strip()
+    local_part, at, domain = address.rpartition('@')
+    if not at:
+        return address
+    return f'{local_part}@{domain.lower()}'
+
+
+def _iter_csv_rows(text):
+    reader = csv.reader(text)
+    column = 0
+    first_row = True
+    for row in reader:
+        if not any(cell.strip() for cell in row):
+            continue
+        if first_row:
+            first_row = False
+            header = [cell.strip().lower() for cell in row]
+            names = [name for name in EMAIL_COLUMN_NAMES if name in header]
+            if names:
+                column = header.index(names[0])
+                continue
+        yield reader.line_num, row[column] if column < len(row) else ''
+
+
+def _iter_ndjson_rows(text):
+    for line_number, line in enumerate(text, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            value = json.loads(line)
+        except ValueError:
+            yield line_number, None
+            continue
+        if isinstance(value, dict):
+            value = value.get('email')
+        yield line_number, value if isinstance(value, str) else None
+
+
+def iter_recipient_rows(uploaded_file, file_format):
+    """
+    Yields `(line_number, raw_address)` for every non-empty row of a CSV or
+    NDJSON recipient file, reading it incrementally. `raw_address` is None
+    for rows that could not be parsed.
+    """
+    uploaded_file.seek(0)
+    text = io.TextIOWrapper(
+        uploaded_file.file, encoding='utf-8-sig', errors='replace', newline='')
+    try:
+        if file_format == 'ndjson':
+            yield from _iter_ndjson_rows(text)
+        else:
+            yield from _iter_csv_rows(text)
+    finally:
+        # Leave closing the upload to Django
+        text.detach()
+
+
+def ingest_recipient_file(recipient_list, uploaded_file, file_format, batch_size=None, max_reported_errors=None):
+    """
+    Validates and normalizes the addresses in `uploaded_file` and stores them
+    as entries of `recipient_list` in batches, so memory use does not grow
+    with the size of the file. Duplicates are dropped by the unique
+    constraint on the entries.
+
+    Updates and returns `recipient_list` with its counters filled in, plus
+    the first `max_reported_errors` invalid rows as `{'line', 'value'}` dicts.
+    """
+    batch_size = batch_size or getattr(
+        settings, 'EMAIL_RECIPIENT_BATCH_SIZE', 1000)
+    max_reported_errors = max_reported_errors if max_reported_errors is not None else getattr(
+        settings, 'EMAIL_RECIPIENT_MAX_REPORTED_ERRORS', 100)
+
+    errors = []
+    batch = set()
+    total_rows = valid_rows = invalid_rows = 0
+
+    def flush():
+        RecipientListEntry.objects.bulk_create(
+            [RecipientListEntry(recipient_list=recipient_list, email=email)
+             for email in batch],
+            ignore_conflicts=True)
+        batch.clear()
+
+    for line_number, raw_address in iter_recipient_rows(uploaded_file, file_format):
+        total_rows += 1
+        address = normalize_email(raw_address) if raw_address else ''
+        try:
+            if len(address) > RecipientListEntry._meta.get_field('email').max_length:
+                raise ValidationError('Email address is too long.')
+            validate_email(address)
+        except ValidationError:
+            invalid_rows += 1
+            if len(errors) < max_reported_errors:
+                errors.append({'line': line_number, 'value': raw_address})
+            continue
+        valid_rows += 1
+        batch.add(address)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+
+    recipient_list.total_rows = total_rows
+    recipient_list.invalid_count = invalid_rows
+    recipient_list.valid_count = recipient_list.entries.count()
+    recipient_list.duplicate_count = valid_rows - recipient_list.valid_count
+    recipient_list.save(update_fields=[
+        'total_rows', 'invalid_count', 'valid_count', 'duplicate_count'])
+    return recipient_list, errors
+
+
+def iter_recipient_chunks(recipient_list, chunk_size):
+    """
+    Yields the addresses of `recipient_list` in chunks of `chunk_size`,
+    paging by primary key so no query has to skip over earlier rows.
+    """
+    last_pk = 0
+    while True:
+        rows = list(
+            recipient_list.entries.filter(pk__gt=last_pk)
+            .order_by('pk').values_list('pk', 'email')[:chunk_size]
+        )
+        if not rows:
+            return
+        last_pk = rows[-1][0]
+        yield [email for _, email in rows]
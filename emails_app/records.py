@@ -0,0 +1,70 @@
+import logging
+import time
+
+from django.conf import settings
+
+from .metrics import timed
+from .models import EmailRecord
+
+logger = logging.getLogger("emails_app")
+
+
+class EmailRecordBuffer:
+    """
+    Collects EmailRecord rows and writes them with `bulk_create`.
+
+    Rows are flushed once `max_size` rows are pending or `max_delay` seconds
+    have passed since the first pending row, and always when the buffer is
+    used as a context manager and the block exits, even on an exception.
+    """
+
+    def __init__(self, max_size=None, max_delay=None):
+        self.max_size = max_size or getattr(
+            settings, 'EMAIL_RECORD_BUFFER_SIZE', 500)
+        self.max_delay = max_delay if max_delay is not None else getattr(
+            settings, 'EMAIL_RECORD_BUFFER_DELAY', 5)
+        self._pending = []
+        self._first_added = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, **fields):
+        if not self._pending:
+            self._first_added = time.monotonic()
+        self._pending.append(EmailRecord(**fields))
+        if len(self._pending) >= self.max_size or time.monotonic() - self._first_added >= self.max_delay:
+            self.flush()
+
+    def add_many(self, recipients, **fields):
+        """
+        Adds one row per recipient, all sharing the remaining fields.
+        """
+        for recipient in recipients:
+            self.add(recipient=recipient, **fields)
+
+    def flush(self):
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, []
+        self._first_added = None
+        with timed('record_insert'):
+            if len(pending) == 1:
+                # A plain INSERT is cheaper than bulk_create for a single row
+                pending[0].save(force_insert=True)
+            else:
+                EmailRecord.objects.bulk_create(pending, batch_size=self.max_size)
+        return len(pending)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.flush()
+        except Exception as e:
+            if exc_type is None:
+                raise
+            # Don't mask the original error with the flush failure
+            logger.error(f"Error flushing email records: {str(e)}")
+        return False
@@ -0,0 +1,132 @@
+import logging
+import random
+import smtplib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .relays import get_relays
+
+logger = logging.getLogger("emails_app")
+
+RELAY_HEALTH_CACHE_KEY = 'emails_app:relay_health:{}'
+RELAY_PROBE_CACHE_KEY = 'emails_app:relay_probe:{}'
+
+
+class NoRelayAvailable(smtplib.SMTPException):
+    """
+    Raised, and treated as a transient failure, when every relay is out of
+    rotation.
+    """
+
+
+def get_failure_threshold():
+    return getattr(settings, 'EMAIL_RELAY_FAILURE_THRESHOLD', 3)
+
+
+def get_max_error_rate():
+    return getattr(settings, 'EMAIL_RELAY_MAX_ERROR_RATE', 0.5)
+
+
+def get_cooldown():
+    return getattr(settings, 'EMAIL_RELAY_COOLDOWN', 30)
+
+
+def get_max_cooldown():
+    return getattr(settings, 'EMAIL_RELAY_COOLDOWN_MAX', 600)
+
+
+def get_relay_health(relay):
+    """
+    The shared health of `relay`: moving averages of its error rate and of
+    its seconds per message, the number of consecutive failed deliveries,
+    and until when it is out of rotation.
+    """
+    return cache.get(RELAY_HEALTH_CACHE_KEY.format(relay.key)) or {
+        'error_rate': 0.0, 'latency': None, 'failures': 0,
+        'down_until': 0, 'cooldown': 0,
+    }
+
+
+def record_relay_result(relay, delivered, failed, elapsed, alpha=0.2):
+    """
+    Folds one delivery call to `relay` into its health: `failed` messages
+    got relay-level errors, `delivered` ones did not, and the call took
+    `elapsed` seconds. Takes the relay out of rotation for a cooldown after
+    too many consecutive failures or too high an error rate; a relay that
+    trips again right after its cooldown stays out twice as long.
+
+    Like the send latency, the health is shared through the cache and
+    concurrent updates may overwrite each other.
+    """
+    total = delivered + failed
+    if total <= 0:
+        return
+    health = get_relay_health(relay)
+    health['error_rate'] = alpha * (failed / total) + (1 - alpha) * health['error_rate']
+    if delivered:
+        observed = elapsed / total
+        health['latency'] = observed if health['latency'] is None else (
+            alpha * observed + (1 - alpha) * health['latency'])
+        health['failures'] = 0
+    else:
+        health['failures'] += 1
+
+    now = time.time()
+    tripped = (health['failures'] >= get_failure_threshold()
+               or health['error_rate'] >= get_max_error_rate())
+    probing = health['down_until'] and now >= health['down_until']
+    if probing and delivered:
+        logger.info(f"SMTP relay {relay} is back in rotation")
+        health.update(error_rate=0.0, failures=0, down_until=0, cooldown=0)
+    elif tripped and (not health['down_until'] or probing):
+        # A failed probe doubles the cooldown, a fresh trip starts over
+        health['cooldown'] = min(get_max_cooldown(), health['cooldown'] * 2) if probing else get_cooldown()
+        health['down_until'] = now + health['cooldown']
+        logger.warning(f"Taking SMTP relay {relay} out of rotation for {health['cooldown']}s "
+                       f"(error rate {health['error_rate']:.2f}, {health['failures']} failures)")
+    cache.set(RELAY_HEALTH_CACHE_KEY.format(relay.key), health, timeout=None)
+    if probing:
+        cache.delete(RELAY_PROBE_CACHE_KEY.format(relay.key))
+
+
+def is_relay_available(relay, health=None):
+    """
+    Tells whether sends may go to `relay`. Once its cooldown is over, one
+    caller at a time gets to probe it with a real delivery.
+    """
+    health = health or get_relay_health(relay)
+    if not health['down_until']:
+        return True
+    if time.time() < health['down_until']:
+        return False
+    return cache.add(RELAY_PROBE_CACHE_KEY.format(relay.key), True, timeout=health['cooldown'] or get_cooldown())
+
+
+def choose_relay(exclude=()):
+    """
+    Picks an active relay in rotation at random, in proportion to its
+    weight, scaled down by its error rate and by how much slower it is than
+    the fastest relay. Relays keyed in `exclude` are skipped. Raises
+    NoRelayAvailable if there is none.
+    """
+    candidates = []
+    for relay in get_relays():
+        if relay.key in exclude or relay.weight <= 0:
+            continue
+        health = get_relay_health(relay)
+        if is_relay_available(relay, health):
+            candidates.append((relay, health))
+    if not candidates:
+        raise NoRelayAvailable("No SMTP relay is in rotation")
+
+    latencies = [health['latency'] for _, health in candidates if health['latency']]
+    fastest = min(latencies) if latencies else None
+    weights = []
+    for relay, health in candidates:
+        weight = relay.weight * max(0.01, 1 - health['error_rate'])
+        if fastest and health['latency']:
+            weight *= fastest / health['latency']
+        weights.append(weight)
+    return random.choices([relay for relay, _ in candidates], weights=weights)[0]
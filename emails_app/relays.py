@@ -0,0 +1,164 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max
+
+from .models import SMTPSettings
+
+logger = logging.getLogger("emails_app")
+
+SETTINGS_VERSION_CACHE_KEY = 'emails_app:smtp_settings_version'
+
+
+class SMTPSettingsSnapshot:
+    """
+    An immutable copy of the SMTP settings row taken at a given version, so
+    workers never read `django.conf.settings` or the database per message.
+    """
+
+    def __init__(self, smtp_settings, version):
+        self.version = version
+        self.pk = smtp_settings.pk if smtp_settings else None
+        self.send_rate = smtp_settings.send_rate if smtp_settings else getattr(
+            settings, 'EMAIL_RELAY_SEND_RATE', None)
+        self.send_burst = smtp_settings.send_burst if smtp_settings else getattr(
+            settings, 'EMAIL_RELAY_SEND_BURST', None)
+        self.max_recipients_per_message = (
+            smtp_settings and smtp_settings.max_recipients_per_message) or getattr(
+            settings, 'EMAIL_MAX_RECIPIENTS_PER_MESSAGE', 50)
+        self.weight = smtp_settings.weight if smtp_settings else 1
+        self.max_connections = smtp_settings.max_connections if smtp_settings else None
+        self.host = smtp_settings.host if smtp_settings else None
+        self.port = smtp_settings.port if smtp_settings else None
+        self.username = smtp_settings.username if smtp_settings else None
+        self.password = smtp_settings.password if smtp_settings else None
+        self.use_tls = smtp_settings.use_tls if smtp_settings else None
+        self.use_ssl = smtp_settings.use_ssl if smtp_settings else None
+        self.default_from_email = (smtp_settings.default_from_email if smtp_settings
+                                   else settings.DEFAULT_FROM_EMAIL)
+
+    @property
+    def key(self):
+        # Names the relay in rate-limit buckets, pools and health state
+        return str(self.pk) if self.pk is not None else 'default'
+
+    def __str__(self):
+        return f'{self.host}:{self.port}' if self.host else 'default relay'
+
+    def connection_kwargs(self):
+        """
+        Keyword arguments for `get_connection`. Empty without a settings row,
+        which falls back to the EMAIL_* Django settings.
+        """
+        if self.host is None:
+            return {}
+        return {
+            'host': self.host,
+            'port': self.port,
+            'username': self.username,
+            'password': self.password,
+            'use_tls': self.use_tls,
+            'use_ssl': self.use_ssl,
+        }
+
+
+def publish_settings_version(version):
+    cache.set(SETTINGS_VERSION_CACHE_KEY, version, timeout=None)
+
+
+def read_settings_version():
+    """
+    Returns the current settings version from the cache, falling back to the
+    database. The fallback is cached only briefly, so a per-process cache
+    backend still notices changes made in other processes.
+    """
+    version = cache.get(SETTINGS_VERSION_CACHE_KEY)
+    if version is None:
+        version = SMTPSettings.objects.aggregate(
+            version=Max('version'))['version'] or 0
+        cache.set(SETTINGS_VERSION_CACHE_KEY, version, timeout=getattr(
+            settings, 'EMAIL_SETTINGS_VERSION_TTL', 60))
+    return version
+
+
+class SMTPSettingsCache:
+    """
+    Per-process cache of the active SMTP relays. The shared version number is
+    checked at most once every `check_interval` seconds, and the rows are
+    only reloaded when that version has changed. Without any active row, the
+    EMAIL_* Django settings form a single default relay.
+    """
+
+    def __init__(self, check_interval=None):
+        self.check_interval = check_interval if check_interval is not None else getattr(
+            settings, 'EMAIL_SETTINGS_CHECK_INTERVAL', 5)
+        self._relays = None
+        self._pinned = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def get_all(self):
+        """
+        Returns the snapshots of every active relay, in primary key order.
+        """
+        if self._pinned is not None:
+            return self._pinned
+        now = time.monotonic()
+        if self._relays is not None and now - self._checked_at < self.check_interval:
+            return self._relays
+        with self._lock:
+            if self._relays is None or now - self._checked_at >= self.check_interval:
+                version = read_settings_version()
+                if self._relays is None or self._relays[0].version != version:
+                    rows = SMTPSettings.objects.filter(is_active=True).order_by('pk')
+                    self._relays = [SMTPSettingsSnapshot(row, version) for row in rows] or [
+                        SMTPSettingsSnapshot(None, version)]
+                    logger.info(f"Loaded SMTP settings version {version} "
+                                f"with {len(self._relays)} relay(s)")
+                self._checked_at = now
+        return self._relays
+
+    def get(self):
+        # The primary relay, whose default From address every message uses
+        return self.get_all()[0]
+
+    def clear(self):
+        with self._lock:
+            self._relays = None
+            self._checked_at = 0
+
+    def pin(self, *snapshots):
+        """
+        Serves `snapshots` in this process, ignoring the database, until
+        `unpin()`. Used to point benchmarks at a local SMTP sink.
+        """
+        self._pinned = list(snapshots)
+
+    def unpin(self):
+        self._pinned = None
+
+
+smtp_settings_cache = SMTPSettingsCache()
+
+
+def get_smtp_snapshot():
+    return smtp_settings_cache.get()
+
+
+def get_relays():
+    return smtp_settings_cache.get_all()
+
+
+def get_max_recipients_per_message():
+    """
+    The envelope recipient limit every active relay accepts, so batched
+    envelopes can fail over from one relay to another.
+    """
+    return min(relay.max_recipients_per_message for relay in get_relays())
+
+
+def get_default_from_email():
+    return get_smtp_snapshot().default_from_email
@@ -0,0 +1,79 @@
+import math
+import os
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+
+SEND_LATENCY_CACHE_KEY = 'emails_app:send_latency'
+
+
+def record_send_latency(elapsed, message_count, alpha=0.2):
+    """
+    Folds the per-message SMTP latency observed by a worker into a moving
+    average shared through the cache. Concurrent updates may overwrite each
+    other, which only slows the average down a little.
+    """
+    if message_count <= 0:
+        return
+    observed = elapsed / message_count
+    current = cache.get(SEND_LATENCY_CACHE_KEY)
+    if current is not None:
+        observed = alpha * observed + (1 - alpha) * current
+    cache.set(SEND_LATENCY_CACHE_KEY, observed, timeout=None)
+
+
+def get_send_latency():
+    """
+    Returns the moving average of seconds spent per message, falling back to
+    `EMAIL_DEFAULT_SEND_LATENCY` until workers have reported any.
+    """
+    latency = cache.get(SEND_LATENCY_CACHE_KEY)
+    if latency is None:
+        latency = getattr(settings, 'EMAIL_DEFAULT_SEND_LATENCY', 0.5)
+    return latency
+
+
+def get_worker_concurrency():
+    return (getattr(settings, 'EMAIL_WORKER_CONCURRENCY', None)
+            or getattr(settings, 'CELERY_WORKER_CONCURRENCY', None)
+            or os.cpu_count()
+            or 1)
+
+
+def compute_chunk_size(recipient_count, override=None, concurrency=None, latency=None, budget=None):
+    """
+    Picks how many recipients each chunk task gets.
+
+    A chunk should take about `EMAIL_CHUNK_TIME_BUDGET` seconds to send at the
+    current per-message latency, but small jobs are still split so that every
+    worker process gets a share. An explicit `override` wins.
+    """
+    max_size = getattr(settings, 'EMAIL_MAX_CHUNK_SIZE', 1000)
+    if override:
+        return max(1, min(override, max_size))
+
+    concurrency = concurrency or get_worker_concurrency()
+    latency = max(latency or get_send_latency(), 0.001)
+    budget = budget or getattr(settings, 'EMAIL_CHUNK_TIME_BUDGET', 30)
+
+    by_budget = int(budget / latency)
+    by_parallelism = math.ceil(recipient_count / concurrency)
+    return max(1, min(by_budget, by_parallelism, max_size))
+
+
+def retry_countdown(retries, base=None, cap=None):
+    """
+    Seconds to wait before retry number `retries + 1`: exponential backoff
+    from `EMAIL_RETRY_BACKOFF`, capped at `EMAIL_RETRY_BACKOFF_MAX`, with
+    random jitter over the upper half so retries of many chunks spread out
+    instead of hitting the relay together.
+    """
+    base = base or getattr(settings, 'EMAIL_RETRY_BACKOFF', 60)
+    cap = cap or getattr(settings, 'EMAIL_RETRY_BACKOFF_MAX', 900)
+    delay = min(cap, base * 2 ** retries)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def get_max_retries():
+    return getattr(settings, 'EMAIL_MAX_RETRIES', 3)
@@ -1,5 +1,11 @@
+from django.conf import settings
+from django.template import TemplateSyntaxError
 from rest_framework import serializers
 
+from emails_app.models import BulkJob, SuppressedRecipient, SuppressionReasonChoices
+from emails_app.recipients import RECIPIENT_FILE_FORMATS
+from emails_app.templating import compile_template
+
 
 class EmailSerializer(serializers.Serializer):
     subject = serializers.CharField(max_length=255)
@@ -23,14 +29,39 @@ class BulkEmailSerializer(serializers.Serializer):
     subject = serializers.CharField(max_length=255)
     message = serializers.CharField(required=False, allow_null=True)
     recipient_list = serializers.ListField(
-        child=serializers.EmailField()
+        child=serializers.EmailField(), required=False
     )
+    # Rows of merge fields, one per recipient, each with an 'email' key.
+    # When given, subject, message and html_message are rendered as
+    # templates against each row.
+    recipient_context = serializers.JSONField(
+        required=False, allow_null=True, binary=True)
     attachments = serializers.ListField(
         child=serializers.FileField(max_length=100000), required=False, allow_null=True
     )
     html_message = serializers.CharField(required=False, allow_null=True)
     collective = serializers.BooleanField(
         required=False, allow_null=True, default=False)
+    chunk_size = serializers.IntegerField(
+        required=False, allow_null=True, min_value=1)
+
+    def validate_recipient_context(self, value):
+        if value is None:
+            return value
+        if not isinstance(value, list) or not value:
+            raise serializers.ValidationError(
+                "Must be a non-empty list of objects.")
+        email_field = serializers.EmailField()
+        for index, row in enumerate(value):
+            if not isinstance(row, dict):
+                raise serializers.ValidationError(
+                    f"Row {index}: must be an object.")
+            try:
+                row['email'] = email_field.run_validation(row.get('email'))
+            except serializers.ValidationError as e:
+                raise serializers.ValidationError(
+                    f"Row {index}: email: {' '.join(e.detail)}")
+        return value
 
     def validate(self, data):
         message = data.get('message')
@@ -38,4 +69,88 @@ class BulkEmailSerializer(serializers.Serializer):
         if not message and not html_message:
             raise serializers.ValidationError(
                 "Either 'message' or 'html_message' must be provided.")
+        if data.get('recipient_context'):
+            if data.get('recipient_list'):
+                raise serializers.ValidationError(
+                    "Provide either 'recipient_list' or 'recipient_context', not both.")
+            if data.get('collective'):
+                raise serializers.ValidationError(
+                    "Personalised emails can not be sent collectively.")
+            for field in ('subject', 'message', 'html_message'):
+                if data.get(field):
+                    try:
+                        compile_template(data[field])
+                    except TemplateSyntaxError as e:
+                        raise serializers.ValidationError(
+                            {field: [f"Invalid template: {e}"]})
+        elif not data.get('recipient_list'):
+            raise serializers.ValidationError(
+                "Either 'recipient_list' or 'recipient_context' must be provided.")
         return data
+
+
+class BatchEmailSerializer(serializers.Serializer):
+    # Distinct messages, each an EmailSerializer object. They are validated
+    # one by one, so an invalid message doesn't reject the others
+    messages = serializers.JSONField()
+    # Shared by every message of the batch
+    attachments = serializers.ListField(
+        child=serializers.FileField(max_length=100000), required=False, allow_null=True
+    )
+
+    def validate_messages(self, value):
+        max_messages = getattr(settings, 'EMAIL_BATCH_MAX_MESSAGES', 500)
+        if not isinstance(value, list) or not value:
+            raise serializers.ValidationError(
+                "Must be a non-empty list of objects.")
+        if len(value) > max_messages:
+            raise serializers.ValidationError(
+                f"Ensure this list has no more than {max_messages} messages.")
+        return value
+
+
+class BulkEmailFileSerializer(serializers.Serializer):
+    subject = serializers.CharField(max_length=255)
+    message = serializers.CharField(required=False, allow_null=True)
+    recipient_file = serializers.FileField()
+    file_format = serializers.ChoiceField(
+        choices=RECIPIENT_FILE_FORMATS, required=False, allow_null=True)
+    attachments = serializers.ListField(
+        child=serializers.FileField(max_length=100000), required=False, allow_null=True
+    )
+    html_message = serializers.CharField(required=False, allow_null=True)
+    chunk_size = serializers.IntegerField(
+        required=False, allow_null=True, min_value=1)
+
+    def validate(self, data):
+        message = data.get('message')
+        html_message = data.get('html_message')
+        if not message and not html_message:
+            raise serializers.ValidationError(
+                "Either 'message' or 'html_message' must be provided.")
+        return data
+
+
+class BulkJobSerializer(serializers.ModelSerializer):
+    pending = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = BulkJob
+        fields = ['id', 'subject', 'status', 'total', 'sent',
+                  'failed', 'suppressed', 'pending', 'created_at', 'completed_at']
+        read_only_fields = fields
+
+
+class SuppressedRecipientSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = SuppressedRecipient
+        fields = ['id', 'email', 'reason', 'note', 'created_at']
+        read_only_fields = fields
+
+
+class SuppressionSerializer(serializers.Serializer):
+    emails = serializers.ListField(
+        child=serializers.EmailField(), allow_empty=False, max_length=10000)
+    reason = serializers.ChoiceField(
+        choices=SuppressionReasonChoices.choices, required=False, default=SuppressionReasonChoices.MANUAL)
+    note = serializers.CharField(required=False, allow_blank=True, default='')
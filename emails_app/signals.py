@@ -1,17 +1,23 @@
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save, pre_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 
-from emails_app.models import Client, SMTPSettings
-from emails_app.utils import generate_unique_api_key, set_smtp_settings
+from emails_app.models import Client, SMTPSettings, SuppressedRecipient
+from emails_app.clients import bump_clients_generation, client_ip_cache
+from emails_app.relays import publish_settings_version
+from emails_app.suppression import bump_suppression_generation
+from emails_app.utils import generate_unique_api_key
 
 
 @receiver(post_save, sender=SMTPSettings)
 def update_smtp_settings(sender, instance, created, **kwargs):
     """
-    Signal receiver to update SMTP settings when SMTPSettings model is saved.
+    Signal receiver to publish the new settings version when SMTPSettings
+    model is saved, so every web and worker process reloads its copy.
     """
-    set_smtp_settings()
+    version = instance.version
+    transaction.on_commit(lambda: publish_settings_version(version))
 
 
 # @receiver(post_save, sender=Client)
@@ -55,3 +61,25 @@ def handle_user_for_client(sender, instance, **kwargs):
                 instance.user = user
             else:
                 instance.user = existing_user
+
+
+@receiver(post_save, sender=Client)
+@receiver(post_delete, sender=Client)
+def invalidate_client_cache(sender, instance, **kwargs):
+    """
+    Drops cached static IP lookups in this process right away and in every
+    other process once the change is committed.
+    """
+    client_ip_cache.clear()
+    transaction.on_commit(bump_clients_generation)
+
+
+@receiver(post_save, sender=SuppressedRecipient)
+@receiver(post_delete, sender=SuppressedRecipient)
+def invalidate_suppression_index(sender, instance, created=False, **kwargs):
+    """
+    New entries are picked up incrementally; edited or deleted ones make
+    every process reload its suppression index.
+    """
+    if not created:
+        transaction.on_commit(bump_suppression_generation)
@@ -0,0 +1,227 @@
+import logging
+import os
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+
+from celery.signals import worker_process_shutdown
+from django.conf import settings
+from django.core.mail import get_connection
+
+from .metrics import timed
+from .relays import get_smtp_snapshot
+from .streaming import stream_sendmail
+
+logger = logging.getLogger("emails_app")
+
+
+class PooledSession:
+    """
+    A single authenticated SMTP session kept open between messages.
+
+    Wraps a Django email backend whose connection has already been opened, so
+    `send_messages` reuses it instead of doing a connect/TLS/login round-trip
+    per message.
+    """
+
+    def __init__(self, **connection_kwargs):
+        self.backend = get_connection(fail_silently=False, **connection_kwargs)
+        self.backend.open()
+        self.opened_at = time.monotonic()
+        self.last_used = self.opened_at
+        self.message_count = 0
+
+    def is_expired(self, max_messages, max_age):
+        if max_messages and self.message_count >= max_messages:
+            return True
+        if max_age and time.monotonic() - self.opened_at >= max_age:
+            return True
+        return False
+
+    def is_alive(self):
+        """
+        Checks the session with a NOOP; any non-250 reply or socket error
+        means the server has dropped us.
+        """
+        connection = getattr(self.backend, 'connection', None)
+        if connection is None:
+            return False
+        try:
+            status = connection.noop()[0]
+        except (smtplib.SMTPException, OSError):
+            return False
+        return status == 250
+
+    def deliver(self, from_email, recipients, data):
+        """
+        Writes already-serialized message bytes, or StreamingData, to the
+        session and returns the recipients the server refused, if any were
+        accepted.
+        """
+        with timed('smtp_data'):
+            if isinstance(data, bytes):
+                refused = self.backend.connection.sendmail(from_email, recipients, data)
+            else:
+                refused = stream_sendmail(self.backend.connection, from_email, recipients, data)
+        self.message_count += 1
+        self.last_used = time.monotonic()
+        return refused
+
+    def close(self):
+        try:
+            self.backend.close()
+        except Exception:
+            pass
+
+
+class SMTPConnectionPool:
+    """
+    Per-process pool of authenticated SMTP sessions to one relay.
+
+    Sessions are recycled after `max_messages` messages or `max_age` seconds
+    and are checked with NOOP when they have been idle for longer than
+    `noop_interval` seconds.
+    """
+
+    def __init__(self, max_size=None, max_messages=None, max_age=None, noop_interval=None, **connection_kwargs):
+        self.max_size = max_size or getattr(settings, 'EMAIL_POOL_MAX_SIZE', 4)
+        self.max_messages = max_messages if max_messages is not None else getattr(
+            settings, 'EMAIL_POOL_MAX_MESSAGES', 100)
+        self.max_age = max_age if max_age is not None else getattr(
+            settings, 'EMAIL_POOL_MAX_AGE', 300)
+        self.noop_interval = noop_interval if noop_interval is not None else getattr(
+            settings, 'EMAIL_POOL_NOOP_INTERVAL', 15)
+        self.connection_kwargs = connection_kwargs
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                session = self._idle.pop() if self._idle else None
+            if session is None:
+                with timed('smtp_connect'):
+                    return PooledSession(**self.connection_kwargs)
+            if session.is_expired(self.max_messages, self.max_age):
+                session.close()
+                continue
+            idle_for = time.monotonic() - session.last_used
+            if idle_for >= self.noop_interval and not session.is_alive():
+                logger.info("Discarding SMTP session dropped by the server")
+                session.close()
+                continue
+            return session
+
+    def _checkin(self, session):
+        if session.is_expired(self.max_messages, self.max_age):
+            session.close()
+            return
+        with self._lock:
+            if len(self._idle) < self.max_size:
+                self._idle.append(session)
+                return
+        session.close()
+
+    @contextmanager
+    def session(self):
+        """
+        Yields a live session and returns it to the pool afterwards. A session
+        that raised is closed rather than reused.
+        """
+        session = self._checkout()
+        try:
+            yield session
+        except BaseException:
+            session.close()
+            raise
+        self._checkin(session)
+
+    def deliver_raw(self, envelopes):
+        """
+        Sends each envelope and returns a `(refused, error)` pair per envelope,
+        in order, like `AsyncDeliveryEngine.deliver`. A message the server
+        rejects doesn't stop the others; if the session drops, it reconnects
+        once and every envelope not yet sent after that gets the error.
+        """
+        envelopes = list(envelopes)
+        results = []
+        reconnected = False
+        while len(results) < len(envelopes):
+            try:
+                with self.session() as session:
+                    for envelope in envelopes[len(results):]:
+                        try:
+                            results.append((session.deliver(*envelope), None))
+                        except smtplib.SMTPServerDisconnected:
+                            raise
+                        except smtplib.SMTPException as e:
+                            # smtplib has already reset the transaction
+                            results.append((None, e))
+            except smtplib.SMTPServerDisconnected as e:
+                if not reconnected:
+                    reconnected = True
+                    logger.info("SMTP session dropped, reconnecting")
+                    continue
+                error = e
+            except (smtplib.SMTPException, OSError) as e:
+                error = e
+            else:
+                continue
+            results.extend((None, error) for _ in envelopes[len(results):])
+        return results
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for session in idle:
+            session.close()
+
+
+_pools = {}
+_pools_pid = None
+_pools_version = None
+_pools_lock = threading.Lock()
+
+
+def get_connection_pool(relay=None):
+    """
+    Returns this process's SMTP connection pool for `relay`, the primary
+    relay by default, creating it on first use. Pools inherited across
+    fork() are discarded, since their sockets belong to the parent, and
+    every pool is rebuilt whenever the SMTP settings version changes.
+    """
+    global _pools, _pools_pid, _pools_version
+    relay = relay or get_smtp_snapshot()
+    pid = os.getpid()
+    stale = []
+    with _pools_lock:
+        if _pools_pid != pid or _pools_version != relay.version:
+            if _pools_pid == pid:
+                stale = list(_pools.values())
+            _pools = {}
+            _pools_pid = pid
+            _pools_version = relay.version
+        pool = _pools.get(relay.key)
+        if pool is None:
+            pool = _pools[relay.key] = SMTPConnectionPool(
+                max_size=relay.max_connections, **relay.connection_kwargs())
+    if stale:
+        logger.info("SMTP settings changed, closing pooled sessions")
+        for stale_pool in stale:
+            stale_pool.close()
+    return pool
+
+
+def close_connection_pool():
+    global _pools
+    with _pools_lock:
+        pools, _pools = _pools, {}
+    if _pools_pid == os.getpid():
+        for pool in pools.values():
+            pool.close()
+
+
+@worker_process_shutdown.connect
+def _close_pool_on_shutdown(**kwargs):
+    close_connection_pool()
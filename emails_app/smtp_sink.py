@@ -0,0 +1,170 @@
+import asyncio
+import threading
+import time
+
+
+class SMTPSink:
+    """
+    A local asyncio SMTP server that accepts and discards mail, for testing
+    and benchmarking delivery without a real relay.
+
+    It advertises PIPELINING, accepts any AUTH, waits `latency` seconds
+    before answering each DATA transfer, and refuses recipients for which
+    `reject(address)` returns an `(code, message)` reply. With
+    `record_arrivals`, the time each message was accepted is kept in
+    `arrivals` as `(time.monotonic(), recipients)`.
+
+    For testing failures, it hangs up in the middle of DATA for messages
+    where `drop(recipients)` is true, and with `starttls` it offers and
+    agrees to STARTTLS but hangs up instead of negotiating TLS.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, reject=None, record_arrivals=False,
+                 drop=None, starttls=False):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.reject = reject
+        self.record_arrivals = record_arrivals
+        self.drop = drop
+        self.starttls = starttls
+        self.arrivals = []
+        self.message_count = 0
+        self.recipient_count = 0
+        self.session_count = 0
+        self.messages = []
+        self.keep_messages = False
+        self._server = None
+        self._loop = None
+        self._thread = None
+
+    async def _reply(self, writer, line):
+        writer.write(line.encode() + b'\r\n')
+        await writer.drain()
+
+    async def _handle(self, reader, writer):
+        self.session_count += 1
+        mail_from, rcpts = None, []
+        await self._reply(writer, '220 sink ESMTP ready')
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                command = line.decode('utf-8', 'replace').strip()
+                verb = command[:4].upper()
+                if verb in ('EHLO', 'HELO'):
+                    starttls = '250-STARTTLS\r\n' if self.starttls else ''
+                    await self._reply(writer, f'250-sink\r\n250-PIPELINING\r\n250-8BITMIME\r\n{starttls}250 AUTH PLAIN LOGIN')
+                elif verb == 'STAR' and self.starttls:
+                    await self._reply(writer, '220 Ready to start TLS')
+                    return
+                elif verb == 'AUTH':
+                    await self._reply(writer, '235 Authentication successful')
+                elif verb == 'MAIL':
+                    mail_from, rcpts = command[10:].strip(), []
+                    await self._reply(writer, '250 OK')
+                elif verb == 'RCPT':
+                    address = command[8:].strip().strip('<>')
+                    refusal = self.reject(address) if self.reject else None
+                    if refusal:
+                        await self._reply(writer, f'{refusal[0]} {refusal[1]}')
+                    else:
+                        rcpts.append(address)
+                        await self._reply(writer, '250 OK')
+                elif verb == 'DATA':
+                    if not rcpts:
+                        await self._reply(writer, '554 No valid recipients')
+                        continue
+                    await self._reply(writer, '354 End data with <CR><LF>.<CR><LF>')
+                    if self.drop and self.drop(rcpts):
+                        await reader.readline()
+                        return
+                    size = 0
+                    chunks = []
+                    while True:
+                        data_line = await reader.readline()
+                        if not data_line:
+                            # Dropped before the final dot: nothing delivered
+                            return
+                        if data_line == b'.\r\n':
+                            break
+                        size += len(data_line)
+                        if self.keep_messages:
+                            chunks.append(data_line)
+                    if self.latency:
+                        await asyncio.sleep(self.latency)
+                    self.message_count += 1
+                    self.recipient_count += len(rcpts)
+                    if self.record_arrivals:
+                        self.arrivals.append((time.monotonic(), rcpts))
+                    if self.keep_messages:
+                        self.messages.append((mail_from, rcpts, b''.join(chunks)))
+                    mail_from, rcpts = None, []
+                    await self._reply(writer, f'250 OK queued ({size} bytes)')
+                elif verb == 'RSET':
+                    mail_from, rcpts = None, []
+                    await self._reply(writer, '250 OK')
+                elif verb == 'NOOP':
+                    await self._reply(writer, '250 OK')
+                elif verb == 'QUIT':
+                    await self._reply(writer, '221 Bye')
+                    return
+                else:
+                    await self._reply(writer, '502 Command not implemented')
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def start_server(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self._server
+
+    def start(self):
+        """
+        Runs the sink on its own event loop in a daemon thread and returns once
+        it is listening, so synchronous code can send to it.
+        """
+        ready = threading.Event()
+
+        def run():
+            loop = self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.start_server())
+            ready.set()
+            loop.run_forever()
+            # Drop sessions clients left open before closing the loop
+            pending = asyncio.all_tasks(loop)
+            for task in pending:
+                task.cancel()
+            loop.run_until_complete(
+                asyncio.gather(*pending, return_exceptions=True))
+            loop.close()
+
+        self._thread = threading.Thread(target=run, name='smtp-sink', daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        if self._loop is None:
+            return
+        self._loop.call_soon_threadsafe(self._server.close)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+        self._loop = None
+
+    def wait_for(self, message_count, timeout=30):
+        deadline = time.monotonic() + timeout
+        while self.message_count < message_count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self.message_count >= message_count
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
@@ -0,0 +1,171 @@
+import base64
+import smtplib
+import uuid
+from email.mime.base import MIMEBase
+
+from django.conf import settings
+
+from .async_delivery import quote_data
+from .attachments import blob_path, get_attachment_storage
+from .models import AttachmentBlob
+
+CRLF = b'\r\n'
+# Raw bytes per 76-character base64 line
+BASE64_LINE_BYTES = 57
+
+
+def get_stream_threshold():
+    return getattr(settings, 'EMAIL_ATTACHMENT_STREAM_THRESHOLD', 1024 * 1024)
+
+
+def get_stream_block_size():
+    block_size = getattr(settings, 'EMAIL_STREAM_BLOCK_SIZE', 64 * 1024)
+    return max(BASE64_LINE_BYTES, block_size - block_size % BASE64_LINE_BYTES)
+
+
+class AttachmentStream:
+    """
+    The base64 encoding of a stored attachment blob, read and encoded one
+    fixed-size block at a time.
+    """
+
+    def __init__(self, digest):
+        self.digest = digest
+
+    def blocks(self, block_size):
+        with get_attachment_storage().open(blob_path(self.digest), 'rb') as f:
+            while True:
+                # A multiple of 57 bytes, so lines continue across blocks
+                chunk = f.read(block_size)
+                if not chunk:
+                    return
+                yield base64.encodebytes(chunk).replace(b'\n', CRLF)
+
+
+class StreamingData:
+    """
+    Message data whose large attachments are only read from storage while
+    the message is written to the SMTP connection, so memory use per
+    message stays at about one block whatever the attachment size.
+
+    Segments are bytes, quoted for DATA up front, or AttachmentStreams;
+    every segment starts at the beginning of a line.
+    """
+
+    def __init__(self, segments):
+        self.segments = [
+            segment if not isinstance(segment, bytes)
+            else quote_data(segment) if segment else None
+            for segment in segments
+        ]
+
+    def blocks(self, block_size=None):
+        """
+        Yields the quoted message in blocks, ready to write after DATA and
+        before the terminating `.` line.
+        """
+        block_size = block_size or get_stream_block_size()
+        for segment in self.segments:
+            if segment is None:
+                continue
+            if isinstance(segment, bytes):
+                yield segment
+            else:
+                yield from segment.blocks(block_size)
+
+
+def split_attachments(attachment_refs, threshold=None):
+    """
+    Splits `(name, digest, content_type)` references into those small enough
+    to load into memory and those to stream at send time.
+    """
+    threshold = threshold if threshold is not None else get_stream_threshold()
+    refs = list(attachment_refs or [])
+    if not refs:
+        return [], []
+    sizes = dict(AttachmentBlob.objects.filter(
+        digest__in={digest for _, digest, _ in refs}).values_list('digest', 'size'))
+    small = [ref for ref in refs if sizes.get(ref[1], 0) < threshold]
+    large = [ref for ref in refs if sizes.get(ref[1], 0) >= threshold]
+    return small, large
+
+
+def attach_streamed(email_message, attachment_refs):
+    """
+    Attaches a placeholder part for each referenced blob. The placeholders
+    are swapped for the streamed base64 content when the serialized message
+    is split with `split_streamed`.
+    """
+    streamed = getattr(email_message, 'streamed_attachments', {})
+    for file_name, digest, content_type in attachment_refs:
+        marker = f'streamed-attachment-{uuid.uuid4().hex}'
+        maintype, _, subtype = (content_type or 'application/octet-stream').partition('/')
+        part = MIMEBase(maintype, subtype or 'octet-stream')
+        # Ends in a newline like the base64 the email package writes, so
+        # the streamed message has the same bytes as one encoded in memory
+        part.set_payload(f'{marker}\n')
+        part['Content-Transfer-Encoding'] = 'base64'
+        part.add_header('Content-Disposition', 'attachment', filename=file_name)
+        email_message.attach(part)
+        streamed[marker.encode()] = digest
+    email_message.streamed_attachments = streamed
+    return streamed
+
+
+def split_streamed(data, streamed):
+    """
+    Splits serialized message bytes at the placeholder lines into segments
+    for StreamingData.
+    """
+    segments = [data]
+    for marker, digest in streamed.items():
+        for index, segment in enumerate(segments):
+            if isinstance(segment, bytes) and marker in segment:
+                before, _, after = segment.partition(marker + CRLF)
+                segments[index:index + 1] = [before, AttachmentStream(digest), after]
+                break
+    return segments
+
+
+def stream_sendmail(connection, from_email, recipients, data, block_size=None):
+    """
+    `smtplib.SMTP.sendmail` for StreamingData: the message is written to
+    the socket block by block instead of being joined in memory first.
+    Returns the refused recipients and raises like `sendmail`.
+    """
+    connection.ehlo_or_helo_if_needed()
+    code, response = connection.mail(from_email)
+    if code != 250:
+        if code == 421:
+            connection.close()
+        else:
+            connection.rset()
+        raise smtplib.SMTPSenderRefused(code, response, from_email)
+
+    refused = {}
+    for recipient in recipients:
+        code, response = connection.rcpt(recipient)
+        if code not in (250, 251):
+            refused[recipient] = (code, response)
+        if code == 421:
+            connection.close()
+            raise smtplib.SMTPRecipientsRefused(refused)
+    if len(refused) == len(recipients):
+        connection.rset()
+        raise smtplib.SMTPRecipientsRefused(refused)
+
+    code, response = connection.docmd('data')
+    if code != 354:
+        connection.rset()
+        raise smtplib.SMTPDataError(code, response)
+    for block in data.blocks(block_size):
+        connection.send(block)
+    connection.send(b'.' + CRLF)
+    code, response = connection.getreply()
+    if code != 250:
+        if code == 421:
+            connection.close()
+        else:
+            connection.rset()
+        raise smtplib.SMTPDataError(code, response)
+    return refused
@@ -0,0 +1,239 @@
+import logging
+import re
+import smtplib
+import threading
+import time
+import uuid
+from array import array
+from bisect import bisect_left, insort
+from itertools import chain
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import SuppressedRecipient, SuppressionReasonChoices
+from .outcomes import describe_error
+
+logger = logging.getLogger("emails_app")
+
+SUPPRESSION_GENERATION_CACHE_KEY = 'emails_app:suppression_generation'
+# Enhanced status codes (RFC 3463) of RCPT replies that mean the mailbox or
+# its domain doesn't exist or can't ever be used. A bare 550 is also what
+# relays answer for policy refusals, such as 5.7.1 relaying denied
+HARD_BOUNCE_STATUS_CODES = ('5.1.1', '5.1.2', '5.1.3', '5.1.6', '5.1.10', '5.2.1')
+ENHANCED_STATUS_RE = re.compile(r'^\s*([245]\.\d{1,3}\.\d{1,3})\b')
+
+
+def suppression_key(address):
+    return address.strip().lower()
+
+
+def bump_suppression_generation():
+    """
+    Tells every process to reload its suppression index in full, after
+    entries were changed or deleted rather than only added.
+    """
+    cache.set(SUPPRESSION_GENERATION_CACHE_KEY, uuid.uuid4().hex, timeout=None)
+
+
+def _search(scope, hashes):
+    # Binary search of each hash in the sorted array, O(k log n)
+    found = []
+    for value in hashes:
+        index = bisect_left(scope, value)
+        if index < len(scope) and scope[index] == value:
+            found.append(value)
+    return found
+
+
+class SuppressionIndex:
+    """
+    Per-process membership index of the suppression list. The global list
+    and each client's list are sorted arrays of the 64-bit hashes of their
+    addresses, 8 bytes an entry.
+
+    Python's string hash is only stable within a process, which is all the
+    index needs. Two different addresses share a hash with odds of about one
+    in 10^19, so a deliverable address is practically never skipped.
+
+    The index is refreshed at most every `check_interval` seconds: rows
+    added since the last load are merged in by primary key, while changes
+    and deletions bump a shared generation that makes every process reload
+    in full. A full reload also happens every `reload_interval` seconds, to
+    catch rows whose transactions committed out of primary key order.
+    """
+
+    def __init__(self, check_interval=None, reload_interval=None):
+        self.check_interval = check_interval if check_interval is not None else getattr(
+            settings, 'EMAIL_SUPPRESSION_CHECK_INTERVAL', 5)
+        self.reload_interval = reload_interval if reload_interval is not None else getattr(
+            settings, 'EMAIL_SUPPRESSION_RELOAD_INTERVAL', 600)
+        self._scopes = {}
+        self._last_pk = 0
+        self._generation = None
+        self._loaded_at = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def _new_rows(self, after_pk):
+        return SuppressedRecipient.objects.filter(pk__gt=after_pk).order_by('pk').values_list(
+            'pk', 'client_id', 'email').iterator(chunk_size=10000)
+
+    def _collect(self, after_pk):
+        hashes = {}
+        last_pk = after_pk
+        for pk, client_id, email in self._new_rows(after_pk):
+            hashes.setdefault(client_id, []).append(hash(email))
+            last_pk = pk
+        return hashes, last_pk
+
+    def _reload(self, generation, now):
+        hashes, self._last_pk = self._collect(0)
+        self._scopes = {client_id: array('q', sorted(values))
+                        for client_id, values in hashes.items()}
+        self._generation = generation
+        self._loaded_at = now
+        logger.info(f"Loaded {sum(map(len, self._scopes.values()))} suppressed recipients")
+
+    def _merge_new(self):
+        hashes, self._last_pk = self._collect(self._last_pk)
+        for client_id, values in hashes.items():
+            current = self._scopes.get(client_id, array('q'))
+            if len(values) <= 1000:
+                for value in values:
+                    insort(current, value)
+            else:
+                current = array('q', sorted(chain(current, values)))
+            self._scopes[client_id] = current
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and self._loaded_at is not None and now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            generation = cache.get(SUPPRESSION_GENERATION_CACHE_KEY)
+            if (force or self._loaded_at is None or generation != self._generation
+                    or now - self._loaded_at >= self.reload_interval):
+                self._reload(generation, now)
+            else:
+                self._merge_new()
+            self._checked_at = now
+
+    def split(self, client_id, items, key=None):
+        """
+        Splits `items` (addresses, or rows whose address `key` returns) into
+        `(allowed, suppressed)` lists for `client_id`, keeping their order.
+        """
+        self.refresh()
+        items = list(items)
+        scopes = [scope for scope in (self._scopes.get(None), self._scopes.get(client_id)) if scope]
+        if not scopes or not items:
+            return items, []
+        addresses = map(key, items) if key else items
+        hashes = list(map(hash, map(str.lower, map(str.strip, addresses))))
+        matches = set()
+        for scope in scopes:
+            # A few addresses are looked up one by one; a batch large enough
+            # to be worth a pass over the whole list is intersected in C,
+            # building a temporary set from the smaller side only
+            if len(hashes) * len(scope).bit_length() < len(scope):
+                matches.update(_search(scope, hashes))
+            elif len(scope) < len(hashes):
+                matches.update(set(scope).intersection(hashes))
+            else:
+                matches.update(set(hashes).intersection(scope))
+        if not matches:
+            return items, []
+        allowed, suppressed = [], []
+        for item, value in zip(items, hashes):
+            (suppressed if value in matches else allowed).append(item)
+        return allowed, suppressed
+
+    def clear(self):
+        with self._lock:
+            self._scopes = {}
+            self._loaded_at = None
+
+
+suppression_index = SuppressionIndex()
+
+
+def filter_suppressed(client_id, items, key=None):
+    return suppression_index.split(client_id, items, key=key)
+
+
+def is_suppressed(client_id, address):
+    return bool(suppression_index.split(client_id, [address])[1])
+
+
+def suppress_recipients(addresses, client_id=None, reason=SuppressionReasonChoices.MANUAL, note=''):
+    """
+    Adds `addresses` to the suppression list of `client_id`, or the global
+    one, skipping those already on it. Returns how many were given.
+    """
+    entries = {suppression_key(address) for address in addresses}
+    SuppressedRecipient.objects.bulk_create([
+        SuppressedRecipient(client_id=client_id, email=email, reason=reason, note=note)
+        for email in entries
+    ], ignore_conflicts=True)
+    return len(entries)
+
+
+def get_hard_bounce_status_codes():
+    return getattr(settings, 'EMAIL_HARD_BOUNCE_STATUS_CODES', HARD_BOUNCE_STATUS_CODES)
+
+
+def enhanced_status(message):
+    if isinstance(message, bytes):
+        message = message.decode('utf-8', 'replace')
+    match = ENHANCED_STATUS_RE.match(message or '')
+    return match.group(1) if match else None
+
+
+def is_hard_bounce(error):
+    """
+    Tells whether a delivery error is a permanent refusal of the recipient
+    itself, as opposed to the message or the relay: a 5xx reply whose
+    enhanced status code names a bad mailbox. An envelope whose recipients
+    were all refused with the very same reply is treated as a relay policy
+    instead.
+    """
+    if not isinstance(error, smtplib.SMTPRecipientsRefused) or not error.recipients:
+        return False
+    replies = list(error.recipients.values())
+    if len(replies) > 1 and len(set(replies)) == 1:
+        return False
+    codes = get_hard_bounce_status_codes()
+    return all(500 <= code < 600 and enhanced_status(message) in codes
+               for code, message in replies)
+
+
+def _replies(error):
+    return frozenset(error.recipients.values())
+
+
+def suppress_bounces(client_id, failures, attempted=None):
+    """
+    Suppresses, for `client_id`, the recipients of `(recipient, error)`
+    failures that hard-bounced, so later sends skip them. When the
+    `attempted` recipients of a delivery, more than one, all bounced with
+    the same reply, the relay is more likely at fault and nothing is
+    suppressed.
+    """
+    if not getattr(settings, 'EMAIL_SUPPRESS_HARD_BOUNCES', True):
+        return
+    bounces = [(recipient, error) for recipient, error in failures if is_hard_bounce(error)]
+    if (attempted is not None and 1 < attempted <= len(bounces)
+            and len({_replies(error) for _, error in bounces}) == 1):
+        logger.warning(f"Not suppressing {len(bounces)} recipients for client {client_id}: "
+                       f"all were refused with the same reply ({describe_error(bounces[0][1])})")
+        return
+    entries = [
+        SuppressedRecipient(client_id=client_id, email=suppression_key(recipient),
+                            reason=SuppressionReasonChoices.HARD_BOUNCE,
+                            note=describe_error(error)[:1000])
+        for recipient, error in bounces
+    ]
+    if entries:
+        SuppressedRecipient.objects.bulk_create(entries, ignore_conflicts=True)
+        logger.info(f"Suppressed {len(entries)} hard-bounced recipients for client {client_id}")
@@ -1,11 +1,34 @@
 # emails/tasks.py
 
-from celery import shared_task, chord, group
+import math
+import smtplib
+import time
+import uuid
+
+from celery import shared_task, group
 from celery.utils.log import get_task_logger
+from django.conf import settings
 from django.core.mail import EmailMessage
 
+from emails_app.archive import archive_email_records
+from emails_app.async_delivery import deliver_envelopes
+from emails_app.attachments import acquire_attachments, collect_attachment_garbage, load_attachments, release_attachments
+from emails_app.idempotency import purge_idempotency_keys
+from emails_app.metrics import count_messages, set_labels, timed
+from emails_app.outcomes import describe_error, expand_batch_results, is_permanent_failure, is_relay_failure, split_outcomes
+from emails_app.prepared import PreparedMessage, build_attachment_parts, message_envelope, prepared_messages
+from emails_app.ratelimit import get_send_buckets, throttle
+from emails_app.recipients import iter_recipient_chunks
+from emails_app.records import EmailRecordBuffer
+from emails_app.relay_health import NoRelayAvailable, choose_relay, record_relay_result
+from emails_app.relays import get_default_from_email, get_max_recipients_per_message
+from emails_app.scheduling import compute_chunk_size, get_max_retries, record_send_latency, retry_countdown
+from emails_app.smtp_pool import get_connection_pool
+from emails_app.streaming import attach_streamed, split_attachments
+from emails_app.suppression import filter_suppressed, is_suppressed, suppress_bounces
+from emails_app.templating import render_subject, render_template
 from emails_app.utils import chunk_list
-from .models import Client, EmailRecord, TaskTypeChoices
+from .models import BulkJob, Client, EmailStatusChoices, RecipientList, TaskTypeChoices
 
 
 logger = get_task_logger(__name__)
@@ -25,132 +48,499 @@ def say_helo(self):
     return "Sayed Hello"
 
 
-@shared_task(bind=True)
+@shared_task(bind=True, ignore_result=True)
 def send_email_task(self, subject, message, recipient, attachments=None, html_message=None, client_pk=None):
-    from .models import Client
+    set_labels(client=client_pk, task_type=TaskTypeChoices.SINGLE)
+    if is_suppressed(client_pk, recipient):
+        release_attachments(attachments)
+        record_suppressed(client_pk, None, subject, [recipient], TaskTypeChoices.SINGLE)
+        return False
     try:
         client = Client.objects.get(pk=client_pk)
-        email = EmailMessage(subject=subject, body=message, to=[recipient])
-        if html_message:
-            email.content_subtype = 'html'
-            email.body = html_message
-        # if attachments:
-        #     for attachment in attachments:
-        #         # Assume attachment is a file path, you can adjust based on actual data
-        #         email.attach_file(attachment)
-
-        if attachments:
-            for attachment in attachments:
-                file_name, file_content, content_type = attachment
+        with timed('mime_build'):
+            email = EmailMessage(subject=subject, body=message,
+                                 from_email=get_default_from_email(), to=[recipient])
+            if html_message:
+                email.content_subtype = 'html'
+                email.body = html_message
+            # if attachments:
+            #     for attachment in attachments:
+            #         # Assume attachment is a file path, you can adjust based on actual data
+            #         email.attach_file(attachment)
+
+            # Attachments arrive as (name, digest, content_type) references;
+            # large ones stay on disk until they are written to the relay
+            small, large = split_attachments(attachments)
+            for file_name, file_content, content_type in load_attachments(small):
                 email.attach(file_name, file_content, content_type)
+            attach_streamed(email, large)
+            envelope = PreparedMessage(email).envelope(recipient)
 
-        email.send()
+        # Waits for the client's and the relay's rate limits
+        send_envelope(envelope, client)
+    except Client.DoesNotExist:
+        # Deleted since the task was queued; nothing to retry, and records
+        # couldn't refer to it
+        logger.error(f"Not sending email: client {client_pk} no longer exists")
+        release_attachments(attachments)
+        return False
+    except Exception as e:
+        # Retry transient failures with backoff; permanent rejections and the
+        # last failed attempt are recorded before giving up
+        logger.error(f"Error sending email: {describe_error(e)}")
+        if not is_permanent_failure(e) and self.request.retries < get_max_retries():
+            count_messages('retried')
+            raise self.retry(exc=e, countdown=retry_countdown(self.request.retries),
+                             max_retries=get_max_retries())
+        count_messages('failed')
+        release_attachments(attachments)
+        suppress_bounces(client_pk, [(recipient, e)])
+        with EmailRecordBuffer() as records:
+            records.add(
+                client_id=client_pk, subject=subject, recipient=recipient, status=EmailStatusChoices.FAILED, error_message=describe_error(e), task_type=TaskTypeChoices.SINGLE
+            )
+        return False
 
-        # Save email record to database
-        EmailRecord.objects.create(
-            client=client, subject=subject, recipient=recipient, status='Sent', task_type=TaskTypeChoices.SINGLE
-        )
+    count_messages('sent')
+    release_attachments(attachments)
 
-        return True
-    except Exception as e:
-        # Log the error and retry the task if an exception occurs
-        self.retry(exc=e, countdown=60, max_retries=3)
-        EmailRecord.objects.create(
-            client=client, subject=subject, recipient=recipient, status='Failed', error_message=str(e), task_type=TaskTypeChoices.SINGLE
+    # Save email record to database
+    with EmailRecordBuffer() as records:
+        records.add(
+            client=client, subject=subject, recipient=recipient, status=EmailStatusChoices.SENT, task_type=TaskTypeChoices.SINGLE
         )
-        return False
+
+    return True
 
 
-@shared_task(bind=True)
-def send_bulk_email_task(self, subject, message, recipient_list, attachments_list=None, html_message=None, client_pk=None, collective=False):
+@shared_task(bind=True, ignore_result=True)
+def send_bulk_email_task(self, subject, message, recipient_list, attachments_list=None, html_message=None, client_pk=None, collective=False, chunk_size=None, recipient_context=None, job_id=None):
+    if recipient_context:
+        # Personalised send: one row of merge fields per recipient
+        recipient_list = [row['email'] for row in recipient_context]
+    set_labels(client=client_pk, task_type=TaskTypeChoices.BULK)
+    chunk_references = 0
     try:
         client = Client.objects.get(pk=client_pk)
+        BulkJob.mark_running(job_id)
 
-        if collective:
-            # Send collectively to all recipients
-            email = EmailMessage(subject, message, to=recipient_list)
-            if html_message:
-                email.content_subtype = 'html'
-                email.body = html_message
+        # Skip suppressed recipients before anything is scheduled
+        with timed('suppression_filter'):
+            if recipient_context:
+                recipient_context, suppressed = filter_suppressed(
+                    client_pk, recipient_context, key=lambda row: row['email'])
+                suppressed = [row['email'] for row in suppressed]
+                recipient_list = [row['email'] for row in recipient_context]
+            else:
+                recipient_list, suppressed = filter_suppressed(client_pk, recipient_list)
+        record_suppressed(client_pk, job_id, subject, suppressed, TaskTypeChoices.BULK)
+        if not recipient_list:
+            release_attachments(attachments_list)
+            return True
 
-            if attachments_list:
-                for attachment in attachments_list:
-                    file_name, file_content, content_type = attachment
-                    email.attach(file_name, file_content, content_type)
+        # Chunk the recipient list, sized so that each chunk fits the
+        # send-duration budget unless overridden. Collective sends go out
+        # as blind copies, one message per batch of envelope recipients
+        if collective and not (chunk_size or client.bulk_chunk_size):
+            per_message = get_max_recipients_per_message()
+            chunk_size = compute_chunk_size(
+                math.ceil(len(recipient_list) / per_message)) * per_message
+        else:
+            chunk_size = compute_chunk_size(
+                len(recipient_list), override=chunk_size or client.bulk_chunk_size)
+        recipient_chunks = list(chunk_list(
+            recipient_context or recipient_list, chunk_size))
 
-            email.send()
+        # Every chunk holds its own reference to the attachments, handed
+        # over once the chunks are published
+        acquire_attachments(attachments_list, count=len(recipient_chunks))
+        chunk_references = len(recipient_chunks)
 
-            # Save one email record for the collective sending
-            EmailRecord.objects.create(
-                client=client, subject=subject, recipient=', '.join(recipient_list), status='Sent', task_type=TaskTypeChoices.BULK
-            )
+        # Create subtasks for each chunk using group; the job key lets
+        # workers share one encoded copy of the message across chunks.
+        # Chunks report progress on the BulkJob row, so no chord or
+        # stored results are needed to tell when the job is done
+        if recipient_context:
+            tasks = group(send_templated_email_chunk.s(subject, message, chunk, attachments_list,
+                          html_message, client_pk, job_id=job_id) for chunk in recipient_chunks)
         else:
-            # Send individually to each recipient
-            # Chunk the recipient list for individual sending
-            chunk_size = 2  # Adjust the chunk size based on your requirements
-            recipient_chunks = list(chunk_list(recipient_list, chunk_size))
-
-            # Create subtasks for each chunk using group
+            job_key = job_id or uuid.uuid4().hex
             tasks = group(send_email_chunk.s(subject, message, chunk, attachments_list,
-                          html_message, client_pk) for chunk in recipient_chunks)
-
-            # Use chord to execute tasks in parallel and handle the final result
-            result = chord(tasks)(
-                finalize_send_bulk_email.s(client_pk, subject))
+                          html_message, client_pk, job_key=job_key, job_id=job_id, collective=collective)
+                          for chunk in recipient_chunks)
+        with timed('publish'):
+            tasks.apply_async()
+        chunk_references = 0
 
+        release_attachments(attachments_list)
         return True
+    except Client.DoesNotExist:
+        logger.error(f"Not sending bulk email: client {client_pk} no longer exists")
+        release_attachments(attachments_list)
+        BulkJob.mark_failed(job_id)
+        return False
     except Exception as e:
-        # Log the error and retry the task if an exception occurs
-        logger.error(f"Error sending bulk email: {str(e)}")
-        self.retry(exc=e, countdown=60, max_retries=3)
-        if collective:
-            EmailRecord.objects.create(
-                client=client, subject=subject, recipient=', '.join(recipient_list), status='Failed', error_message=str(e), task_type=TaskTypeChoices.BULK
+        # Log the error and retry the task if it may still succeed
+        logger.error(f"Error sending bulk email: {describe_error(e)}")
+        if chunk_references:
+            release_attachments(attachments_list, count=chunk_references)
+        if not is_permanent_failure(e) and self.request.retries < get_max_retries():
+            raise self.retry(exc=e, countdown=retry_countdown(self.request.retries),
+                             max_retries=get_max_retries())
+        count_messages('failed', len(recipient_list))
+        release_attachments(attachments_list)
+        BulkJob.mark_failed(job_id)
+        with EmailRecordBuffer() as records:
+            records.add_many(
+                recipient_list, client_id=client_pk, subject=subject, status=EmailStatusChoices.FAILED, error_message=describe_error(e), task_type=TaskTypeChoices.BULK
             )
-        else:
-            for recipient in recipient_list:
-                EmailRecord.objects.create(
-                    client=client, subject=subject, recipient=recipient, status='Failed', error_message=str(e), task_type=TaskTypeChoices.BULK
-                )
         return False
 
 
-@shared_task(bind=True)
-def send_email_chunk(self, subject, message, recipient_chunk, attachments_list, html_message, client_pk):
+def record_suppressed(client_pk, job_id, subject, recipients, task_type):
+    """
+    Records `recipients` as skipped for being on the suppression list.
+    """
+    if not recipients:
+        return
+    with EmailRecordBuffer() as records:
+        records.add_many(
+            recipients, client_id=client_pk, subject=subject[:255], status=EmailStatusChoices.SUPPRESSED, error_message='Recipient is on the suppression list', task_type=task_type
+        )
+    BulkJob.record_progress(job_id, suppressed=len(recipients))
+    count_messages('suppressed', len(recipients))
+
+
+def send_envelope(envelope, client):
+    """
+    Sends one envelope through a pooled session, raising if every relay
+    tried refused it or any of its recipients.
+    """
+    [(refused, error)] = deliver_chunk([envelope], client, use_async=False)
+    if error is not None:
+        raise error
+    if refused:
+        raise smtplib.SMTPRecipientsRefused(refused)
+
+
+def deliver_via_relay(envelopes, client, relay, weight=None, use_async=None):
+    """
+    Sends `envelopes` through `relay` with the configured delivery engine,
+    releasing them as fast as the rate limits allow, and returns a
+    `(refused, error)` pair per envelope. `weight` is passed on to
+    `throttle`. Each batch is folded into the relay's health; once a whole
+    batch fails at the relay, the rest get the same error without being
+    tried.
+    """
+    if use_async is None:
+        use_async = getattr(settings, 'EMAIL_DELIVERY_ENGINE', 'pool') == 'async'
+    pool = None if use_async else get_connection_pool(relay)
+    results = []
     try:
-        client = Client.objects.get(pk=client_pk)
-        for recipient in recipient_chunk:
-            email = EmailMessage(subject, message, to=[recipient])
-            if html_message:
-                email.content_subtype = 'html'
-                email.body = html_message
+        for batch in throttle(envelopes, get_send_buckets(client, relay), weight=weight):
+            started = time.monotonic()
+            if use_async:
+                # Drive several concurrent SMTP sessions from this process
+                batch_results = deliver_envelopes(
+                    batch, concurrency=relay.max_connections, **relay.connection_kwargs())
+            else:
+                # Send the batch through one pooled SMTP session
+                batch_results = pool.deliver_raw(batch)
+            elapsed = time.monotonic() - started
+            record_send_latency(elapsed, len(batch))
+            results.extend(batch_results)
 
-            if attachments_list:
-                for attachment in attachments_list:
-                    file_name, file_content, content_type = attachment
-                    email.attach(file_name, file_content, content_type)
+            errors = [error for _, error in batch_results
+                      if error is not None and is_relay_failure(error)]
+            record_relay_result(relay, len(batch) - len(errors), len(errors), elapsed)
+            if len(errors) == len(batch):
+                results.extend((None, errors[-1]) for _ in envelopes[len(results):])
+                break
+    except Exception as e:
+        # Taking rate-limit tokens or the engine itself broke off part-way.
+        # The batches already sent keep their results; the envelopes not
+        # yet attempted get the error, which counts as transient
+        logger.error(f"Delivery through SMTP relay {relay} broke off after "
+                     f"{len(results)} of {len(envelopes)} messages: {describe_error(e)}")
+        results.extend((None, e) for _ in envelopes[len(results):])
+    return results
+
+
+def deliver_chunk(envelopes, client, weight=None, use_async=None):
+    """
+    Sends `envelopes` across the active relays and returns a `(refused,
+    error)` pair per envelope. A relay is picked by weight and health;
+    envelopes it fails with relay-level errors fail over to the next relay
+    in rotation, trying each relay at most once.
+    """
+    results = [None] * len(envelopes)
+    pending = list(range(len(envelopes)))
+    tried = set()
+    while pending:
+        try:
+            relay = choose_relay(exclude=tried)
+        except NoRelayAvailable as e:
+            if not tried:
+                results = [(None, e)] * len(envelopes)
+            break
+        if tried:
+            logger.info(f"Failing {len(pending)} messages over to SMTP relay {relay}")
+        tried.add(relay.key)
+        relay_results = deliver_via_relay(
+            [envelopes[index] for index in pending], client, relay, weight=weight, use_async=use_async)
+        for index, result in zip(pending, relay_results):
+            results[index] = result
+        pending = [index for index in pending
+                   if results[index][1] is not None and is_relay_failure(results[index][1])]
+    return results
 
-            email.send()
 
-            # Save email record to database for each recipient
-            EmailRecord.objects.create(
-                client=client, subject=subject, recipient=recipient, status='Sent', task_type=TaskTypeChoices.BULK
+def settle_chunk(task, client, job_id, items, results, recipient_of, subject_of):
+    """
+    Records each item's own outcome and adds it to the job's progress.
+
+    Items that failed transiently are held back while `task` has retries
+    left; they are returned for the retry, and recorded as failed otherwise.
+    """
+    delivered, permanent, transient = split_outcomes(items, results)
+    retry = bool(transient) and task.request.retries < get_max_retries()
+    failed = permanent if retry else permanent + transient
+    suppress_bounces(client.pk, [(recipient_of(item), error) for item, error in permanent],
+                     attempted=len(items))
+
+    with EmailRecordBuffer() as records:
+        for item in delivered:
+            records.add(
+                client=client, subject=subject_of(item), recipient=recipient_of(item), status=EmailStatusChoices.SENT, task_type=TaskTypeChoices.BULK
+            )
+        for item, error in failed:
+            records.add(
+                client=client, subject=subject_of(item), recipient=recipient_of(item), status=EmailStatusChoices.FAILED, error_message=describe_error(error), task_type=TaskTypeChoices.BULK
             )
+    BulkJob.record_progress(job_id, sent=len(delivered), failed=len(failed))
+    count_messages('sent', len(delivered))
+    count_messages('failed', len(failed))
+    if retry:
+        count_messages('retried', len(transient))
+
+    if retry:
+        logger.info(f"Retrying {len(transient)} of {len(items)} recipients after transient failures")
+        return [item for item, _ in transient]
+    return []
+
+
+@shared_task(bind=True, ignore_result=True)
+def send_email_chunk(self, subject, message, recipient_chunk, attachments_list, html_message, client_pk, job_key=None, job_id=None, collective=False):
+    retrying = False
+    set_labels(client=client_pk, task_type=TaskTypeChoices.BULK)
+    try:
+        try:
+            client = Client.objects.get(pk=client_pk)
+
+            def build_email():
+                email = EmailMessage(subject, message, get_default_from_email())
+                if html_message:
+                    email.content_subtype = 'html'
+                    email.body = html_message
+
+                small, large = split_attachments(attachments_list)
+                for file_name, file_content, content_type in load_attachments(small):
+                    email.attach(file_name, file_content, content_type)
+                attach_streamed(email, large)
+                return email
+
+            # The MIME message is encoded once per job, except for large
+            # attachments, which are streamed from disk; each recipient only
+            # gets its own To and Message-ID headers
+            with timed('mime_build'):
+                prepared = prepared_messages.get(job_key, build_email)
+                if collective:
+                    # Blind copies to batches of envelope recipients, as many
+                    # as the relay accepts per message
+                    per_message = get_max_recipients_per_message()
+                    envelopes = [prepared.batch_envelope(batch)
+                                 for batch in chunk_list(recipient_chunk, per_message)]
+                else:
+                    envelopes = [prepared.envelope(recipient)
+                                 for recipient in recipient_chunk]
+        except Client.DoesNotExist:
+            logger.error(f"Not sending email chunk: client {client_pk} no longer exists")
+            return False
+        except Exception as e:
+            # Nothing was sent if the chunk couldn't even be prepared
+            logger.error(f"Error preparing email chunk: {str(e)}")
+            with EmailRecordBuffer() as records:
+                records.add_many(
+                    recipient_chunk, client_id=client_pk, subject=subject, status=EmailStatusChoices.FAILED, error_message=str(e), task_type=TaskTypeChoices.BULK
+                )
+            BulkJob.record_progress(job_id, failed=len(recipient_chunk))
+            count_messages('failed', len(recipient_chunk))
+            return False
+
+        # Delivery problems come back as a result per envelope, so only
+        # what the relay accepted is recorded as sent
+        if collective:
+            # Every recipient gets its own outcome from its RCPT reply
+            results = expand_batch_results(envelopes, deliver_chunk(
+                envelopes, client, weight=lambda envelope: len(envelope[1])))
+        else:
+            results = deliver_chunk(envelopes, client)
+
+        # Only recipients that failed transiently are sent again; the retry
+        # keeps the chunk's attachment reference
+        remaining = settle_chunk(self, client, job_id, recipient_chunk, results,
+                                 recipient_of=lambda recipient: recipient,
+                                 subject_of=lambda recipient: subject)
+        if remaining:
+            retrying = True
+            raise self.retry(args=(subject, message, remaining, attachments_list, html_message, client_pk),
+                             kwargs={'job_key': job_key, 'job_id': job_id, 'collective': collective},
+                             countdown=retry_countdown(self.request.retries), max_retries=get_max_retries())
+        return True
+    finally:
+        if not retrying:
+            release_attachments(attachments_list)
+
 
+@shared_task(bind=True, ignore_result=True)
+def send_templated_email_chunk(self, subject, message, context_chunk, attachments_list, html_message, client_pk, job_id=None):
+    """
+    Renders and sends a personalised email to every row of `context_chunk`.
+    The subject and bodies are merge-field templates, compiled once per
+    worker; small attachments are encoded once for the whole chunk and
+    large ones are streamed from disk for each message.
+    """
+    retrying = False
+    set_labels(client=client_pk, task_type=TaskTypeChoices.BULK)
+    try:
+        try:
+            client = Client.objects.get(pk=client_pk)
+            with timed('mime_build'):
+                small, large = split_attachments(attachments_list)
+                attachment_parts = build_attachment_parts(load_attachments(small))
+                from_email = get_default_from_email()
+
+                envelopes = []
+                rendered = []
+                for context in context_chunk:
+                    rendered_subject = render_subject(subject, context)
+                    if html_message:
+                        email = EmailMessage(rendered_subject, render_template(
+                            html_message, context, autoescape=True), from_email, to=[context['email']])
+                        email.content_subtype = 'html'
+                    else:
+                        email = EmailMessage(rendered_subject, render_template(
+                            message, context), from_email, to=[context['email']])
+
+                    for part in attachment_parts:
+                        email.attach(part)
+                    attach_streamed(email, large)
+                    envelopes.append(message_envelope(email))
+                    rendered.append((context, rendered_subject[:255]))
+        except Client.DoesNotExist:
+            logger.error(f"Not sending templated email chunk: client {client_pk} no longer exists")
+            return False
+        except Exception as e:
+            # Nothing was sent if the chunk couldn't even be rendered
+            logger.error(f"Error preparing templated email chunk: {str(e)}")
+            with EmailRecordBuffer() as records:
+                for context in context_chunk:
+                    # Record the subject the row would have been sent with,
+                    # unless rendering it is what failed
+                    try:
+                        failed_subject = render_subject(subject, context)
+                    except Exception:
+                        failed_subject = subject
+                    records.add(
+                        recipient=context['email'], client_id=client_pk, subject=failed_subject[:255], status=EmailStatusChoices.FAILED, error_message=str(e), task_type=TaskTypeChoices.BULK
+                    )
+            BulkJob.record_progress(job_id, failed=len(context_chunk))
+            count_messages('failed', len(context_chunk))
+            return False
+
+        results = deliver_chunk(envelopes, client)
+
+        remaining = settle_chunk(self, client, job_id, rendered, results,
+                                 recipient_of=lambda item: item[0]['email'],
+                                 subject_of=lambda item: item[1])
+        if remaining:
+            retrying = True
+            raise self.retry(args=(subject, message, [context for context, _ in remaining], attachments_list, html_message, client_pk),
+                             kwargs={'job_id': job_id},
+                             countdown=retry_countdown(self.request.retries), max_retries=get_max_retries())
         return True
+    finally:
+        if not retrying:
+            release_attachments(attachments_list)
+
+
+@shared_task(bind=True, ignore_result=True)
+def send_recipient_list_task(self, subject, message, recipient_list_pk, attachments_list=None, html_message=None, client_pk=None, chunk_size=None, job_id=None):
+    """
+    Fans a stored recipient list out into chunk tasks, reading it one chunk
+    at a time and skipping suppressed recipients, then drops the list.
+    The entries of each published chunk are deleted straight away, so a
+    retry resumes after the last chunk published.
+    """
+    set_labels(client=client_pk, task_type=TaskTypeChoices.BULK)
+    try:
+        client = Client.objects.get(pk=client_pk)
+        recipient_list = RecipientList.objects.get(pk=recipient_list_pk)
+        BulkJob.mark_running(job_id)
+        chunk_size = compute_chunk_size(
+            recipient_list.valid_count, override=chunk_size or client.bulk_chunk_size)
+
+        job_key = job_id or uuid.uuid4().hex
+        for chunk in iter_recipient_chunks(recipient_list, chunk_size):
+            with timed('suppression_filter'):
+                recipients, suppressed = filter_suppressed(client_pk, chunk)
+            record_suppressed(client_pk, job_id, subject, suppressed, TaskTypeChoices.BULK)
+            if recipients:
+                acquire_attachments(attachments_list)
+                try:
+                    with timed('publish'):
+                        send_email_chunk.delay(
+                            subject, message, recipients, attachments_list, html_message, client_pk, job_key=job_key, job_id=job_id)
+                except Exception:
+                    # The chunk never got its reference
+                    release_attachments(attachments_list)
+                    raise
+            recipient_list.entries.filter(email__in=chunk).delete()
+
+        recipient_list.delete()
+        release_attachments(attachments_list)
+        return True
+    except (Client.DoesNotExist, RecipientList.DoesNotExist) as e:
+        logger.error(f"Not sending bulk email to recipient list {recipient_list_pk}: {str(e)}")
+        release_attachments(attachments_list)
+        BulkJob.mark_failed(job_id)
+        return False
     except Exception as e:
-        # Log the error
-        logger.error(f"Error sending email chunk: {str(e)}")
-        for recipient in recipient_chunk:
-            EmailRecord.objects.create(
-                client=client, subject=subject, recipient=recipient, status='Failed', error_message=str(e), task_type=TaskTypeChoices.BULK
-            )
+        # Log the error and retry the task if it may still succeed
+        logger.error(f"Error sending bulk email to recipient list: {describe_error(e)}")
+        if not is_permanent_failure(e) and self.request.retries < get_max_retries():
+            raise self.retry(exc=e, countdown=retry_countdown(self.request.retries),
+                             max_retries=get_max_retries())
+        release_attachments(attachments_list)
+        BulkJob.mark_failed(job_id)
+        # Nothing resumes a failed job, so the rest of the list is dropped
+        RecipientList.objects.filter(pk=recipient_list_pk).delete()
         return False
 
 
 @shared_task(bind=True)
-def finalize_send_bulk_email(self, results, client_pk, subject):
-    # This function runs after all chunks have been processed
-    logger.info(
-        f"Finished sending bulk email for client {client_pk} with subject {subject}")
-    return True
+def collect_attachment_garbage_task(self):
+    # Periodically delete attachment blobs no pending task references
+    return collect_attachment_garbage()
+
+
+@shared_task(bind=True)
+def purge_idempotency_keys_task(self):
+    # Drop idempotency keys that are past their TTL
+    return purge_idempotency_keys()
+
+
+@shared_task(bind=True)
+def archive_email_records_task(self):
+    # Roll email records past the hot period over into the archive
+    return archive_email_records()
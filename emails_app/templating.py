@@ -0,0 +1,30 @@
+from functools import lru_cache
+
+from django.template import Context, Engine, Template
+
+TEMPLATE_CACHE_SIZE = 256
+
+
+@lru_cache(maxsize=None)
+def get_template_engine():
+    # A standalone engine, so merge templates don't depend on TEMPLATES
+    return Engine()
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def compile_template(source):
+    """
+    Compiles a merge-field template. Each worker keeps the most recently
+    used templates compiled, so a job's templates are parsed once per worker
+    rather than once per recipient.
+    """
+    return Template(source, engine=get_template_engine())
+
+
+def render_template(source, context, autoescape=False):
+    return compile_template(source).render(Context(context, autoescape=autoescape))
+
+
+def render_subject(source, context):
+    # Headers can't hold newlines, whatever the context values contain
+    return ' '.join(render_template(source, context).splitlines()).strip()
@@ -0,0 +1,100 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from emails_app.archive import ARCHIVE_FIELDS, archive_email_records, search_email_records
+from emails_app.models import Client, EmailRecord, EmailRecordArchive, EmailStatusChoices, TaskTypeChoices
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.first = Client.objects.create(system_name='First', static_ip='192.0.2.10')
+        self.second = Client.objects.create(system_name='Second', static_ip='192.0.2.11')
+        self.now = timezone.now()
+        self.record(self.first, 'a@x.com', 40, EmailStatusChoices.SENT)
+        self.record(self.first, 'b@x.com', 35, EmailStatusChoices.FAILED,
+                    error_message='550 "No such user",\nhere', task_type=TaskTypeChoices.BULK)
+        self.record(self.second, 'a@x.com', 33, 'Sent')
+        self.record(self.first, 'a@x.com', 1, EmailStatusChoices.SENT)
+
+    def record(self, client, recipient, days_ago, status, **fields):
+        record = EmailRecord.objects.create(client=client, subject='Hi, "you"', recipient=recipient,
+                                            status=status, **fields)
+        EmailRecord.objects.filter(pk=record.pk).update(timestamp=self.now - timedelta(days=days_ago))
+
+    def snapshot(self):
+        return sorted(EmailRecord.objects.values(*ARCHIVE_FIELDS), key=lambda record: record['id'])
+
+    def search(self, **filters):
+        return [(record['client_id'], record['recipient'], record['status'])
+                for record in search_email_records(**filters)]
+
+    def test_round_trip(self):
+        before = self.snapshot()
+        before[2]['status'] = EmailStatusChoices.SENT
+        self.assertEqual(archive_email_records(older_than_days=30, batch_size=2), 3)
+        self.assertEqual(EmailRecord.objects.count(), 1)
+
+        archives = EmailRecordArchive.objects.order_by('pk')
+        self.assertEqual(
+            [(archive.client_id, archive.record_count, archive.sent_count, archive.failed_count)
+             for archive in archives],
+            [(self.first.pk, 2, 1, 1), (self.second.pk, 1, 1, 0)])
+        self.assertEqual(sorted(search_email_records(since=self.now - timedelta(days=60)),
+                                key=lambda record: record['id']), before)
+
+    def test_limit(self):
+        self.assertEqual(archive_email_records(older_than_days=30, batch_size=2, limit=1), 1)
+        self.assertEqual(EmailRecord.objects.count(), 3)
+
+    def test_search_covers_archives_and_hot_records(self):
+        archive_email_records(older_than_days=30)
+        self.assertEqual(self.search(client_id=self.first.pk), [
+            (self.first.pk, 'a@x.com', EmailStatusChoices.SENT),
+            (self.first.pk, 'b@x.com', EmailStatusChoices.FAILED),
+            (self.first.pk, 'a@x.com', EmailStatusChoices.SENT)])
+        self.assertEqual(self.search(recipient='a@x.com', status=EmailStatusChoices.SENT,
+                                     until=self.now - timedelta(days=2)), [
+            (self.first.pk, 'a@x.com', EmailStatusChoices.SENT),
+            (self.second.pk, 'a@x.com', EmailStatusChoices.SENT)])
+        self.assertEqual(self.search(since=self.now - timedelta(days=36),
+                                     until=self.now - timedelta(days=34)), [
+            (self.first.pk, 'b@x.com', EmailStatusChoices.FAILED)])
+
+    def test_search_command(self):
+        archive_email_records(older_than_days=30)
+        stdout = StringIO()
+        call_command('search_email_records', '--client', str(self.second.pk), stdout=stdout)
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(lines[0], ','.join(ARCHIVE_FIELDS))
+        self.assertEqual(len(lines), 2)
+        self.assertIn(f',a@x.com,{EmailStatusChoices.SENT},', lines[1])
+
+
+class LegacyStatusTests(TestCase):
+    def setUp(self):
+        self.client_row = Client.objects.create(system_name='Test', static_ip='192.0.2.10')
+        for recipient, status in [('a@x.com', 'Sent'), ('b@x.com', EmailStatusChoices.SENT),
+                                  ('c@x.com', 'Failed'), ('d@x.com', EmailStatusChoices.FAILED)]:
+            EmailRecord.objects.create(client=self.client_row, subject='Subject',
+                                       recipient=recipient, status=status)
+
+    def search(self, status):
+        return sorted((record['recipient'], record['status'])
+                      for record in search_email_records(client_id=self.client_row.pk, status=status))
+
+    def test_search_matches_unconverted_rows(self):
+        self.assertEqual(self.search(EmailStatusChoices.SENT), [
+            ('a@x.com', EmailStatusChoices.SENT), ('b@x.com', EmailStatusChoices.SENT)])
+        self.assertEqual(self.search(EmailStatusChoices.FAILED), [
+            ('c@x.com', EmailStatusChoices.FAILED), ('d@x.com', EmailStatusChoices.FAILED)])
+
+    def test_convert_command(self):
+        call_command('convert_email_record_status', batch_size=1, stdout=StringIO())
+        self.assertEqual(
+            sorted(EmailRecord.objects.values_list('recipient', 'status')),
+            [('a@x.com', EmailStatusChoices.SENT), ('b@x.com', EmailStatusChoices.SENT),
+             ('c@x.com', EmailStatusChoices.FAILED), ('d@x.com', EmailStatusChoices.FAILED)])
@@ -0,0 +1,155 @@
+import asyncio
+import smtplib
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from emails_app.async_delivery import AsyncDeliveryEngine, AsyncSMTPSession, deliver_envelopes, quote_data
+from emails_app.smtp_sink import SMTPSink
+
+MESSAGE = b'Subject: Test\r\n\r\nBody\r\n'
+
+
+def envelope(*recipients):
+    return ('sender@example.com', list(recipients), MESSAGE)
+
+
+def refuse_unknown(address):
+    if address.startswith('unknown'):
+        return (550, '5.1.1 User unknown')
+    return None
+
+
+class QuoteDataTests(SimpleTestCase):
+    def test_normalizes_line_endings_and_stuffs_dots(self):
+        self.assertEqual(quote_data(b'a\nb\r.c\r\n.\r\nd'), b'a\r\nb\r\n..c\r\n..\r\nd\r\n')
+
+
+class AsyncSMTPTestCase(SimpleTestCase):
+    sink_options = {}
+
+    def setUp(self):
+        self.sink = SMTPSink(reject=refuse_unknown, **self.sink_options)
+        self.sink.keep_messages = True
+        self.sink.start()
+        self.addCleanup(self.sink.stop)
+
+    def connection_kwargs(self, **kwargs):
+        return {'host': self.sink.host, 'port': self.sink.port, 'timeout': 5, **kwargs}
+
+    def deliver(self, envelopes, **kwargs):
+        engine = AsyncDeliveryEngine(**self.connection_kwargs(**kwargs))
+        return asyncio.run(engine.deliver(envelopes))
+
+
+class AsyncSMTPSessionTests(AsyncSMTPTestCase):
+    def send(self, *envelopes, pipelining=True):
+        async def run():
+            session = AsyncSMTPSession(**self.connection_kwargs())
+            await session.connect()
+            if not pipelining:
+                session.extensions.discard('pipelining')
+            writes = []
+            write = session._write
+
+            async def record(data):
+                writes.append(data)
+                await write(data)
+
+            session._write = record
+            outcomes = []
+            for item in envelopes:
+                try:
+                    outcomes.append(await session.send(*item))
+                except smtplib.SMTPException as e:
+                    outcomes.append(e)
+            await session.quit()
+            return outcomes, writes
+
+        return asyncio.run(run())
+
+    def test_pipelines_mail_rcpt_and_data(self):
+        outcomes, writes = self.send(envelope('a@x.com', 'b@x.com'))
+        self.assertEqual(outcomes, [{}])
+        self.assertEqual(writes[0], b'MAIL FROM:<sender@example.com>\r\nRCPT TO:<a@x.com>\r\n'
+                                    b'RCPT TO:<b@x.com>\r\nDATA\r\n')
+        self.assertEqual(self.sink.messages, [('<sender@example.com>', ['a@x.com', 'b@x.com'], MESSAGE)])
+
+    def test_one_command_per_write_without_pipelining(self):
+        outcomes, writes = self.send(envelope('a@x.com', 'b@x.com'), pipelining=False)
+        self.assertEqual(outcomes, [{}])
+        self.assertEqual(writes[:4], [b'MAIL FROM:<sender@example.com>\r\n', b'RCPT TO:<a@x.com>\r\n',
+                                      b'RCPT TO:<b@x.com>\r\n', b'DATA\r\n'])
+        self.assertEqual(self.sink.message_count, 1)
+
+    def test_partial_rcpt_refusal(self):
+        outcomes, _ = self.send(envelope('a@x.com', 'unknown@x.com'))
+        self.assertEqual(outcomes, [{'unknown@x.com': (550, b'5.1.1 User unknown')}])
+        self.assertEqual(self.sink.messages[0][1], ['a@x.com'])
+
+    def test_every_rcpt_refused_keeps_session_usable(self):
+        for pipelining in (True, False):
+            outcomes, _ = self.send(envelope('unknown@x.com'), envelope('a@x.com'), pipelining=pipelining)
+            self.assertIsInstance(outcomes[0], smtplib.SMTPRecipientsRefused)
+            self.assertEqual(outcomes[1], {})
+        self.assertEqual(self.sink.message_count, 2)
+
+
+class AsyncDeliveryEngineTests(AsyncSMTPTestCase):
+    sink_options = {'drop': lambda recipients: 'drop@x.com' in recipients}
+
+    def test_delivers_over_concurrent_sessions(self):
+        results = self.deliver([envelope(f'user{number}@x.com') for number in range(6)], concurrency=3)
+        self.assertEqual(results, [({}, None)] * 6)
+        self.assertEqual(self.sink.message_count, 6)
+        self.assertEqual(self.sink.session_count, 3)
+
+    def test_recycles_sessions_after_max_messages(self):
+        results = self.deliver([envelope(f'user{number}@x.com') for number in range(4)],
+                               concurrency=1, max_messages=2)
+        self.assertEqual(results, [({}, None)] * 4)
+        self.assertEqual(self.sink.session_count, 2)
+
+    def test_session_dropped_mid_data(self):
+        results = self.deliver([envelope('a@x.com'), envelope('drop@x.com'), envelope('b@x.com')], concurrency=1)
+        self.assertEqual([results[0], results[2]], [({}, None), ({}, None)])
+        self.assertIsInstance(results[1][1], smtplib.SMTPServerDisconnected)
+        self.assertEqual([rcpts for _, rcpts, _ in self.sink.messages], [['a@x.com'], ['b@x.com']])
+        self.assertEqual(self.sink.session_count, 2)
+
+    def test_refused_starttls_sends_nothing(self):
+        # The sink doesn't offer STARTTLS, so the session must not go on in plain text
+        results = self.deliver([envelope('a@x.com'), envelope('b@x.com')], concurrency=1, use_tls=True)
+        self.assertEqual([type(error) for _, error in results], [smtplib.SMTPResponseException] * 2)
+        self.assertEqual(self.sink.message_count, 0)
+
+    def test_failed_session_keeps_other_results(self):
+        send = AsyncSMTPSession.send
+
+        async def failing_send(session, from_email, recipients, data):
+            if recipients == ['boom@x.com']:
+                raise RuntimeError('Unexpected failure')
+            return await send(session, from_email, recipients, data)
+
+        envelopes = [envelope('a@x.com'), envelope('boom@x.com')] + [
+            envelope(f'user{number}@x.com') for number in range(4)]
+        with mock.patch.object(AsyncSMTPSession, 'send', failing_send):
+            results = self.deliver(envelopes, concurrency=2)
+        self.assertIsInstance(results[1][1], RuntimeError)
+        self.assertEqual([result for index, result in enumerate(results) if index != 1], [({}, None)] * 5)
+        self.assertEqual(self.sink.message_count, 5)
+
+    def test_deliver_envelopes(self):
+        results = deliver_envelopes([envelope('a@x.com', 'unknown@x.com')], **self.connection_kwargs())
+        self.assertEqual(results, [({'unknown@x.com': (550, b'5.1.1 User unknown')}, None)])
+
+
+class StartTLSFailureTests(AsyncSMTPTestCase):
+    sink_options = {'starttls': True}
+
+    def test_failed_handshake(self):
+        results = self.deliver([envelope('a@x.com'), envelope('b@x.com')], concurrency=1, use_tls=True)
+        for _, error in results:
+            self.assertIsInstance(error, smtplib.SMTPConnectError)
+            self.assertEqual(error.smtp_code, 421)
+        self.assertEqual(self.sink.message_count, 0)
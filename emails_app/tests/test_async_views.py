@@ -0,0 +1,95 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import OperationalError
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from emails_app.clients import client_ip_cache
+from emails_app.idempotency import REPLAYED_HEADER
+from emails_app.models import AttachmentBlob, BulkJob, BulkJobStatusChoices, Client
+from emails_app.tasks import send_bulk_email_task, send_email_task
+from emails_app.tests.test_attachments import AttachmentStoreTestCase
+
+EMAIL = {'subject': 'Subject', 'message': 'Body', 'recipient': 'a@x.com'}
+
+
+class AsyncViewTests(AttachmentStoreTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.addCleanup(cache.clear)
+        client_ip_cache.clear()
+        self.addCleanup(client_ip_cache.clear)
+        self.user = User.objects.create_user('client')
+        self.client_row = Client.objects.create(user=self.user, system_name='Test', static_ip='192.0.2.10')
+        token = RefreshToken.for_user(self.user).access_token
+        self.headers = {'Authorization': f'Bearer {token}'}
+
+    async def post(self, name, data=None, **headers):
+        return await self.async_client.post(reverse(name), data or {}, headers={**self.headers, **headers})
+
+    async def test_obtain_token(self):
+        response = await self.async_client.post(reverse('async_obtain_token'),
+                                                 headers={'X-Forwarded-For': '192.0.2.10'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['token_info']['user_id'], str(self.user.pk))
+
+        response = await self.async_client.post(reverse('async_obtain_token'),
+                                                 headers={'X-Forwarded-For': '192.0.2.10, 203.0.113.5'})
+        self.assertEqual(response.status_code, 403)
+        response = await self.async_client.get(reverse('async_obtain_token'))
+        self.assertEqual((response.status_code, response['Allow']), (405, 'POST'))
+
+    async def test_authentication(self):
+        response = await self.async_client.post(reverse('async_send_single_email'), EMAIL)
+        self.assertEqual(response.status_code, 401)
+        response = await self.post('async_send_single_email', EMAIL, Authorization='Bearer not-a-token')
+        self.assertEqual(response.status_code, 401)
+
+        other = await User.objects.acreate(username='other')
+        token = RefreshToken.for_user(other).access_token
+        response = await self.post('async_send_single_email', EMAIL, Authorization=f'Bearer {token}')
+        self.assertEqual(response.status_code, 404)
+
+    async def test_send_single_email(self):
+        attachment = SimpleUploadedFile('report.txt', b'report', content_type='text/plain')
+        with mock.patch.object(send_email_task, 'delay') as delay:
+            response = await self.post('async_send_single_email', {**EMAIL, 'attachments': [attachment]})
+            invalid = await self.post('async_send_single_email', {**EMAIL, 'recipient': 'not-an-address'})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(invalid.status_code, 400)
+        subject, message, recipient, attached_files, _, client_pk = delay.call_args.args
+        self.assertEqual((subject, recipient, client_pk), ('Subject', 'a@x.com', self.client_row.pk))
+        self.assertEqual([name for name, _, _ in attached_files], ['report.txt'])
+        self.assertEqual((await AttachmentBlob.objects.aget()).references, 1)
+
+    async def test_idempotent_replay(self):
+        with mock.patch.object(send_email_task, 'delay') as delay:
+            first = await self.post('async_send_single_email', EMAIL, Idempotency_Key='key-1')
+            second = await self.post('async_send_single_email', EMAIL, Idempotency_Key='key-1')
+        self.assertEqual((second.status_code, second.json()), (first.status_code, first.json()))
+        self.assertEqual(second[REPLAYED_HEADER], 'true')
+        self.assertEqual(delay.call_count, 1)
+
+    async def test_send_bulk_email(self):
+        with mock.patch.object(send_bulk_email_task, 'delay') as delay:
+            response = await self.post('async_send_bulk_email', {
+                'subject': 'Subject', 'message': 'Body', 'recipient_list': ['a@x.com', 'b@x.com']})
+        self.assertEqual(response.status_code, 202)
+        job = await BulkJob.objects.aget(pk=response.json()['job_id'])
+        self.assertEqual(job.total, 2)
+        self.assertEqual(delay.call_args.args[2], ['a@x.com', 'b@x.com'])
+        self.assertEqual(delay.call_args.kwargs['job_id'], str(job.pk))
+
+    async def test_failed_publish_cleans_up(self):
+        attachment = SimpleUploadedFile('report.txt', b'report', content_type='text/plain')
+        with mock.patch.object(send_bulk_email_task, 'delay', side_effect=OperationalError('Broker unavailable')):
+            response = await self.post('async_send_bulk_email', {
+                'subject': 'Subject', 'message': 'Body', 'recipient_list': ['a@x.com'],
+                'attachments': [attachment]})
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual((await AttachmentBlob.objects.aget()).references, 0)
+        self.assertEqual((await BulkJob.objects.aget()).status, BulkJobStatusChoices.FAILED)
@@ -0,0 +1,120 @@
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import OperationalError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from emails_app.attachments import (
+    acquire_attachments, blob_path, collect_attachment_garbage, get_attachment_storage,
+    load_attachments, release_attachments, store_attachment,
+)
+from emails_app.models import AttachmentBlob, BulkJob, BulkJobStatusChoices, Client
+from emails_app.tasks import send_bulk_email_task, send_email_task
+
+
+class AttachmentStoreTestCase(TestCase):
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        settings_override = override_settings(EMAIL_ATTACHMENT_ROOT=root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        get_attachment_storage.cache_clear()
+        self.addCleanup(get_attachment_storage.cache_clear)
+
+    def store(self, content=b'report', name='report.txt'):
+        return store_attachment(SimpleUploadedFile(name, content, content_type='text/plain'))
+
+    def references(self, ref):
+        return AttachmentBlob.objects.get(digest=ref[1]).references
+
+    def blob_exists(self, ref):
+        return get_attachment_storage().exists(blob_path(ref[1]))
+
+
+class AttachmentBlobTests(AttachmentStoreTestCase):
+    def test_same_content_is_stored_once(self):
+        first = self.store(name='a.txt')
+        second = self.store(name='b.txt')
+        self.assertEqual(first[1], second[1])
+        self.assertEqual(AttachmentBlob.objects.count(), 1)
+        self.assertEqual(load_attachments([first, second]), [
+            ('a.txt', b'report', 'text/plain'), ('b.txt', b'report', 'text/plain')])
+
+    def test_reference_counts(self):
+        ref = self.store()
+        acquire_attachments([ref], count=3)
+        self.assertEqual(self.references(ref), 3)
+        # The same blob attached twice holds two references per task
+        release_attachments([ref, ref])
+        self.assertEqual(self.references(ref), 1)
+
+    def test_collects_unreferenced_blobs_after_grace_period(self):
+        kept, collected = self.store(b'kept'), self.store(b'collected')
+        acquire_attachments([kept])
+        AttachmentBlob.objects.update(updated_at=timezone.now() - timedelta(hours=2))
+
+        self.assertEqual(collect_attachment_garbage(grace_period=3600), 1)
+        self.assertTrue(self.blob_exists(kept))
+        self.assertFalse(self.blob_exists(collected))
+        self.assertFalse(AttachmentBlob.objects.filter(digest=collected[1]).exists())
+
+    def test_keeps_recently_released_blobs(self):
+        ref = self.store()
+        self.assertEqual(collect_attachment_garbage(grace_period=3600), 0)
+        self.assertTrue(self.blob_exists(ref))
+
+    def test_collects_referenced_blobs_past_max_age(self):
+        ref = self.store()
+        acquire_attachments([ref])
+        AttachmentBlob.objects.update(updated_at=timezone.now() - timedelta(days=8))
+        self.assertEqual(collect_attachment_garbage(grace_period=3600, max_age=7 * 24 * 3600), 1)
+        self.assertFalse(self.blob_exists(ref))
+
+
+class FanOutReferenceTests(AttachmentStoreTestCase):
+    def test_failed_publish_releases_chunk_references(self):
+        client = Client.objects.create(system_name='Test', static_ip='192.0.2.10')
+        ref = self.store()
+        # The reference the view hands to the fan-out task
+        acquire_attachments([ref])
+
+        with mock.patch('emails_app.tasks.group') as group:
+            group.return_value.apply_async.side_effect = OperationalError('Broker unavailable')
+            send_bulk_email_task.apply(
+                args=('Subject', 'Body', ['a@x.com', 'b@x.com', 'c@x.com'], [ref], None, client.pk),
+                kwargs={'chunk_size': 1})
+
+        self.assertEqual(group.return_value.apply_async.call_count, 4)
+        self.assertEqual(self.references(ref), 0)
+
+
+class SendViewReferenceTests(AttachmentStoreTestCase):
+    def setUp(self):
+        super().setUp()
+        user = User.objects.create_user('client')
+        Client.objects.create(user=user, system_name='Test', static_ip='192.0.2.10')
+        self.api = APIClient()
+        self.api.force_authenticate(user)
+
+    def post(self, name, task, **data):
+        attachment = SimpleUploadedFile('report.txt', b'report', content_type='text/plain')
+        with mock.patch.object(task, 'delay', side_effect=OperationalError('Broker unavailable')):
+            response = self.api.post(reverse(name), {
+                'subject': 'Subject', 'message': 'Body', 'attachments': [attachment], **data},
+                format='multipart')
+        self.assertEqual(response.status_code, 500)
+        return AttachmentBlob.objects.get().references
+
+    def test_failed_publish_releases_references(self):
+        self.assertEqual(self.post('send_single_email', send_email_task, recipient='a@x.com'), 0)
+        self.assertEqual(self.post('send_bulk_email', send_bulk_email_task,
+                                   recipient_list=['a@x.com', 'b@x.com']), 0)
+        self.assertEqual(BulkJob.objects.get().status, BulkJobStatusChoices.FAILED)
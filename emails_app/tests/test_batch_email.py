@@ -0,0 +1,78 @@
+import json
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import OperationalError
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from emails_app.models import AttachmentBlob, Client
+from emails_app.tests.test_attachments import AttachmentStoreTestCase
+
+MESSAGES = [
+    {'subject': 'First', 'message': 'Body', 'recipient': 'a@x.com'},
+    {'subject': 'Second', 'recipient': 'not-an-address'},
+    {'subject': 'Third', 'html_message': '<p>Hi</p>', 'recipient': 'c@x.com'},
+]
+
+
+class BatchEmailTestCase(AttachmentStoreTestCase):
+    def setUp(self):
+        super().setUp()
+        user = User.objects.create_user('client')
+        self.client_row = Client.objects.create(user=user, system_name='Test', static_ip='192.0.2.10')
+        self.api = APIClient()
+        self.api.force_authenticate(user)
+        group = mock.patch('emails_app.views.group')
+        self.group = group.start()
+        self.addCleanup(group.stop)
+
+    def post(self, data, format='json'):
+        return self.api.post(reverse('send_batch_email'), data, format=format)
+
+    def published(self):
+        (signatures,), _ = self.group.call_args
+        return [signature.args for signature in signatures]
+
+
+class SendBatchEmailTests(BatchEmailTestCase):
+    def test_publishes_the_valid_messages(self):
+        response = self.post({'messages': MESSAGES})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual((response.data['accepted'], response.data['rejected']), (2, 1))
+        self.assertEqual([result['accepted'] for result in response.data['results']], [True, False, True])
+        self.assertIn('recipient', response.data['results'][1]['errors'])
+        self.assertEqual(self.published(), [
+            ('First', 'Body', 'a@x.com', [], None, self.client_row.pk),
+            ('Third', None, 'c@x.com', [], '<p>Hi</p>', self.client_row.pk)])
+        self.group.return_value.apply_async.assert_called_once_with()
+
+    def test_no_valid_messages(self):
+        response = self.post({'messages': MESSAGES[1:2]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['results'][0]['accepted'], False)
+        self.group.assert_not_called()
+
+    @override_settings(EMAIL_BATCH_MAX_MESSAGES=2)
+    def test_rejects_malformed_batches(self):
+        for messages in ([], {'subject': 'First'}, MESSAGES):
+            self.assertEqual(self.post({'messages': messages}).status_code, 400)
+        self.group.assert_not_called()
+
+
+class SendBatchEmailAttachmentTests(BatchEmailTestCase):
+    def post_with_attachment(self):
+        attachment = SimpleUploadedFile('report.txt', b'report', content_type='text/plain')
+        return self.post({'messages': json.dumps(MESSAGES), 'attachments': [attachment]}, format='multipart')
+
+    def test_every_message_holds_a_reference(self):
+        self.assertEqual(self.post_with_attachment().status_code, 202)
+        self.assertEqual(AttachmentBlob.objects.get().references, 2)
+        self.assertEqual([args[3][0][0] for args in self.published()], ['report.txt', 'report.txt'])
+
+    def test_failed_publish_releases_references(self):
+        self.group.return_value.apply_async.side_effect = OperationalError('Broker unavailable')
+        self.assertEqual(self.post_with_attachment().status_code, 500)
+        self.assertEqual(AttachmentBlob.objects.get().references, 0)
@@ -0,0 +1,54 @@
+from io import StringIO
+from unittest import mock
+
+from celery import current_app
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from emails_app.benchmark import DeliveryBenchmark, benchmark_routing, percentile
+from emails_app.models import Client
+
+
+def queue_for(name):
+    return current_app.amqp.router.route({}, name)['queue'].name
+
+
+class PercentileTests(SimpleTestCase):
+    def test_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual([percentile(values, fraction) for fraction in (0.5, 0.9, 0.99, 1.0)],
+                         [50, 90, 99, 100])
+        self.assertEqual(percentile([7], 0.0), 7)
+        self.assertEqual(percentile([1, 2, 3], 0.5), 2)
+        self.assertIsNone(percentile([], 0.5))
+
+
+@override_settings(EMAIL_BENCHMARK_QUEUE='benchmark-test')
+class BenchmarkRoutingTests(SimpleTestCase):
+    def test_routes_every_task_to_the_benchmark_queue(self):
+        send_email = 'emails_app.tasks.send_email_task'
+        queue = queue_for(send_email)
+        with benchmark_routing():
+            self.assertEqual(queue_for(send_email), 'benchmark-test')
+            self.assertEqual(queue_for('emails_app.tasks.send_email_chunk'), 'benchmark-test')
+        self.assertEqual(queue_for(send_email), queue)
+
+
+class BenchmarkDeliveryCommandTests(TestCase):
+    def test_refuses_shared_settings(self):
+        with mock.patch.object(DeliveryBenchmark, 'run') as run:
+            with self.assertRaises(CommandError):
+                call_command('benchmark_delivery', stdout=StringIO())
+            with self.assertRaises(CommandError):
+                call_command('benchmark_worker', '--relay', '127.0.0.1:25', '--hostname', 'test')
+        run.assert_not_called()
+
+    def test_eager_run(self):
+        stdout = StringIO()
+        with override_settings(EMAIL_BENCHMARK_ISOLATED=True):
+            call_command('benchmark_delivery', '--tasks', 'single,chunk', '--recipients', '3',
+                         '--timeout', '10', stdout=stdout)
+        self.assertIn('"completed": true', stdout.getvalue())
+        self.assertNotIn('"completed": false', stdout.getvalue())
+        # The throwaway client is gone, and with it what it sent
+        self.assertFalse(Client.objects.exists())
@@ -0,0 +1,114 @@
+import smtplib
+from email import message_from_bytes
+from types import SimpleNamespace
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from emails_app.models import (
+    BulkJob, BulkJobStatusChoices, Client, EmailRecord, EmailStatusChoices, SuppressedRecipient,
+)
+from emails_app.scheduling import get_max_retries
+from emails_app.tasks import send_email_chunk, settle_chunk
+from emails_app.tests.utils import start_sink
+
+
+class BulkJobProgressTests(TestCase):
+    def setUp(self):
+        self.client_row = Client.objects.create(system_name='Test', static_ip='192.0.2.10')
+        self.job = BulkJob.objects.create(client=self.client_row, subject='Subject', total=5)
+
+    def test_counts_progress_until_complete(self):
+        BulkJob.record_progress(self.job.pk, sent=2, failed=1)
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.sent, self.job.failed, self.job.pending), (2, 1, 2))
+        self.assertIsNone(self.job.completed_at)
+
+        BulkJob.record_progress(self.job.pk, sent=1, suppressed=1)
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, BulkJobStatusChoices.COMPLETED)
+        self.assertIsNotNone(self.job.completed_at)
+
+    def test_mark_failed_fails_the_rest(self):
+        BulkJob.mark_running(self.job.pk)
+        BulkJob.record_progress(self.job.pk, sent=2)
+        BulkJob.mark_failed(self.job.pk)
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, BulkJobStatusChoices.FAILED)
+        self.assertEqual((self.job.sent, self.job.failed, self.job.pending), (2, 3, 0))
+
+    def test_completed_job_is_not_failed(self):
+        BulkJob.record_progress(self.job.pk, sent=5)
+        BulkJob.mark_failed(self.job.pk)
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.failed), (BulkJobStatusChoices.COMPLETED, 0))
+
+
+class SettleChunkTests(TestCase):
+    def setUp(self):
+        self.client_row = Client.objects.create(system_name='Test', static_ip='192.0.2.10')
+        self.job = BulkJob.objects.create(client=self.client_row, subject='Subject', total=3)
+        self.results = [
+            ({}, None),
+            (None, smtplib.SMTPDataError(554, b'Message rejected')),
+            (None, smtplib.SMTPServerDisconnected('Connection lost')),
+        ]
+
+    def settle(self, retries):
+        task = SimpleNamespace(request=SimpleNamespace(retries=retries))
+        return settle_chunk(task, self.client_row, str(self.job.pk),
+                            ['a@x.com', 'b@x.com', 'c@x.com'], self.results,
+                            recipient_of=lambda recipient: recipient,
+                            subject_of=lambda recipient: 'Subject')
+
+    def statuses(self):
+        return dict(EmailRecord.objects.values_list('recipient', 'status'))
+
+    def test_holds_back_transient_failures_for_retry(self):
+        self.assertEqual(self.settle(retries=0), ['c@x.com'])
+        self.assertEqual(self.statuses(), {
+            'a@x.com': EmailStatusChoices.SENT, 'b@x.com': EmailStatusChoices.FAILED})
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.sent, self.job.failed, self.job.completed_at), (1, 1, None))
+
+    def test_records_transient_failures_on_last_attempt(self):
+        self.assertEqual(self.settle(retries=get_max_retries()), [])
+        self.assertEqual(self.statuses()['c@x.com'], EmailStatusChoices.FAILED)
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.sent, self.job.failed), (1, 2))
+        self.assertIsNotNone(self.job.completed_at)
+
+
+def refuse_unknown(address):
+    if address.startswith('unknown'):
+        return (550, '5.1.1 User unknown')
+    return None
+
+
+class CollectiveChunkTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        settings_override = override_settings(EMAIL_MAX_RECIPIENTS_PER_MESSAGE=2)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client_row = Client.objects.create(system_name='Test', static_ip='192.0.2.10')
+        self.job = BulkJob.objects.create(client=self.client_row, subject='Subject', total=5)
+        self.sink = start_sink(self, reject=refuse_unknown)
+
+    def test_sends_blind_copies_within_the_rcpt_limit(self):
+        recipients = ['a@x.com', 'b@x.com', 'c@x.com', 'unknown@x.com', 'e@x.com']
+        send_email_chunk.apply(args=('Subject', 'Body', recipients, None, None, self.client_row.pk),
+                               kwargs={'job_id': str(self.job.pk), 'collective': True})
+
+        self.assertEqual([rcpts for _, rcpts, _ in self.sink.messages],
+                         [['a@x.com', 'b@x.com'], ['c@x.com'], ['e@x.com']])
+        for _, _, data in self.sink.messages:
+            self.assertEqual(message_from_bytes(data)['To'], 'undisclosed-recipients:;')
+        self.assertEqual(dict(EmailRecord.objects.values_list('recipient', 'status')), {
+            **dict.fromkeys(['a@x.com', 'b@x.com', 'c@x.com', 'e@x.com'], EmailStatusChoices.SENT),
+            'unknown@x.com': EmailStatusChoices.FAILED})
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.sent, self.job.failed, self.job.status),
+                         (4, 1, BulkJobStatusChoices.COMPLETED))
+        self.assertEqual(list(SuppressedRecipient.objects.values_list('email', flat=True)), ['unknown@x.com'])
@@ -0,0 +1,90 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from emails_app.clients import ClientIPCache, bump_clients_generation, client_ip_cache
+from emails_app.models import Client
+from emails_app.utils import get_server_ip, get_trusted_proxies
+
+
+class GetServerIPTests(SimpleTestCase):
+    def setUp(self):
+        get_trusted_proxies.cache_clear()
+        self.addCleanup(get_trusted_proxies.cache_clear)
+
+    def server_ip(self, remote_addr, forwarded_for=None):
+        headers = {'HTTP_X_FORWARDED_FOR': forwarded_for} if forwarded_for else {}
+        return get_server_ip(RequestFactory().post('/', REMOTE_ADDR=remote_addr, **headers))
+
+    def test_direct_request(self):
+        self.assertEqual(self.server_ip('203.0.113.5'), '203.0.113.5')
+
+    def test_ignores_forwarded_for_from_untrusted_peer(self):
+        self.assertEqual(self.server_ip('203.0.113.5', '192.0.2.10'), '203.0.113.5')
+
+    def test_trusted_proxy(self):
+        self.assertEqual(self.server_ip('127.0.0.1', '203.0.113.5'), '203.0.113.5')
+
+    def test_spoofed_chain_is_not_believed(self):
+        # The client prepended an address of a registered client
+        self.assertEqual(self.server_ip('127.0.0.1', '192.0.2.10, 203.0.113.5'), '203.0.113.5')
+
+    @override_settings(EMAIL_TRUSTED_PROXIES=['127.0.0.1', '10.0.0.0/8'])
+    def test_skips_every_trusted_hop(self):
+        self.assertEqual(
+            self.server_ip('127.0.0.1', '192.0.2.10, 203.0.113.5, 10.1.2.3, 10.4.5.6'), '203.0.113.5')
+
+    @override_settings(EMAIL_TRUSTED_PROXIES=['127.0.0.1', '10.0.0.0/8'])
+    def test_chain_of_trusted_hops_only(self):
+        self.assertEqual(self.server_ip('127.0.0.1', '10.1.2.3, not-an-ip'), 'not-an-ip')
+        self.assertEqual(self.server_ip('127.0.0.1', '10.1.2.3, 10.4.5.6'), '10.1.2.3')
+
+
+class ClientIPCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.client_row = Client.objects.create(system_name='Test', static_ip='192.0.2.10')
+
+    def test_caches_hits_and_misses(self):
+        ip_cache = ClientIPCache(check_interval=3600)
+        with self.assertNumQueries(2):
+            self.assertEqual(ip_cache.get('192.0.2.10'), self.client_row)
+            self.assertIsNone(ip_cache.get('192.0.2.99'))
+            ip_cache.get('192.0.2.10')
+            ip_cache.get('192.0.2.99')
+
+    def test_generation_bump_drops_cached_clients(self):
+        ip_cache = ClientIPCache(check_interval=0)
+        self.assertIsNone(ip_cache.get('192.0.2.99'))
+        Client.objects.filter(pk=self.client_row.pk).update(static_ip='192.0.2.99')
+        self.assertIsNone(ip_cache.get('192.0.2.99'))
+        bump_clients_generation()
+        self.assertEqual(ip_cache.get('192.0.2.99'), self.client_row)
+
+    def test_saving_a_client_bumps_the_generation(self):
+        ip_cache = ClientIPCache(check_interval=0)
+        self.assertIsNone(ip_cache.get('192.0.2.99'))
+        self.client_row.static_ip = '192.0.2.99'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client_row.save()
+        self.assertEqual(ip_cache.get('192.0.2.99'), self.client_row)
+
+
+class ObtainTokenTests(TestCase):
+    def setUp(self):
+        client_ip_cache.clear()
+        self.addCleanup(client_ip_cache.clear)
+        Client.objects.create(user=User.objects.create_user('client'), system_name='Test',
+                              static_ip='192.0.2.10')
+
+    def test_issues_tokens_to_registered_ip(self):
+        response = self.client.post(reverse('obtain_token'), REMOTE_ADDR='192.0.2.10')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access', response.json())
+
+    def test_refuses_unknown_ip(self):
+        response = self.client.post(reverse('obtain_token'), REMOTE_ADDR='127.0.0.1',
+                                    HTTP_X_FORWARDED_FOR='192.0.2.10, 203.0.113.5')
+        self.assertEqual(response.status_code, 403)
@@ -0,0 +1,79 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from emails_app.idempotency import REPLAYED_HEADER, _cache_key
+from emails_app.models import Client, IdempotencyKey
+from emails_app.tasks import send_email_task
+
+EMAIL = {'subject': 'Subject', 'message': 'Body', 'recipient': 'a@x.com'}
+
+
+class IdempotentViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user('client')
+        self.client_row = Client.objects.create(user=self.user, system_name='Test', static_ip='192.0.2.10')
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+        delay = mock.patch.object(send_email_task, 'delay')
+        self.delay = delay.start()
+        self.addCleanup(delay.stop)
+
+    def post(self, key='key-1', **data):
+        return self.api.post(reverse('send_single_email'), {**EMAIL, **data}, HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_repeat_replays_the_response(self):
+        first = self.post()
+        second = self.post()
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual((second.status_code, second.data), (202, first.data))
+        self.assertEqual(second[REPLAYED_HEADER], 'true')
+        self.assertEqual(self.delay.call_count, 1)
+        # Another key is a new request
+        self.assertEqual(self.post(key='key-2').status_code, 202)
+        self.assertEqual(self.delay.call_count, 2)
+
+    def test_cache_hit_makes_no_queries(self):
+        self.post()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.post()[REPLAYED_HEADER], 'true')
+
+    def test_view_queries_the_client_once(self):
+        with mock.patch('emails_app.idempotency.Client.objects.filter', wraps=Client.objects.filter) as lookup:
+            self.post()
+        self.assertEqual(lookup.call_count, 1)
+
+    def test_request_in_progress(self):
+        IdempotencyKey.objects.create(client=self.client_row, key='key-1')
+        response = self.post()
+        self.assertEqual(response.status_code, 409)
+        self.delay.assert_not_called()
+
+    def test_failed_request_releases_the_key(self):
+        self.assertEqual(self.post(recipient='not-an-address').status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.post().status_code, 202)
+
+        self.delay.side_effect = RuntimeError('Broker unavailable')
+        self.assertEqual(self.post(key='key-2').status_code, 500)
+        self.assertFalse(IdempotencyKey.objects.filter(key='key-2').exists())
+
+    def test_database_hit_is_cached_for_the_remaining_ttl(self):
+        IdempotencyKey.objects.create(client=self.client_row, key='key-1', status_code=202,
+                                      response={'success': True})
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(hours=23))
+        with self.settings(EMAIL_IDEMPOTENCY_TTL=24 * 3600), \
+                mock.patch('emails_app.idempotency.cache.set') as cache_set:
+            response = self.post()
+        self.assertEqual((response.status_code, response.data), (202, {'success': True}))
+        self.assertEqual(cache_set.call_args.args[0], _cache_key(self.user.pk, 'key-1'))
+        self.assertAlmostEqual(cache_set.call_args.kwargs['timeout'], 3600, delta=60)
+        self.delay.assert_not_called()
@@ -0,0 +1,76 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from emails_app.metrics import (
+    AGGREGATE_FILE, MESSAGES_TOTAL, STAGE_SECONDS, MetricsRegistry, clear_labels, collect,
+    compact_metrics, render_prometheus,
+)
+
+DEAD_PID = 999999
+
+
+class CompactMetricsTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        settings_override = override_settings(EMAIL_METRICS_DIR=self.directory)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        process_exists = mock.patch('emails_app.metrics._process_exists', lambda pid: pid != DEAD_PID)
+        process_exists.start()
+        self.addCleanup(process_exists.stop)
+        clear_labels()
+
+    def write(self, name, sent=0, seconds=()):
+        registry = MetricsRegistry(flush_interval=3600)
+        registry.inc(MESSAGES_TOTAL, sent, outcome='sent')
+        for value in seconds:
+            registry.observe(STAGE_SECONDS, value, stage='smtp', outcome='ok')
+        data = registry.snapshot()
+        with open(os.path.join(self.directory, name), 'w') as f:
+            json.dump(data, f)
+
+    def files(self):
+        return sorted(os.listdir(self.directory))
+
+    def sent(self):
+        counters, _, _ = collect()
+        return counters.get((MESSAGES_TOTAL, (('outcome', 'sent'),)))
+
+    def test_folds_exited_processes_into_the_aggregate(self):
+        live = f'{os.getpid()}-live.json'
+        self.write(live, sent=1)
+        self.write(f'{DEAD_PID}-first.json', sent=2, seconds=[0.002])
+        self.assertEqual(self.sent(), 3)
+        self.assertEqual([name for name in self.files() if name.endswith('.json')], sorted([AGGREGATE_FILE, live]))
+
+        # A later exit is added to the aggregate, not written over it
+        self.write(f'{DEAD_PID}-second.json', sent=4, seconds=[0.002, 20.0])
+        self.assertEqual(self.sent(), 7)
+        _, histograms, _ = collect()
+        counts, total = histograms[(STAGE_SECONDS, (('outcome', 'ok'), ('stage', 'smtp')))]
+        self.assertEqual((sum(counts), counts[1], counts[-3]), (3, 2, 1))
+        self.assertAlmostEqual(total, 20.004)
+        self.assertIn(f'{MESSAGES_TOTAL}{{outcome="sent"}} 7', render_prometheus())
+
+    def test_drops_unreadable_and_foreign_files(self):
+        self.write(f'{DEAD_PID}-kept.json', sent=2)
+        with open(os.path.join(self.directory, f'{DEAD_PID}-broken.json'), 'w') as f:
+            f.write('{')
+        with open(os.path.join(self.directory, f'{DEAD_PID}-buckets.json'), 'w') as f:
+            json.dump({'buckets': [1.0], 'counters': [[MESSAGES_TOTAL, [['outcome', 'sent']], 5]],
+                       'histograms': []}, f)
+        compact_metrics()
+        self.assertEqual([name for name in self.files() if name.endswith('.json')], [AGGREGATE_FILE])
+        self.assertEqual(self.sent(), 2)
+
+    def test_nothing_to_compact(self):
+        compact_metrics(os.path.join(self.directory, 'missing'))
+        self.write(f'{os.getpid()}-live.json', sent=1)
+        compact_metrics()
+        self.assertNotIn(AGGREGATE_FILE, self.files())
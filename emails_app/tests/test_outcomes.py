@@ -0,0 +1,57 @@
+import smtplib
+
+from django.test import SimpleTestCase
+
+from emails_app.outcomes import expand_batch_results, split_outcomes
+
+
+def batch(*recipients):
+    return ('sender@example.com', list(recipients), b'message')
+
+
+class ExpandBatchResultsTests(SimpleTestCase):
+    def test_accepted_envelope(self):
+        results = expand_batch_results([batch('a@x.com', 'b@x.com')], [({}, None)])
+        self.assertEqual(results, [({}, None), ({}, None)])
+
+    def test_partial_rcpt_refusal(self):
+        refused = {'b@x.com': (550, b'5.1.1 User unknown')}
+        results = expand_batch_results(
+            [batch('a@x.com', 'b@x.com', 'c@x.com')], [(refused, None)])
+        self.assertEqual(results, [
+            ({}, None),
+            ({'b@x.com': (550, b'5.1.1 User unknown')}, None),
+            ({}, None),
+        ])
+
+    def test_every_recipient_refused(self):
+        error = smtplib.SMTPRecipientsRefused({
+            'a@x.com': (550, b'5.1.1 User unknown'),
+            'b@x.com': (450, b'4.2.1 Mailbox busy'),
+        })
+        results = expand_batch_results([batch('a@x.com', 'b@x.com')], [(None, error)])
+        self.assertEqual(results, [
+            ({'a@x.com': (550, b'5.1.1 User unknown')}, None),
+            ({'b@x.com': (450, b'4.2.1 Mailbox busy')}, None),
+        ])
+
+    def test_whole_envelope_error(self):
+        error = smtplib.SMTPDataError(554, b'Message rejected')
+        results = expand_batch_results(
+            [batch('a@x.com', 'b@x.com'), batch('c@x.com')], [(None, error), ({}, None)])
+        self.assertEqual(results, [(None, error), (None, error), ({}, None)])
+
+
+class SplitOutcomesTests(SimpleTestCase):
+    def test_sorts_by_outcome(self):
+        permanent = smtplib.SMTPDataError(554, b'Message rejected')
+        transient = smtplib.SMTPServerDisconnected('Connection lost')
+        delivered, failed, retry = split_outcomes(
+            ['a', 'b', 'c', 'd', 'e'],
+            [({}, None), (None, permanent), (None, transient),
+             ({'d': (550, b'5.1.1 User unknown')}, None),
+             ({'e': (451, b'4.3.0 Try again')}, None)])
+        self.assertEqual(delivered, ['a'])
+        self.assertEqual([item for item, _ in failed], ['b', 'd'])
+        self.assertEqual([item for item, _ in retry], ['c', 'e'])
+        self.assertIsInstance(failed[1][1], smtplib.SMTPRecipientsRefused)
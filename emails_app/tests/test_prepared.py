@@ -0,0 +1,76 @@
+from email import message_from_bytes
+from unittest import mock
+
+from django.core.mail import EmailMessage
+from django.test import SimpleTestCase
+
+from emails_app.prepared import PreparedMessage, PreparedMessageCache, build_attachment_parts
+
+
+def make_email():
+    email = EmailMessage('Subject', 'Body', 'sender@example.com')
+    for part in build_attachment_parts([('report.txt', b'report', 'text/plain')]):
+        email.attach(part)
+    return email
+
+
+def parse(envelope):
+    return message_from_bytes(envelope[2])
+
+
+class PreparedMessageTests(SimpleTestCase):
+    def test_splices_per_recipient_headers(self):
+        prepared = PreparedMessage(make_email())
+        first, second = prepared.envelope('a@x.com'), prepared.envelope('b@x.com')
+        self.assertEqual(first[:2], ('sender@example.com', ['a@x.com']))
+
+        first, second = parse(first), parse(second)
+        self.assertEqual((first.get_all('To'), second.get_all('To')), (['a@x.com'], ['b@x.com']))
+        self.assertEqual(len(first.get_all('Message-ID')), 1)
+        self.assertNotEqual(first['Message-ID'], second['Message-ID'])
+        self.assertEqual(first['Subject'], 'Subject')
+        self.assertEqual(first.get_payload(1).get_payload(decode=True), b'report')
+
+    def test_date_is_the_send_time(self):
+        with mock.patch('emails_app.prepared.formatdate', return_value='Mon, 01 Jan 2024 08:00:00 -0000'):
+            prepared = PreparedMessage(make_email())
+        with mock.patch('emails_app.prepared.formatdate', return_value='Mon, 01 Jan 2024 11:00:00 -0000'):
+            message = parse(prepared.envelope('a@x.com'))
+        self.assertEqual(message.get_all('Date'), ['Mon, 01 Jan 2024 11:00:00 -0000'])
+
+    def test_batch_envelope_keeps_recipients_out_of_headers(self):
+        envelope = PreparedMessage(make_email()).batch_envelope(['a@x.com', 'b@x.com'])
+        self.assertEqual(envelope[1], ['a@x.com', 'b@x.com'])
+        self.assertEqual(parse(envelope).get_all('To'), ['undisclosed-recipients:;'])
+        self.assertNotIn(b'a@x.com', envelope[2])
+
+    def test_folded_headers_are_stripped_whole(self):
+        email = make_email()
+        email.to = [f'recipient{number}@example.com' for number in range(20)]
+        message = parse(PreparedMessage(email).envelope('a@x.com'))
+        self.assertEqual(message.get_all('To'), ['a@x.com'])
+        self.assertNotIn(b'recipient19', PreparedMessage(email).envelope('a@x.com')[2])
+
+
+class PreparedMessageCacheTests(SimpleTestCase):
+    def test_reuses_prepared_message_per_job(self):
+        cache = PreparedMessageCache(max_size=2)
+        build = mock.Mock(side_effect=make_email)
+        first = cache.get('job-1', build)
+        self.assertIs(cache.get('job-1', build), first)
+        self.assertEqual(build.call_count, 1)
+
+    def test_evicts_least_recently_used(self):
+        cache = PreparedMessageCache(max_size=2)
+        first = cache.get('job-1', make_email)
+        cache.get('job-2', make_email)
+        cache.get('job-1', make_email)
+        cache.get('job-3', make_email)
+        self.assertIs(cache.get('job-1', make_email), first)
+        build = mock.Mock(side_effect=make_email)
+        cache.get('job-2', build)
+        self.assertEqual(build.call_count, 1)
+
+    def test_no_job_key_is_not_cached(self):
+        cache = PreparedMessageCache()
+        self.assertIsNot(cache.get(None, make_email), cache.get(None, make_email))
@@ -0,0 +1,58 @@
+from django.test import SimpleTestCase, TestCase
+
+from emails_app.models import RateLimitBucket
+from emails_app.ratelimit import make_bucket, take_tokens, throttle
+
+
+class MakeBucketTests(SimpleTestCase):
+    def test_unset_rate_means_no_bucket(self):
+        self.assertIsNone(make_bucket('test', None))
+        self.assertIsNone(make_bucket('test', 0))
+
+    def test_burst_defaults_to_one_second(self):
+        self.assertEqual(make_bucket('test', 2.5).burst, 3)
+        self.assertEqual(make_bucket('test', 0.1).burst, 1)
+
+
+class TakeTokensTests(TestCase):
+    def test_grants_up_to_the_emptiest_bucket(self):
+        buckets = [make_bucket('a', rate=0.001, burst=10), make_bucket('b', rate=0.001, burst=4)]
+        self.assertEqual(take_tokens(buckets, 6), (4, 0))
+        tokens = dict(RateLimitBucket.objects.values_list('key', 'tokens'))
+        self.assertAlmostEqual(tokens['a'], 6, delta=0.01)
+        self.assertAlmostEqual(tokens['b'], 0, delta=0.01)
+
+    def test_empty_bucket_asks_to_wait(self):
+        bucket = make_bucket('test', rate=10, burst=5)
+        self.assertEqual(take_tokens([bucket], 5), (5, 0))
+        granted, wait = take_tokens([bucket], 5)
+        self.assertEqual(granted, 0)
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 0.5)
+
+    def test_without_buckets(self):
+        self.assertEqual(take_tokens([], 7), (7, 0))
+
+
+class ThrottleTests(TestCase):
+    def setUp(self):
+        # Refills too slowly to matter, so the tokens taken can be counted
+        self.bucket = make_bucket('test', rate=0.001, burst=100)
+
+    def tokens_taken(self):
+        return self.bucket.burst - RateLimitBucket.objects.get(key='test').tokens
+
+    def test_weighted_slices(self):
+        items = [1, 2, 1, 3, 1]
+        slices = list(throttle(items, [self.bucket], batch_size=3, weight=lambda item: item))
+        self.assertEqual(slices, [[1, 2], [1], [3], [1]])
+        self.assertAlmostEqual(self.tokens_taken(), sum(items), delta=0.01)
+
+    def test_weight_larger_than_batch_size(self):
+        items = [5, 1, 1, 2]
+        slices = list(throttle(items, [self.bucket], batch_size=3, weight=lambda item: item))
+        self.assertEqual(slices, [[5], [1, 1], [2]])
+        self.assertAlmostEqual(self.tokens_taken(), sum(items), delta=0.01)
+
+    def test_without_buckets(self):
+        self.assertEqual(list(throttle([1, 2], [], weight=lambda item: item)), [[1, 2]])
@@ -0,0 +1,135 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import OperationalError
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from emails_app.models import BulkJob, BulkJobStatusChoices, Client, RecipientList
+from emails_app.recipients import ingest_recipient_file, iter_recipient_chunks, normalize_email
+from emails_app.tasks import send_email_chunk, send_recipient_list_task
+
+
+def upload(content, name='recipients.csv'):
+    return SimpleUploadedFile(name, content.encode(), content_type='text/plain')
+
+
+class IngestRecipientFileTests(TestCase):
+    def setUp(self):
+        self.client_row = Client.objects.create(system_name='Test', static_ip='192.0.2.10')
+        self.recipient_list = RecipientList.objects.create(client=self.client_row)
+
+    def ingest(self, content, file_format='csv', **kwargs):
+        return ingest_recipient_file(self.recipient_list, upload(content), file_format, **kwargs)
+
+    def emails(self):
+        return sorted(self.recipient_list.entries.values_list('email', flat=True))
+
+    def test_csv_with_header_dedupes_and_reports_invalid_rows(self):
+        recipient_list, errors = self.ingest(
+            'name,Email\nAnn,ann@example.com\nBob,not-an-address\n\n'
+            'Ann again, ann@EXAMPLE.com \nCat,cat@example.com\n', batch_size=2)
+        self.assertEqual(self.emails(), ['ann@example.com', 'cat@example.com'])
+        self.assertEqual(
+            (recipient_list.total_rows, recipient_list.valid_count,
+             recipient_list.invalid_count, recipient_list.duplicate_count),
+            (4, 2, 1, 1))
+        self.assertEqual(errors, [{'line': 3, 'value': 'not-an-address'}])
+
+    def test_csv_without_header_uses_first_column(self):
+        recipient_list, _ = self.ingest('ann@example.com,Ann\nbob@example.com,Bob\n')
+        self.assertEqual(self.emails(), ['ann@example.com', 'bob@example.com'])
+        self.assertEqual(recipient_list.total_rows, 2)
+
+    def test_ndjson(self):
+        recipient_list, errors = self.ingest(
+            '{"email": "ann@example.com"}\n"bob@example.com"\n{broken\n{"name": "Cat"}\n', 'ndjson')
+        self.assertEqual(self.emails(), ['ann@example.com', 'bob@example.com'])
+        self.assertEqual(recipient_list.invalid_count, 2)
+        self.assertEqual([error['line'] for error in errors], [3, 4])
+
+    def test_limits_reported_errors(self):
+        recipient_list, errors = self.ingest('x\ny\nz\n', max_reported_errors=2)
+        self.assertEqual(recipient_list.invalid_count, 3)
+        self.assertEqual(len(errors), 2)
+
+    def test_normalize_email_lowercases_only_the_domain(self):
+        self.assertEqual(normalize_email(' Ann.Lee@Example.COM '), 'Ann.Lee@example.com')
+
+    def test_iter_recipient_chunks(self):
+        self.ingest('a@x.com\nb@x.com\nc@x.com\n')
+        chunks = list(iter_recipient_chunks(self.recipient_list, 2))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 1])
+        self.assertEqual(sorted(sum(chunks, [])), ['a@x.com', 'b@x.com', 'c@x.com'])
+
+
+class SendRecipientListTaskTests(TestCase):
+    def setUp(self):
+        self.client_row = Client.objects.create(system_name='Test', static_ip='192.0.2.10')
+        self.recipient_list = RecipientList.objects.create(client=self.client_row)
+        ingest_recipient_file(self.recipient_list, upload('a@x.com\nb@x.com\nc@x.com\nd@x.com\n'), 'csv')
+        self.job = BulkJob.objects.create(client=self.client_row, subject='Subject', total=4)
+
+    def run_task(self):
+        return send_recipient_list_task.apply(
+            args=('Subject', 'Body', self.recipient_list.pk, None, None, self.client_row.pk),
+            kwargs={'chunk_size': 2, 'job_id': str(self.job.pk)})
+
+    def test_retry_resumes_after_the_published_chunks(self):
+        published = []
+
+        def delay(subject, message, chunk, *args, **kwargs):
+            if len(published) == 1 and not delay.failed:
+                delay.failed = True
+                raise OperationalError('Broker unavailable')
+            published.append(chunk)
+        delay.failed = False
+
+        with mock.patch.object(send_email_chunk, 'delay', side_effect=delay):
+            self.assertTrue(self.run_task().result)
+        # Each recipient is published exactly once
+        self.assertEqual(len(published), 2)
+        self.assertEqual(sorted(sum(published, [])), ['a@x.com', 'b@x.com', 'c@x.com', 'd@x.com'])
+        self.assertFalse(RecipientList.objects.filter(pk=self.recipient_list.pk).exists())
+
+    def test_final_failure_fails_the_job_and_drops_the_list(self):
+        with mock.patch.object(send_email_chunk, 'delay', side_effect=OperationalError('Broker unavailable')), \
+                mock.patch('emails_app.tasks.get_max_retries', return_value=0):
+            self.assertFalse(self.run_task().result)
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.failed), (BulkJobStatusChoices.FAILED, 4))
+        self.assertFalse(RecipientList.objects.filter(pk=self.recipient_list.pk).exists())
+
+
+class SendBulkEmailFromFileTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('client')
+        self.client_row = Client.objects.create(user=user, system_name='Test', static_ip='192.0.2.10')
+        self.api = APIClient()
+        self.api.force_authenticate(user)
+
+    def post(self, content):
+        return self.api.post(reverse('send_bulk_email_from_file'), {
+            'subject': 'Subject', 'message': 'Body', 'recipient_file': upload(content)}, format='multipart')
+
+    def test_publishes_the_list(self):
+        with mock.patch.object(send_recipient_list_task, 'delay') as delay:
+            response = self.post('a@x.com\nb@x.com\nbad\n')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['recipients']['accepted'], 2)
+        self.assertEqual(response.data['recipients']['invalid_rows'], [{'line': 3, 'value': 'bad'}])
+        self.assertEqual(delay.call_args.args[2], response.data['recipients']['recipient_list_id'])
+
+    def test_no_valid_recipients(self):
+        response = self.post('bad\n')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(RecipientList.objects.exists())
+
+    def test_failed_publish_leaves_nothing_behind(self):
+        with mock.patch.object(send_recipient_list_task, 'delay', side_effect=OperationalError('Broker unavailable')):
+            response = self.post('a@x.com\nb@x.com\n')
+        self.assertEqual(response.status_code, 500)
+        self.assertFalse(RecipientList.objects.exists())
+        self.assertEqual(BulkJob.objects.get().status, BulkJobStatusChoices.FAILED)
@@ -0,0 +1,51 @@
+from django.test import TestCase
+
+from emails_app.models import Client, EmailRecord, EmailStatusChoices
+from emails_app.records import EmailRecordBuffer
+
+
+class EmailRecordBufferTests(TestCase):
+    def setUp(self):
+        self.client_row = Client.objects.create(system_name='Test', static_ip='192.0.2.10')
+
+    def add(self, records, recipient):
+        records.add(client=self.client_row, subject='Subject', recipient=recipient,
+                    status=EmailStatusChoices.SENT)
+
+    def test_flushes_on_exit(self):
+        with EmailRecordBuffer() as records:
+            self.add(records, 'a@x.com')
+            self.add(records, 'b@x.com')
+            self.assertEqual(EmailRecord.objects.count(), 0)
+        self.assertEqual(len(records), 0)
+        self.assertEqual(EmailRecord.objects.count(), 2)
+
+    def test_flushes_when_full(self):
+        records = EmailRecordBuffer(max_size=2, max_delay=3600)
+        self.add(records, 'a@x.com')
+        self.assertEqual(EmailRecord.objects.count(), 0)
+        self.add(records, 'b@x.com')
+        self.assertEqual(EmailRecord.objects.count(), 2)
+        self.add(records, 'c@x.com')
+        self.assertEqual(len(records), 1)
+
+    def test_flushes_after_max_delay(self):
+        records = EmailRecordBuffer(max_size=100, max_delay=0)
+        self.add(records, 'a@x.com')
+        self.assertEqual(EmailRecord.objects.count(), 1)
+
+    def test_add_many_shares_fields(self):
+        with EmailRecordBuffer() as records:
+            records.add_many(['a@x.com', 'b@x.com'], client=self.client_row, subject='Subject',
+                             status=EmailStatusChoices.FAILED, error_message='Relay down')
+        self.assertEqual(
+            sorted(EmailRecord.objects.values_list('recipient', 'status', 'error_message')),
+            [('a@x.com', EmailStatusChoices.FAILED, 'Relay down'),
+             ('b@x.com', EmailStatusChoices.FAILED, 'Relay down')])
+
+    def test_flushes_when_the_block_raises(self):
+        with self.assertRaises(RuntimeError):
+            with EmailRecordBuffer() as records:
+                self.add(records, 'a@x.com')
+                raise RuntimeError('boom')
+        self.assertEqual(EmailRecord.objects.count(), 1)
@@ -0,0 +1,118 @@
+import smtplib
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from emails_app.models import SMTPSettings
+from emails_app.relay_health import (
+    NoRelayAvailable, choose_relay, get_relay_health, is_relay_available, record_relay_result,
+)
+from emails_app.relays import SMTPSettingsSnapshot, smtp_settings_cache
+from emails_app.tasks import deliver_chunk
+
+
+def snapshot(pk, weight=1):
+    return SMTPSettingsSnapshot(
+        SMTPSettings(pk=pk, host=f'smtp{pk}.example.com', port=25, weight=weight,
+                     default_from_email='noreply@example.com'), version=1)
+
+
+@override_settings(EMAIL_RELAY_FAILURE_THRESHOLD=3, EMAIL_RELAY_MAX_ERROR_RATE=0.9,
+                   EMAIL_RELAY_COOLDOWN=30, EMAIL_RELAY_COOLDOWN_MAX=100)
+class RelayHealthTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.relays = [snapshot(1, weight=3), snapshot(2), snapshot(3, weight=0)]
+        smtp_settings_cache.pin(*self.relays)
+        self.addCleanup(smtp_settings_cache.unpin)
+        clock = mock.patch('emails_app.relay_health.time.time', return_value=1000.0)
+        self.time = clock.start()
+        self.addCleanup(clock.stop)
+
+    def fail(self, relay, times=1):
+        for _ in range(times):
+            record_relay_result(relay, delivered=0, failed=1, elapsed=1.0)
+
+
+class ChooseRelayTests(RelayHealthTestCase):
+    def weights(self, **kwargs):
+        with mock.patch('emails_app.relay_health.random.choices', side_effect=lambda relays, weights: relays) as choices:
+            choose_relay(**kwargs)
+        relays, weights = choices.call_args.args[0], choices.call_args.kwargs['weights']
+        return {relay.key: round(weight, 3) for relay, weight in zip(relays, weights)}
+
+    def test_weights_by_weight_errors_and_latency(self):
+        self.assertEqual(self.weights(), {'1': 3, '2': 1})
+        record_relay_result(self.relays[0], delivered=10, failed=0, elapsed=1.0)
+        record_relay_result(self.relays[1], delivered=1, failed=1, elapsed=1.0)
+        # Relay 2 has a 0.1 error rate and takes five times as long per message
+        self.assertEqual(self.weights(), {'1': 3, '2': 0.18})
+
+    def test_exclude_and_no_relay_available(self):
+        self.assertEqual(choose_relay(exclude={'1'}).key, '2')
+        with self.assertRaises(NoRelayAvailable):
+            choose_relay(exclude={'1', '2'})
+
+
+class CooldownTests(RelayHealthTestCase):
+    def test_trips_after_consecutive_failures(self):
+        relay = self.relays[0]
+        self.fail(relay, times=2)
+        self.assertTrue(is_relay_available(relay))
+        record_relay_result(relay, delivered=1, failed=0, elapsed=0.1)
+        self.fail(relay, times=3)
+        self.assertFalse(is_relay_available(relay))
+        self.assertEqual(get_relay_health(relay)['down_until'], 1030.0)
+        self.assertEqual(choose_relay().key, '2')
+
+    def test_one_probe_after_the_cooldown(self):
+        relay = self.relays[0]
+        self.fail(relay, times=3)
+        self.time.return_value = 1030.0
+        self.assertTrue(is_relay_available(relay))
+        self.assertFalse(is_relay_available(relay))
+
+        # A successful probe puts it back in rotation
+        record_relay_result(relay, delivered=1, failed=0, elapsed=0.1)
+        health = get_relay_health(relay)
+        self.assertEqual((health['down_until'], health['failures'], health['error_rate']), (0, 0, 0.0))
+        self.assertTrue(is_relay_available(relay))
+
+    def test_failed_probes_double_the_cooldown_up_to_the_maximum(self):
+        relay = self.relays[0]
+        self.fail(relay, times=3)
+        cooldowns = []
+        for _ in range(3):
+            self.time.return_value = get_relay_health(relay)['down_until']
+            self.assertTrue(is_relay_available(relay))
+            self.fail(relay)
+            cooldowns.append(get_relay_health(relay)['cooldown'])
+        self.assertEqual(cooldowns, [60, 100, 100])
+        self.assertFalse(is_relay_available(relay))
+
+
+class DeliverChunkTests(RelayHealthTestCase):
+    def test_relay_failures_fail_over_once_per_relay(self):
+        refused = smtplib.SMTPRecipientsRefused({'b@x.com': (550, b'User unknown')})
+        calls = []
+
+        def deliver_via_relay(envelopes, client, relay, weight=None, use_async=None):
+            calls.append((relay.key, len(envelopes)))
+            if relay.key == '1':
+                return [(None, smtplib.SMTPServerDisconnected('Dropped')), (None, refused), ({}, None)]
+            return [(None, smtplib.SMTPServerDisconnected('Dropped'))] * len(envelopes)
+
+        with mock.patch('emails_app.tasks.deliver_via_relay', side_effect=deliver_via_relay), \
+                mock.patch('emails_app.relay_health.random.choices', side_effect=lambda relays, weights: relays):
+            results = deliver_chunk(['a', 'b', 'c'], client=None)
+        self.assertEqual(calls, [('1', 3), ('2', 1)])
+        self.assertIsInstance(results[0][1], smtplib.SMTPServerDisconnected)
+        self.assertEqual(results[1:], [(None, refused), ({}, None)])
+
+    def test_no_relay_available(self):
+        for relay in self.relays[:2]:
+            self.fail(relay, times=3)
+        results = deliver_chunk(['a', 'b'], client=None)
+        self.assertEqual([type(error) for _, error in results], [NoRelayAvailable] * 2)
@@ -0,0 +1,65 @@
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from emails_app.models import SMTPSettings
+from emails_app.relays import SMTPSettingsCache
+
+
+def make_relay(host='smtp.example.com', **fields):
+    return SMTPSettings(host=host, username='user', password='secret',
+                        default_from_email='noreply@example.com', **fields)
+
+
+class SMTPSettingsVersionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def save(self, relay):
+        with self.captureOnCommitCallbacks(execute=True):
+            relay.save()
+        return relay
+
+    def test_every_save_gets_a_new_version(self):
+        first = self.save(make_relay())
+        versions = [first.version, self.save(make_relay('smtp2.example.com')).version]
+        versions.append(self.save(first).version)
+        self.assertGreater(versions[0], 0)
+        self.assertEqual(versions, sorted(set(versions)))
+
+    def test_reloads_when_the_version_changes(self):
+        relay = self.save(make_relay())
+        settings_cache = SMTPSettingsCache(check_interval=0)
+        self.assertEqual(settings_cache.get().host, 'smtp.example.com')
+
+        # Rows changed without a new version are not picked up
+        SMTPSettings.objects.filter(pk=relay.pk).update(host='quiet.example.com')
+        self.assertEqual(settings_cache.get().host, 'smtp.example.com')
+
+        relay.refresh_from_db()
+        relay.host = 'smtp2.example.com'
+        self.save(relay)
+        snapshot = settings_cache.get()
+        self.assertEqual((snapshot.host, snapshot.version), ('smtp2.example.com', relay.version))
+
+    def test_checks_the_version_at_most_every_interval(self):
+        relay = self.save(make_relay())
+        settings_cache = SMTPSettingsCache(check_interval=3600)
+        settings_cache.get()
+        relay.host = 'smtp2.example.com'
+        self.save(relay)
+        self.assertEqual(settings_cache.get().host, 'smtp.example.com')
+        settings_cache.clear()
+        self.assertEqual(settings_cache.get().host, 'smtp2.example.com')
+
+    def test_inactive_relays_are_skipped(self):
+        self.save(make_relay('off.example.com', is_active=False))
+        self.save(make_relay('on.example.com'))
+        self.assertEqual([relay.host for relay in SMTPSettingsCache(check_interval=0).get_all()],
+                         ['on.example.com'])
+
+    @override_settings(DEFAULT_FROM_EMAIL='fallback@example.com')
+    def test_falls_back_to_django_settings(self):
+        snapshot = SMTPSettingsCache(check_interval=0).get()
+        self.assertEqual((snapshot.host, snapshot.key, snapshot.connection_kwargs()), (None, 'default', {}))
+        self.assertEqual(snapshot.default_from_email, 'fallback@example.com')
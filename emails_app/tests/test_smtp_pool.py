@@ -0,0 +1,73 @@
+import socket
+
+from django.test import SimpleTestCase, override_settings
+
+from emails_app.smtp_pool import SMTPConnectionPool
+from emails_app.smtp_sink import SMTPSink
+
+
+def envelope(recipient):
+    return ('sender@example.com', [recipient], b'Subject: Test\r\n\r\nBody\r\n')
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend')
+class SMTPConnectionPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.sink = SMTPSink(reject=lambda address: (550, '5.1.1 User unknown') if address.startswith('unknown') else None)
+        self.sink.start()
+        self.addCleanup(self.sink.stop)
+
+    def make_pool(self, **kwargs):
+        pool = SMTPConnectionPool(host='127.0.0.1', port=self.sink.port, use_tls=False, use_ssl=False, **kwargs)
+        self.addCleanup(pool.close)
+        return pool
+
+    def drop_idle_session(self, pool):
+        # Close the idle session's socket as if the server had dropped it
+        pool._idle[0].backend.connection.sock.shutdown(socket.SHUT_RDWR)
+
+    def test_reuses_session_across_calls(self):
+        pool = self.make_pool()
+        pool.deliver_raw([envelope('a@x.com'), envelope('b@x.com')])
+        pool.deliver_raw([envelope('c@x.com')])
+        self.assertEqual(self.sink.message_count, 3)
+        self.assertEqual(self.sink.session_count, 1)
+
+    def test_refused_message_does_not_stop_the_others(self):
+        pool = self.make_pool()
+        results = pool.deliver_raw([envelope('a@x.com'), envelope('unknown@x.com'), envelope('b@x.com')])
+        self.assertEqual([error is None for _, error in results], [True, False, True])
+        self.assertEqual(results[1][1].recipients['unknown@x.com'][0], 550)
+        self.assertEqual(self.sink.message_count, 2)
+        self.assertEqual(self.sink.session_count, 1)
+
+    def test_recycles_session_after_max_messages(self):
+        pool = self.make_pool(max_messages=2)
+        pool.deliver_raw([envelope('a@x.com'), envelope('b@x.com')])
+        pool.deliver_raw([envelope('c@x.com')])
+        self.assertEqual(self.sink.message_count, 3)
+        self.assertEqual(self.sink.session_count, 2)
+
+    def test_discards_idle_session_that_fails_noop(self):
+        pool = self.make_pool(noop_interval=0)
+        pool.deliver_raw([envelope('a@x.com')])
+        self.drop_idle_session(pool)
+        results = pool.deliver_raw([envelope('b@x.com')])
+        self.assertEqual(results, [({}, None)])
+        self.assertEqual(self.sink.session_count, 2)
+
+    def test_reconnects_once_when_session_drops_mid_send(self):
+        pool = self.make_pool(noop_interval=3600)
+        pool.deliver_raw([envelope('a@x.com')])
+        self.drop_idle_session(pool)
+        results = pool.deliver_raw([envelope('b@x.com'), envelope('c@x.com')])
+        self.assertEqual(results, [({}, None), ({}, None)])
+        self.assertEqual(self.sink.message_count, 3)
+        self.assertEqual(self.sink.session_count, 2)
+
+    def test_broken_session_is_not_returned_to_the_pool(self):
+        pool = self.make_pool()
+        with self.assertRaises(RuntimeError):
+            with pool.session():
+                raise RuntimeError('boom')
+        self.assertEqual(pool._idle, [])
@@ -0,0 +1,71 @@
+import os
+import smtplib
+from email import message_from_bytes
+
+from django.core.mail import EmailMessage
+
+from emails_app.async_delivery import quote_data
+from emails_app.smtp_sink import SMTPSink
+from emails_app.streaming import (
+    StreamingData, attach_streamed, get_stream_block_size, split_streamed, stream_sendmail,
+)
+from emails_app.tests.test_attachments import AttachmentStoreTestCase
+
+CONTENT = os.urandom(1000) + b'\n.leading dot'
+
+
+def refuse_unknown(address):
+    if address.startswith('unknown'):
+        return (550, '5.1.1 User unknown')
+    return None
+
+
+def serialize(email):
+    message = email.message()
+    message.set_boundary('BOUNDARY')
+    return message.as_bytes(linesep='\r\n')
+
+
+class StreamedAttachmentTests(AttachmentStoreTestCase):
+    def setUp(self):
+        super().setUp()
+        name, digest, _ = self.store(CONTENT, 'large.bin')
+        ref = (name, digest, 'application/octet-stream')
+        streamed_email, email = self.email(), self.email()
+        streamed = attach_streamed(streamed_email, [ref])
+        self.segments = split_streamed(serialize(streamed_email), streamed)
+        email.attach('large.bin', CONTENT, 'application/octet-stream')
+        self.expected = serialize(email)
+
+    def email(self):
+        email = EmailMessage('Subject', 'Hi\n.leading dot\n', 'sender@example.com', ['a@x.com'],
+                             headers={'Date': 'Sun, 18 Oct 2026 08:00:00 -0000', 'Message-ID': '<1@x.com>'})
+        email.attach('small.txt', b'small', 'text/plain')
+        return email
+
+    def test_blocks_match_the_message_encoded_in_memory(self):
+        for block_size in (57, 171, get_stream_block_size()):
+            self.assertEqual(b''.join(StreamingData(self.segments).blocks(block_size)),
+                             quote_data(self.expected))
+
+    def test_stream_sendmail(self):
+        sink = SMTPSink(reject=refuse_unknown)
+        sink.keep_messages = True
+        sink.start()
+        self.addCleanup(sink.stop)
+        connection = smtplib.SMTP(sink.host, sink.port, timeout=5)
+        self.addCleanup(connection.close)
+
+        refused = stream_sendmail(connection, 'sender@example.com', ['a@x.com', 'unknown@x.com'],
+                                  StreamingData(self.segments), block_size=114)
+        self.assertEqual(refused, {'unknown@x.com': (550, b'5.1.1 User unknown')})
+        self.assertEqual(sink.messages, [('<sender@example.com>', ['a@x.com'], quote_data(self.expected))])
+        attachments = [part for part in message_from_bytes(self.expected).walk()
+                       if part.get_filename() == 'large.bin']
+        self.assertEqual(attachments[0].get_payload(decode=True), CONTENT)
+
+        # Every recipient refused: nothing is sent and the session stays usable
+        with self.assertRaises(smtplib.SMTPRecipientsRefused):
+            stream_sendmail(connection, 'sender@example.com', ['unknown@x.com'], StreamingData(self.segments))
+        stream_sendmail(connection, 'sender@example.com', ['b@x.com'], StreamingData(self.segments))
+        self.assertEqual([rcpts for _, rcpts, _ in sink.messages], [['a@x.com'], ['b@x.com']])
@@ -0,0 +1,92 @@
+import smtplib
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+
+from emails_app import suppression
+from emails_app.models import Client, SuppressedRecipient
+from emails_app.suppression import (
+    SuppressionIndex, bump_suppression_generation, is_hard_bounce, suppress_bounces, suppress_recipients,
+)
+
+UNKNOWN = (550, b'5.1.1 User unknown')
+
+
+def refused(**replies):
+    return smtplib.SMTPRecipientsRefused({f'{name}@x.com': reply for name, reply in replies.items()})
+
+
+class SuppressionIndexTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.client_row = Client.objects.create(system_name='Test', static_ip='192.0.2.10')
+        self.other = Client.objects.create(system_name='Other', static_ip='192.0.2.11')
+        suppress_recipients([f'filler{number}@x.com' for number in range(100)])
+        suppress_recipients(['global@x.com'])
+        suppress_recipients([' Mine@X.com'], client_id=self.client_row.pk)
+        suppress_recipients(['theirs@x.com'], client_id=self.other.pk)
+        self.index = SuppressionIndex(check_interval=0, reload_interval=3600)
+
+    def split(self, items, **kwargs):
+        return self.index.split(self.client_row.pk, items, **kwargs)
+
+    def test_split_by_lookup_and_by_intersection(self):
+        items = ['a@x.com', 'GLOBAL@x.com ', 'mine@x.com', 'theirs@x.com']
+        for extra in (0, 100):
+            batch = items + [f'new{number}@x.com' for number in range(extra)]
+            with mock.patch('emails_app.suppression._search', wraps=suppression._search) as search:
+                allowed, suppressed = self.split(batch)
+            # Four addresses are looked up against the global list, a hundred more intersected
+            self.assertEqual(search.called, not extra)
+            self.assertEqual(allowed, ['a@x.com', 'theirs@x.com'] + batch[4:])
+            self.assertEqual(suppressed, ['GLOBAL@x.com ', 'mine@x.com'])
+
+    def test_split_rows_by_key(self):
+        rows = [{'email': 'mine@x.com'}, {'email': 'b@x.com'}]
+        self.assertEqual(self.split(rows, key=lambda row: row['email']), ([rows[1]], [rows[0]]))
+        self.assertEqual(self.split([]), ([], []))
+
+    def test_new_rows_are_merged_by_primary_key(self):
+        self.split(['a@x.com'])
+        suppress_recipients(['a@x.com'], client_id=self.client_row.pk)
+        suppress_recipients([f'bulk{number}@x.com' for number in range(1001)])
+        with mock.patch.object(self.index, '_reload') as reload:
+            self.assertEqual(self.split(['a@x.com', 'bulk1000@x.com', 'b@x.com']),
+                             (['b@x.com'], ['a@x.com', 'bulk1000@x.com']))
+        reload.assert_not_called()
+        self.assertEqual(list(self.index._scopes[None]), sorted(self.index._scopes[None]))
+
+    def test_generation_bump_reloads(self):
+        self.assertEqual(self.split(['mine@x.com'])[1], ['mine@x.com'])
+        SuppressedRecipient.objects.filter(client=self.client_row).delete()
+        # Deletions aren't merged in
+        self.assertEqual(self.split(['mine@x.com'])[1], ['mine@x.com'])
+        bump_suppression_generation()
+        self.assertEqual(self.split(['mine@x.com']), (['mine@x.com'], []))
+
+
+class HardBounceTests(SimpleTestCase):
+    def test_is_hard_bounce(self):
+        self.assertTrue(is_hard_bounce(refused(a=UNKNOWN)))
+        self.assertTrue(is_hard_bounce(refused(a=UNKNOWN, b=(550, '5.2.1 Mailbox disabled'))))
+        self.assertFalse(is_hard_bounce(refused(a=(550, b'5.7.1 Relaying denied'))))
+        self.assertFalse(is_hard_bounce(refused(a=(550, b'User unknown'))))
+        self.assertFalse(is_hard_bounce(refused(a=(450, b'4.2.2 Mailbox full'))))
+        self.assertFalse(is_hard_bounce(refused(a=UNKNOWN, b=(450, b'4.2.2 Mailbox full'))))
+        # The same reply for every recipient points at the relay
+        self.assertFalse(is_hard_bounce(refused(a=UNKNOWN, b=UNKNOWN)))
+        self.assertFalse(is_hard_bounce(smtplib.SMTPDataError(554, b'5.1.1 Rejected')))
+
+
+class SuppressBouncesTests(TestCase):
+    def test_suppresses_hard_bounces_only(self):
+        suppress_bounces(None, [('A@x.com', refused(a=UNKNOWN)),
+                                ('b@x.com', refused(b=(450, b'4.2.2 Mailbox full')))], attempted=3)
+        self.assertEqual(list(SuppressedRecipient.objects.values_list('email', flat=True)), ['a@x.com'])
+
+    def test_skips_a_delivery_that_bounced_entirely(self):
+        suppress_bounces(None, [('a@x.com', refused(a=UNKNOWN)), ('b@x.com', refused(b=UNKNOWN))],
+                         attempted=2)
+        self.assertFalse(SuppressedRecipient.objects.exists())
@@ -0,0 +1,72 @@
+from email import message_from_bytes
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+
+from emails_app.models import Client, EmailRecord, EmailStatusChoices
+from emails_app.tasks import send_templated_email_chunk
+from emails_app.templating import compile_template, render_subject, render_template
+from emails_app.tests.utils import start_sink
+
+ROWS = [{'email': 'ann@example.com', 'name': 'Ann'}, {'email': 'bob@example.com', 'name': 'Bob <b>'}]
+
+
+class TemplatingTests(SimpleTestCase):
+    def test_compiled_templates_are_cached(self):
+        compile_template.cache_clear()
+        first = compile_template('Hello {{ name }}')
+        self.assertIs(compile_template('Hello {{ name }}'), first)
+        self.assertIsNot(compile_template('Bye {{ name }}'), first)
+        self.assertEqual(compile_template.cache_info().hits, 1)
+
+    def test_render_template_escapes_only_when_asked(self):
+        self.assertEqual(render_template('Hi {{ name }}', {'name': 'Bob <b>'}), 'Hi Bob <b>')
+        self.assertEqual(render_template('Hi {{ name }}', {'name': 'Bob <b>'}, autoescape=True),
+                         'Hi Bob &lt;b&gt;')
+
+    def test_render_subject_keeps_to_one_line(self):
+        self.assertEqual(render_subject('Hi {{ name }} ', {'name': 'Ann\r\nBcc: x@y.com'}),
+                         'Hi Ann Bcc: x@y.com')
+
+    def test_missing_fields_render_empty(self):
+        self.assertEqual(render_subject('Hi {{ name }}!', {}), 'Hi !')
+
+
+class SendTemplatedEmailChunkTests(TestCase):
+    def setUp(self):
+        self.client_row = Client.objects.create(system_name='Test', static_ip='192.0.2.10')
+        self.sink = start_sink(self)
+
+    def records(self):
+        return sorted(EmailRecord.objects.values_list('recipient', 'subject', 'status'))
+
+    def test_personalises_each_message(self):
+        send_templated_email_chunk.apply(args=(
+            'Hi {{ name }}', None, ROWS, None, '<p>Dear {{ name }}</p>', self.client_row.pk))
+        messages = {rcpts[0]: message_from_bytes(data) for _, rcpts, data in self.sink.messages}
+        self.assertEqual(messages['ann@example.com']['Subject'], 'Hi Ann')
+        self.assertIn('Dear Bob &lt;b&gt;', messages['bob@example.com'].get_payload(decode=True).decode())
+        self.assertEqual(self.records(), [
+            ('ann@example.com', 'Hi Ann', EmailStatusChoices.SENT),
+            ('bob@example.com', 'Hi Bob <b>', EmailStatusChoices.SENT)])
+
+    def test_failure_records_rendered_subjects(self):
+        with mock.patch('emails_app.tasks.get_default_from_email', side_effect=RuntimeError('No sender')):
+            send_templated_email_chunk.apply(args=('Hi {{ name }}', 'Body', ROWS, None, None, self.client_row.pk))
+        self.assertEqual(self.records(), [
+            ('ann@example.com', 'Hi Ann', EmailStatusChoices.FAILED),
+            ('bob@example.com', 'Hi Bob <b>', EmailStatusChoices.FAILED)])
+
+    def test_failure_falls_back_to_the_template(self):
+        real_render_subject = render_subject
+
+        def render(source, context):
+            if context['email'] == 'bob@example.com':
+                raise ValueError('Bad merge field')
+            return real_render_subject(source, context)
+
+        with mock.patch('emails_app.tasks.render_subject', side_effect=render):
+            send_templated_email_chunk.apply(args=('Hi {{ name }}', 'Body', ROWS, None, None, self.client_row.pk))
+        self.assertEqual(self.records(), [
+            ('ann@example.com', 'Hi Ann', EmailStatusChoices.FAILED),
+            ('bob@example.com', 'Hi {{ name }}', EmailStatusChoices.FAILED)])
@@ -0,0 +1,17 @@
+from emails_app.benchmark import pin_relay
+from emails_app.smtp_sink import SMTPSink
+
+
+def start_sink(test, engine='pool', **sink_kwargs):
+    """
+    Starts a local SMTP sink that keeps the messages it receives, and points
+    delivery at it for the rest of `test`.
+    """
+    sink = SMTPSink(**sink_kwargs)
+    sink.keep_messages = True
+    sink.start()
+    test.addCleanup(sink.stop)
+    relay = pin_relay(sink.host, sink.port, engine)
+    relay.__enter__()
+    test.addCleanup(relay.__exit__, None, None, None)
+    return sink
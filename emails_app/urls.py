@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import async_views, views
 
 urlpatterns = [
     path('', views.index, name='index'),
@@ -7,4 +7,14 @@ urlpatterns = [
     path('obtain-token/', views.obtain_token, name='obtain_token'),
     path('send-single-email/', views.send_single_email, name='send_single_email'),
     path('send-bulk-email/', views.send_bulk_email, name='send_bulk_email'),
+    path('send-batch-email/', views.send_batch_email, name='send_batch_email'),
+    path('send-bulk-email-file/', views.send_bulk_email_from_file,
+         name='send_bulk_email_from_file'),
+    path('bulk-jobs/<uuid:job_id>/', views.bulk_job_status, name='bulk_job_status'),
+    path('suppressions/', views.suppressions, name='suppressions'),
+    # Non-blocking versions of the token and send endpoints for ASGI servers
+    path('async/obtain-token/', async_views.obtain_token, name='async_obtain_token'),
+    path('async/send-single-email/', async_views.send_single_email, name='async_send_single_email'),
+    path('async/send-bulk-email/', async_views.send_bulk_email, name='async_send_bulk_email'),
+    path('metrics/', views.metrics, name='metrics'),
 ]
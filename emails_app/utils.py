@@ -1,8 +1,8 @@
 
+import ipaddress
 import logging
+from functools import lru_cache
 
-import requests
-from .models import SMTPSettings
 from rest_framework.exceptions import ErrorDetail
 import string
 import secrets
@@ -12,52 +12,6 @@ from django.conf import settings
 logger = logging.getLogger("emails_app")
 
 
-def set_smtp_settings():
-    try:
-        smtp_settings = SMTPSettings.objects.get()
-        settings.EMAIL_HOST = smtp_settings.host
-        settings.EMAIL_PORT = smtp_settings.port
-        settings.EMAIL_HOST_USER = smtp_settings.username
-        settings.EMAIL_HOST_PASSWORD = smtp_settings.password
-        settings.EMAIL_USE_TLS = smtp_settings.use_tls
-        settings.EMAIL_USE_SSL = smtp_settings.use_ssl
-        settings.DEFAULT_FROM_EMAIL = smtp_settings.default_from_email
-    except SMTPSettings.DoesNotExist:
-        pass  # Handle the case where no SMTP settings are found
-    except Exception:
-        pass
-
-
-# logger = logging.getLogger(__name__)
-
-
-# def set_smtp_settings():
-#     try:
-#         smtp_settings = SMTPSettings.objects.get()
-
-#         settings.EMAIL_HOST = smtp_settings.host
-#         settings.EMAIL_PORT = smtp_settings.port
-#         settings.EMAIL_HOST_USER = smtp_settings.username
-#         settings.EMAIL_HOST_PASSWORD = smtp_settings.password
-#         settings.EMAIL_USE_TLS = smtp_settings.use_tls
-#         settings.EMAIL_USE_SSL = smtp_settings.use_ssl
-#         settings.DEFAULT_FROM_EMAIL = smtp_settings.default_from_email
-
-#         # Ensure only one of use_tls or use_ssl is enabled at a time
-#         if smtp_settings.use_tls and smtp_settings.use_ssl:
-#             logger.warning(
-#                 "Both EMAIL_USE_TLS and EMAIL_USE_SSL are set to True. This might cause configuration issues.")
-
-#         logger.info("SMTP settings successfully applied.")
-
-#     except SMTPSettings.DoesNotExist:
-#         logger.error(
-#             "No SMTP settings found. Please configure the SMTP settings in the database.")
-#     except Exception as e:
-#         logger.exception(
-#             "An unexpected error occurred while setting SMTP settings: %s", e)
-
-
 def chunk_list(data, chunk_size):
     for i in range(0, len(data), chunk_size):
         yield data[i:i + chunk_size]
@@ -78,6 +32,7 @@ class ErrorCode(Enum):
     INVALID_IP = {'code': 1001, 'message': 'Invalid IP address'}
     INVALID_REQUEST = {'code': 1002, 'message': 'Invalid request data'}
     INTERNAL_ERROR = {'code': 1003, 'message': 'Internal server error'}
+    REQUEST_IN_PROGRESS = {'code': 1004, 'message': 'A request with this idempotency key is still being processed'}
     # Add more error codes as needed
 
     def __str__(self):
@@ -160,14 +115,33 @@ def generate_unique_token():
     return token
 
 
+@lru_cache(maxsize=None)
+def get_trusted_proxies():
+    """
+    Parses `EMAIL_TRUSTED_PROXIES`, a list of proxy addresses or networks
+    whose `X-Forwarded-For` header is believed. Defaults to loopback only.
+    """
+    proxies = getattr(settings, 'EMAIL_TRUSTED_PROXIES', ['127.0.0.1', '::1'])
+    return tuple(ipaddress.ip_network(proxy, strict=False) for proxy in proxies)
+
+
+def is_trusted_proxy(ip):
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return any(address in network for network in get_trusted_proxies())
+
+
 def get_server_ip(request):
     """
     Extracts the IP address of the server making the request.
 
-    This function checks the `X-Forwarded-For` header first, which contains the original IP address 
-    of the client making the request, as passed by proxies or load balancers. If the `X-Forwarded-For` 
-    header is not present, it falls back to using the `REMOTE_ADDR` which is the IP address of the 
-    immediate sender.
+    `REMOTE_ADDR` is used unless it belongs to a trusted proxy (see
+    `EMAIL_TRUSTED_PROXIES`). In that case the `X-Forwarded-For` chain is
+    walked from the right, skipping further trusted proxies, and the first
+    untrusted address is the client. Addresses prepended by the client itself
+    are therefore never believed.
 
     Args:
         request (HttpRequest): The Django HTTP request object.
@@ -175,27 +149,13 @@ def get_server_ip(request):
     Returns:
         str: The IP address of the server making the request.
     """
-    try:
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            # Use the first IP address in the X-Forwarded-For list
-            server_ip = x_forwarded_for.split(',')[0].strip()
-        else:
-            # Fallback to REMOTE_ADDR if X-Forwarded-For is not present
-            server_ip = request.META.get('REMOTE_ADDR')
-
-        return server_ip
-    except requests.RequestException as e:
-        logger.error(f"Error fetching public IP: {e}")
-        return None
-
-
-def get_public_ip():
-    try:
-        response = requests.get('https://api.ipify.org?format=json')
-        response.raise_for_status()
-        data = response.json()
-        return data.get('ip')
-    except requests.RequestException as e:
-        logger.error(f"Error fetching public IP: {e}")
-        return None
+    remote_addr = request.META.get('REMOTE_ADDR')
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    if not x_forwarded_for or not is_trusted_proxy(remote_addr):
+        return remote_addr
+
+    forwarded = [ip.strip() for ip in x_forwarded_for.split(',') if ip.strip()]
+    for ip in reversed(forwarded):
+        if not is_trusted_proxy(ip):
+            return ip
+    return forwarded[0] if forwarded else remote_addr
@@ -11,18 +11,25 @@ from datetime import timedelta, datetime
 from django.shortcuts import get_object_or_404
 from rest_framework_simplejwt.tokens import RefreshToken
 import json
-from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.parsers import JSONParser, MultiPartParser, FormParser
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework import status
 from django_celery_beat.models import PeriodicTask, CrontabSchedule
-
-from emails_app.models import Client
-from emails_app.serializers import BulkEmailSerializer, EmailSerializer
-from emails_app.utils import ErrorCode, format_serializer_errors, get_public_ip, get_server_ip
-from .tasks import send_email_task, send_bulk_email_task, test_func
+from celery import group
+
+from emails_app.attachments import acquire_attachments, release_attachments, store_attachment
+from emails_app.clients import get_client_for_ip, get_request_client
+from emails_app.idempotency import idempotent
+from emails_app.metrics import render_prometheus, set_labels, timed
+from emails_app.models import BulkJob, RecipientList, SuppressedRecipient, TaskTypeChoices
+from emails_app.recipients import guess_file_format, ingest_recipient_file
+from emails_app.serializers import BatchEmailSerializer, BulkEmailFileSerializer, BulkEmailSerializer, BulkJobSerializer, EmailSerializer, SuppressedRecipientSerializer, SuppressionSerializer
+from emails_app.suppression import suppress_recipients, suppression_key
+from emails_app.utils import ErrorCode, format_serializer_errors, get_server_ip
+from .tasks import send_email_task, send_bulk_email_task, send_recipient_list_task, test_func
 
 from django.core.files.base import ContentFile
-from django.core.files.uploadedfile import InMemoryUploadedFile
 from django.core.files.storage import default_storage
 
 logger = logging.getLogger("emails_app")
@@ -37,11 +44,17 @@ def index(request):
 @authentication_classes([JWTAuthentication])
 @permission_classes([IsAuthenticated])
 @parser_classes([MultiPartParser, FormParser])
+@idempotent
 def send_single_email(request):
-    serializer = EmailSerializer(data=request.data)
-    client = get_object_or_404(Client, user=request.user)
-
-    if serializer.is_valid():
+    client = get_request_client(request)
+    set_labels(client=client.pk, task_type=TaskTypeChoices.SINGLE)
+    # Parsing the multipart body reads the uploaded attachments
+    with timed('request_parse'):
+        serializer = EmailSerializer(data=request.data)
+    with timed('validate'):
+        is_valid = serializer.is_valid()
+
+    if is_valid:
         subject = serializer.validated_data['subject']
         message = serializer.validated_data.get('message', None)
         recipient = serializer.validated_data['recipient']
@@ -49,35 +62,28 @@ def send_single_email(request):
         attachments = request.FILES.getlist('attachments')
         html_message = serializer.validated_data.get('html_message', None)
 
+        attached_files = []
         try:
-            # Prepare attachments in a format suitable for EmailMessage
-            attached_files = []
-            for attachment in attachments:
-                if isinstance(attachment, InMemoryUploadedFile):
-                    # Handle in-memory file objects (BytesIO or similar)
-                    file_name = attachment.name
-                    file_content = attachment.read()
-                    attached_files.append(
-                        (file_name, file_content, attachment.content_type))
-                else:
-                    # Handle regular file objects (uploaded files saved on disk)
-                    with open(attachment.temporary_file_path(), 'rb') as f:
-                        attached_files.append(
-                            (attachment.name, f.read(), attachment.content_type))
-
-            # print(attached_files)
+            # Store attachments once and pass (name, digest, content_type)
+            # references to the task instead of the file contents
+            with timed('attachment_store'):
+                attached_files = [store_attachment(attachment)
+                                  for attachment in attachments]
+                acquire_attachments(attached_files)
 
             # Call the Celery task to send the email
-            send_email_task.delay(
-                subject, message, recipient, attached_files, html_message, client.pk)
+            with timed('publish'):
+                send_email_task.delay(
+                    subject, message, recipient, attached_files, html_message, client.pk)
             success_response = {
                 "success": True,
                 'message': 'Email sending task has been initiated'
             }
             return Response(success_response, status=status.HTTP_202_ACCEPTED)
         except Exception as e:
-            # Remember to Log the errors
-            # print(str(e))
+            logger.error(f"Error initiating email: {str(e)}")
+            # The task was never published, so nothing else drops its references
+            release_attachments(attached_files)
             error_response = {
                 "success": False,
                 'code': ErrorCode.INTERNAL_ERROR.code,
@@ -100,46 +106,247 @@ def send_single_email(request):
 @authentication_classes([JWTAuthentication])
 @permission_classes([IsAuthenticated])
 @parser_classes([MultiPartParser, FormParser])
+@idempotent
 def send_bulk_email(request):
-    serializer = BulkEmailSerializer(data=request.data)
-    client = get_object_or_404(Client, user=request.user)
-
-    if serializer.is_valid():
+    client = get_request_client(request)
+    set_labels(client=client.pk, task_type=TaskTypeChoices.BULK)
+    # Parsing the multipart body reads the uploaded attachments
+    with timed('request_parse'):
+        serializer = BulkEmailSerializer(data=request.data)
+    with timed('validate'):
+        is_valid = serializer.is_valid()
+
+    if is_valid:
         subject = serializer.validated_data['subject']
         message = serializer.validated_data.get('message', None)
-        recipient_list = serializer.validated_data['recipient_list']
+        recipient_list = serializer.validated_data.get('recipient_list', [])
+        recipient_context = serializer.validated_data.get(
+            'recipient_context', None)
         attachments = request.FILES.getlist('attachments')
         html_message = serializer.validated_data.get('html_message', None)
         collective = serializer.validated_data.get('collective', False)
+        chunk_size = serializer.validated_data.get('chunk_size', None)
 
+        job = None
+        attached_files = []
         try:
-            # Prepare attachments in a format suitable for EmailMessage
-            attached_files = []
-            for attachment in attachments:
-                if isinstance(attachment, InMemoryUploadedFile):
-                    # Handle in-memory file objects (BytesIO or similar)
-                    file_name = attachment.name
-                    file_content = attachment.read()
-                    attached_files.append(
-                        (file_name, file_content, attachment.content_type))
-                else:
-                    # Handle regular file objects (uploaded files saved on disk)
-                    with open(attachment.temporary_file_path(), 'rb') as f:
-                        attached_files.append(
-                            (attachment.name, f.read(), attachment.content_type))
-
-            # print(attached_files)
+            # Store attachments once and pass (name, digest, content_type)
+            # references to the task instead of the file contents
+            with timed('attachment_store'):
+                attached_files = [store_attachment(attachment)
+                                  for attachment in attachments]
+                acquire_attachments(attached_files)
+
+            # Track progress on a BulkJob the client can poll
+            job = BulkJob.objects.create(
+                client=client, subject=subject, total=len(recipient_context or recipient_list))
 
             # Call the Celery task to send the bulk emails
-            send_bulk_email_task.delay(
-                subject, message, recipient_list, attached_files, html_message, client.pk, collective=collective)
+            with timed('publish'):
+                send_bulk_email_task.delay(
+                    subject, message, recipient_list, attached_files, html_message, client.pk, collective=collective, chunk_size=chunk_size,
+                    recipient_context=recipient_context, job_id=str(job.pk))
+
+            success_response = {
+                "success": True,
+                'message': 'Bulky email sending task has been initiated',
+                'job_id': str(job.pk),
+            }
+            return Response(success_response, status=status.HTTP_202_ACCEPTED)
+        except Exception as e:
+            logger.error(f"Error initiating bulk email: {str(e)}")
+            # The task was never published, so nothing else cleans up
+            release_attachments(attached_files)
+            BulkJob.mark_failed(job and job.pk)
+            error_response = {
+                "success": False,
+                'code': ErrorCode.INTERNAL_ERROR.code,
+                'message': ErrorCode.INTERNAL_ERROR.message,
+                'errors': []
+            }
+            return Response(error_response, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    else:
+        error_response = {
+            "success": False,
+            'code': ErrorCode.INVALID_REQUEST.code,
+            'message': ErrorCode.INVALID_REQUEST.message,
+            'errors': format_serializer_errors(serializer.errors)
+        }
+        return Response(error_response, status=status.HTTP_400_BAD_REQUEST)
+
+
+@api_view(['POST'])
+@authentication_classes([JWTAuthentication])
+@permission_classes([IsAuthenticated])
+@parser_classes([JSONParser, MultiPartParser, FormParser])
+@idempotent
+def send_batch_email(request):
+    """
+    Sends a batch of distinct messages, each with its own subject, recipient
+    and body, given as a JSON array in `messages`. Multipart requests may
+    add `attachments`, which every message carries.
+
+    Every message is validated on its own and the valid ones are published
+    together; the response says which were accepted, by position.
+    """
+    client = get_request_client(request)
+    set_labels(client=client.pk, task_type=TaskTypeChoices.SINGLE)
+    with timed('request_parse'):
+        serializer = BatchEmailSerializer(data=request.data)
+    with timed('validate'):
+        is_valid = serializer.is_valid()
+        if is_valid:
+            # One serializer validates every message, so its fields are
+            # only set up once per batch
+            message_serializer = EmailSerializer()
+            accepted = []
+            results = []
+            for index, item in enumerate(serializer.validated_data['messages']):
+                try:
+                    accepted.append(message_serializer.run_validation(item))
+                    results.append({'index': index, 'accepted': True})
+                except ValidationError as e:
+                    results.append({'index': index, 'accepted': False,
+                                    'errors': format_serializer_errors(e.detail)})
+
+    if not is_valid:
+        error_response = {
+            "success": False,
+            'code': ErrorCode.INVALID_REQUEST.code,
+            'message': ErrorCode.INVALID_REQUEST.message,
+            'errors': format_serializer_errors(serializer.errors)
+        }
+        return Response(error_response, status=status.HTTP_400_BAD_REQUEST)
+    if not accepted:
+        error_response = {
+            "success": False,
+            'code': ErrorCode.INVALID_REQUEST.code,
+            'message': ErrorCode.INVALID_REQUEST.message,
+            'errors': {'messages': ['No valid messages found.']},
+            'results': results,
+        }
+        return Response(error_response, status=status.HTTP_400_BAD_REQUEST)
+
+    attachments = request.FILES.getlist('attachments')
+    attached_files = []
+    try:
+        # Every message's task holds its own reference to the attachments
+        with timed('attachment_store'):
+            attached_files = [store_attachment(attachment)
+                              for attachment in attachments]
+            acquire_attachments(attached_files, count=len(accepted))
+
+        # A group is published over a single broker connection
+        with timed('publish'):
+            group(send_email_task.s(
+                data['subject'], data.get('message', None), data['recipient'], attached_files,
+                data.get('html_message', None), client.pk) for data in accepted).apply_async()
+    except Exception as e:
+        logger.error(f"Error initiating batch email: {str(e)}")
+        # No task was published, so nothing else drops their references
+        release_attachments(attached_files, count=len(accepted))
+        error_response = {
+            "success": False,
+            'code': ErrorCode.INTERNAL_ERROR.code,
+            'message': ErrorCode.INTERNAL_ERROR.message,
+            'errors': []
+        }
+        return Response(error_response, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    success_response = {
+        "success": True,
+        'message': 'Batch email sending tasks have been initiated',
+        'accepted': len(accepted),
+        'rejected': len(results) - len(accepted),
+        'results': results,
+    }
+    return Response(success_response, status=status.HTTP_202_ACCEPTED)
+
+
+@api_view(['POST'])
+@authentication_classes([JWTAuthentication])
+@permission_classes([IsAuthenticated])
+@parser_classes([MultiPartParser, FormParser])
+@idempotent
+def send_bulk_email_from_file(request):
+    """
+    Bulk send to the recipients in an uploaded CSV or NDJSON file. The file
+    is validated and stored row by row, so its size does not affect memory
+    use; invalid rows are reported back in the response.
+    """
+    client = get_request_client(request)
+    set_labels(client=client.pk, task_type=TaskTypeChoices.BULK)
+    # Parsing the multipart body reads the uploaded attachments
+    with timed('request_parse'):
+        serializer = BulkEmailFileSerializer(data=request.data)
+    with timed('validate'):
+        is_valid = serializer.is_valid()
+
+    if is_valid:
+        subject = serializer.validated_data['subject']
+        message = serializer.validated_data.get('message', None)
+        recipient_file = serializer.validated_data['recipient_file']
+        file_format = serializer.validated_data.get(
+            'file_format') or guess_file_format(recipient_file.name)
+        attachments = request.FILES.getlist('attachments')
+        html_message = serializer.validated_data.get('html_message', None)
+        chunk_size = serializer.validated_data.get('chunk_size', None)
+
+        recipient_list = job = None
+        attached_files = []
+        try:
+            recipient_list = RecipientList.objects.create(
+                client=client, source_name=recipient_file.name[:255])
+            with timed('recipient_ingest'):
+                recipient_list, invalid_rows = ingest_recipient_file(
+                    recipient_list, recipient_file, file_format)
+            recipients_summary = {
+                'recipient_list_id': recipient_list.pk,
+                'total_rows': recipient_list.total_rows,
+                'accepted': recipient_list.valid_count,
+                'invalid': recipient_list.invalid_count,
+                'duplicates': recipient_list.duplicate_count,
+                'invalid_rows': invalid_rows,
+            }
+
+            if not recipient_list.valid_count:
+                recipient_list.delete()
+                error_response = {
+                    "success": False,
+                    'code': ErrorCode.INVALID_REQUEST.code,
+                    'message': ErrorCode.INVALID_REQUEST.message,
+                    'errors': {'recipient_file': ['No valid recipients found.']},
+                    'recipients': recipients_summary,
+                }
+                return Response(error_response, status=status.HTTP_400_BAD_REQUEST)
+
+            with timed('attachment_store'):
+                attached_files = [store_attachment(attachment)
+                                  for attachment in attachments]
+                acquire_attachments(attached_files)
+
+            job = BulkJob.objects.create(
+                client=client, subject=subject, total=recipient_list.valid_count)
+
+            with timed('publish'):
+                send_recipient_list_task.delay(
+                    subject, message, recipient_list.pk, attached_files, html_message, client.pk, chunk_size=chunk_size,
+                    job_id=str(job.pk))
 
             success_response = {
                 "success": True,
-                'message': 'Bulky email sending task has been initiated'
+                'message': 'Bulky email sending task has been initiated',
+                'job_id': str(job.pk),
+                'recipients': recipients_summary,
             }
             return Response(success_response, status=status.HTTP_202_ACCEPTED)
         except Exception as e:
+            logger.error(f"Error initiating bulk email from file: {str(e)}")
+            if recipient_list is not None:
+                # The task was never published, so nothing else cleans up
+                RecipientList.objects.filter(pk=recipient_list.pk).delete()
+                release_attachments(attached_files)
+                BulkJob.mark_failed(job and job.pk)
             error_response = {
                 "success": False,
                 'code': ErrorCode.INTERNAL_ERROR.code,
@@ -157,19 +364,80 @@ def send_bulk_email(request):
         return Response(error_response, status=status.HTTP_400_BAD_REQUEST)
 
 
+@api_view(['GET'])
+@authentication_classes([JWTAuthentication])
+@permission_classes([IsAuthenticated])
+def bulk_job_status(request, job_id):
+    """
+    Progress of a bulk job started by the requesting client.
+    """
+    client = get_request_client(request)
+    job = get_object_or_404(BulkJob, pk=job_id, client=client)
+    return Response({
+        "success": True,
+        'job': BulkJobSerializer(job).data,
+    }, status=status.HTTP_200_OK)
+
+
+@api_view(['GET', 'POST', 'DELETE'])
+@authentication_classes([JWTAuthentication])
+@permission_classes([IsAuthenticated])
+def suppressions(request):
+    """
+    The requesting client's suppression list. GET pages through it (filter
+    with `email`, continue with `after`), POST adds `emails` with a
+    `reason` and DELETE removes them again.
+    """
+    client = get_request_client(request)
+    entries = SuppressedRecipient.objects.filter(client=client)
+
+    if request.method == 'GET':
+        page_size = getattr(settings, 'EMAIL_SUPPRESSION_PAGE_SIZE', 100)
+        email = request.query_params.get('email')
+        after = request.query_params.get('after')
+        if email:
+            entries = entries.filter(email=suppression_key(email))
+        if after and after.isdigit():
+            entries = entries.filter(pk__gt=int(after))
+        page = list(entries.order_by('pk')[:page_size])
+        return Response({
+            "success": True,
+            'suppressions': SuppressedRecipientSerializer(page, many=True).data,
+            'next_after': page[-1].pk if len(page) == page_size else None,
+        }, status=status.HTTP_200_OK)
+
+    serializer = SuppressionSerializer(data=request.data)
+    if not serializer.is_valid():
+        error_response = {
+            "success": False,
+            'code': ErrorCode.INVALID_REQUEST.code,
+            'message': ErrorCode.INVALID_REQUEST.message,
+            'errors': format_serializer_errors(serializer.errors)
+        }
+        return Response(error_response, status=status.HTTP_400_BAD_REQUEST)
+
+    emails = serializer.validated_data['emails']
+    if request.method == 'POST':
+        added = suppress_recipients(
+            emails, client_id=client.pk, reason=serializer.validated_data['reason'],
+            note=serializer.validated_data['note'])
+        return Response({"success": True, 'added': added}, status=status.HTTP_201_CREATED)
+
+    # The delete signals make every process reload its index
+    removed, _ = entries.filter(email__in=[suppression_key(email) for email in emails]).delete()
+    return Response({"success": True, 'removed': removed}, status=status.HTTP_200_OK)
+
+
 @api_view(['POST'])
 def obtain_token(request):
-    server_ip_ = get_server_ip(request)
-    server_ip = get_public_ip()
+    # Identify the client from the request itself; the static IP to client
+    # mapping is cached in memory, so this never touches the network
+    server_ip = get_server_ip(request)
     # Log the IP address
-    logger.info(f'Request Token from IP: {server_ip} ({server_ip_})')
-
-    # static_ip = request.META.get(
-    #     'HTTP_X_FORWARDED_FOR', request.META.get('REMOTE_ADDR'))
+    logger.info(f'Request Token from IP: {server_ip}')
 
-    try:
-        client = Client.objects.get(static_ip=server_ip)
-    except Client.DoesNotExist:
+    client = get_client_for_ip(server_ip)
+    if client is None or client.user is None:
         error_response = {
             "success": False,
             'code': ErrorCode.INVALID_IP.code,
@@ -201,6 +469,18 @@ def obtain_token(request):
         return Response(error_response, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+def metrics(request):
+    """
+    Delivery metrics of every web and worker process in the Prometheus text
+    format. Only served to addresses listed in `EMAIL_METRICS_ALLOWED_IPS`.
+    """
+    from django.http import HttpResponse, HttpResponseForbidden
+    allowed = getattr(settings, 'EMAIL_METRICS_ALLOWED_IPS', ['127.0.0.1', '::1'])
+    if get_server_ip(request) not in allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 @api_view(['POST'])
 def test(request):
     test_func.delay()